@@ -1,11 +1,24 @@
+import argparse
+import glob
 import gzip
 import json
 from os import path
-from statistics import quantiles
+from typing import Dict, Tuple
+import numpy as np
 import tabulate
 
+from support import deviation_columns
+from support.deviation_columns import Series
+from support.incremental_analysis import IncrementalAnalysis
+from support.quantile_sketch import TDigest
+
+Quantiles = Tuple[float, float, float]  # q99, q99.8, q99.9
+
 ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
 DEVIATIONS_PATH = path.join(ROOT_DIR, "build", "deviations.json.gz")
+COLUMNS_PATH = path.join(ROOT_DIR, "build", "deviation-columns")
+SEGMENTS_PATH = path.join(ROOT_DIR, "build", "deviations")
+STATE_PATH = path.join(ROOT_DIR, "build", "deviation-analysis-state.json")
 
 POOL_NAMES = {
     "0x0CD6f267b2086bea681E922E19D40512511BE538": "crvUSDFRAX-f",
@@ -59,39 +72,128 @@ fees = {
     "0xd632f22692FaC7611d2AA1C0D552930D43CAEd3B": 4.0,
 }
 
-with gzip.open(DEVIATIONS_PATH) as f:
-    items = [json.loads(line) for line in f]
-
-per_pool = {}
-for item in items:
-    for pool, deviations in item["deviations"].items():
-        for i, deviation in enumerate(deviations):
-            per_pool.setdefault((pool, i), [])
-            per_pool[(pool, i)].append(deviation)
-
-
-results = []
-for (pool, i), deviations in per_pool.items():
-    pool_name = POOL_NAMES[pool]
-    quantile_99 = quantiles(deviations, n=100)[98]
-    quantile_499 = quantiles(deviations, n=500)[498]
-    quantile_999 = quantiles(deviations, n=1000)[998]
-    name = f"{pool_name}[0-{i+1}]"
-    threshold = CL_DEVIATION_THRESHOLDS[name]
-    results.append(
-        [
-            name,
-            quantile_99,
-            quantile_499,
-            quantile_999,
-            threshold,
-            fees[pool],
-        ]
+
+def update_columns():
+    # (re)builds the columns when the JSON lines file is newer
+    manifest = path.join(COLUMNS_PATH, deviation_columns.MANIFEST_FILE)
+    if not path.exists(manifest) or path.getmtime(manifest) < path.getmtime(
+        DEVIATIONS_PATH
+    ):
+        deviation_columns.convert_jsonl(DEVIATIONS_PATH, COLUMNS_PATH)
+
+
+def load_from_columns() -> Dict[Series, np.ndarray]:
+    update_columns()
+    # only the deviations are needed, the blocks are not loaded
+    return {
+        series: deviation_columns.load_column(
+            COLUMNS_PATH, series, deviation_columns.DEVIATIONS
+        )
+        for series in deviation_columns.list_series(COLUMNS_PATH)
+    }
+
+
+def quantile(sorted_deviations: np.ndarray, i: int, n: int) -> float:
+    # same as `statistics.quantiles(deviations, n=n)[i - 1]` (exclusive
+    # method) on data that is already sorted
+    m = len(sorted_deviations) + 1
+    j = i * m // n
+    j = 1 if j < 1 else m - 2 if j > m - 2 else j
+    delta = i * m - j * n
+    low, high = sorted_deviations[j - 1], sorted_deviations[j]
+    return (low * (n - delta) + high * delta) / n
+
+
+def exact_quantiles() -> Dict[Series, Quantiles]:
+    result = {}
+    for series, deviations in load_from_columns().items():
+        sorted_deviations = np.sort(deviations)
+        result[series] = (
+            quantile(sorted_deviations, 99, 100),
+            quantile(sorted_deviations, 499, 500),
+            quantile(sorted_deviations, 999, 1000),
+        )
+    return result
+
+
+def stream_sketches(filename: str = DEVIATIONS_PATH) -> Dict[Series, TDigest]:
+    # reads the file line by line, memory only depends on the number of series
+    sketches: Dict[Series, TDigest] = {}
+    with gzip.open(filename, "rt") as f:
+        for line in f:
+            item = json.loads(line)
+            for pool, deviations in item["deviations"].items():
+                for i, deviation in enumerate(deviations):
+                    sketches.setdefault((pool, i), TDigest()).add(deviation)
+    return sketches
+
+
+def merge_sketches(*shards: Dict[Series, TDigest]) -> Dict[Series, TDigest]:
+    merged: Dict[Series, TDigest] = {}
+    for sketches in shards:
+        for series, sketch in sketches.items():
+            merged.setdefault(series, TDigest(sketch.compression)).merge(sketch)
+    return merged
+
+
+def sketch_quantiles(sketches: Dict[Series, TDigest]) -> Dict[Series, Quantiles]:
+    return {
+        series: (sketch.quantile(0.99), sketch.quantile(0.998), sketch.quantile(0.999))
+        for series, sketch in sketches.items()
+    }
+
+
+def print_report(per_pool: Dict[Series, Quantiles]):
+    results = []
+    for (pool, i), (quantile_99, quantile_499, quantile_999) in per_pool.items():
+        pool_name = POOL_NAMES[pool]
+        name = f"{pool_name}[0-{i+1}]"
+        threshold = CL_DEVIATION_THRESHOLDS[name]
+        results.append(
+            [
+                name,
+                quantile_99,
+                quantile_499,
+                quantile_999,
+                threshold,
+                fees[pool],
+            ]
+        )
+
+    table = tabulate.tabulate(
+        results,
+        headers=["name", "q99", "q499", "q999", "cl threshold", "fee"],
+        tablefmt="github",
     )
+    print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="estimate the quantiles with t-digests in a single pass",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="fold the lines appended to the fetched segments into saved t-digests",
+    )
+    args = parser.parse_args()
+
+    if args.incremental:
+        analysis = IncrementalAnalysis.load(STATE_PATH)
+        processed = analysis.update(glob.glob(path.join(SEGMENTS_PATH, "*.json")))
+        analysis.save(STATE_PATH)
+        print(f"{processed} new blocks, last block: {analysis.last_block}")
+        print_report(sketch_quantiles(analysis.sketches))
+    elif args.stream:
+        print_report(sketch_quantiles(stream_sketches()))
+    else:
+        print_report(exact_quantiles())
+
 
-table = tabulate.tabulate(
-    results,
-    headers=["name", "q99", "q499", "q999", "cl threshold", "fee"],
-    tablefmt="github",
-)
-print(table)
+# run from the root of the repository with `python -m scripts.analyze_deviations`
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import os
+from os import path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import tabulate
+from brownie import interface, web3  # type: ignore
+
+from scripts.fetch_deviations import (
+    BLOCK_INTERVAL,
+    CONCURRENCY,
+    END_BLOCK,
+    METADATA_BLOCK,
+    NEW_ORACLE_ADDRESS,
+    OLD_ORACLE_ADDRESS,
+    REGISTRY_CACHE_ADDRESS,
+    REQUESTS_PER_SECOND,
+    START_BLOCK,
+)
+from support.addresses import SUPPORTED_CURVE_POOLS
+from support.async_fetcher import BlockFetcher, TokenBucket
+from support.constants import NEW_ORACLE_DEPLOYMENT_BLOCK
+from support.curve_lp_oracle import (
+    CURVE_POOL_FEE_DECIMALS,
+    DEFAULT_IMBALANCE_BUFFER,
+    FEE_IMBALANCE_MULTIPLIER,
+    MAX_IMBALANCE_BUFFER,
+    NEVER_BALANCED,
+    ONE,
+    AssetType,
+    OraclePool,
+    convert_scale,
+    required_imbalance_buffers,
+)
+from support.multicall import Multicall
+from support.rpc_cache import RpcCache
+
+STATES_DIR = "build/pool-states"
+CALIBRATION_FILE = "build/imbalance-buffer-calibration.json"
+
+BPS = 10**14  # 1 bps with 18 decimals
+BUFFER_GRID = list(range(0, MAX_IMBALANCE_BUFFER + 1, 5 * BPS))
+REPORTED_BUFFERS = [0, 10 * BPS, 20 * BPS, 50 * BPS, 100 * BPS, 500 * BPS, 1000 * BPS]
+TARGET_REVERT_RATE = 0.001
+
+
+def pairs(n_coins: int) -> List[Tuple[int, int]]:
+    return [(i, j) for i in range(n_coins - 1) for j in range(i + 1, n_coins)]
+
+
+class PoolStatesFetcher:
+    """Fetches, for every block, what `ensurePoolBalanced` reads: the oracle
+    price of every coin, the pool fee and the `get_dy` quotes."""
+
+    def __init__(self, address: str, cache: RpcCache, rate_limiter: TokenBucket):
+        self.registry = interface.ICurveRegistryCache(REGISTRY_CACHE_ADDRESS)
+        self.oracles = [
+            interface.IOracle(OLD_ORACLE_ADDRESS),
+            interface.IOracle(NEW_ORACLE_ADDRESS),
+        ]
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+
+        multicall = Multicall(web3, cache=cache, rate_limiter=rate_limiter)
+        multicall.add(self.registry.coins, address)
+        multicall.add(self.registry.decimals, address)
+        multicall.add(self.registry.assetType, address)
+        coins, decimals, asset_type = multicall.execute(METADATA_BLOCK)
+        if coins is None:
+            raise ValueError(f"{address} is not registered at {METADATA_BLOCK}")
+        self.coins = list(coins)
+        self.decimals = list(decimals)
+        self.asset_type = asset_type
+        # same interfaces as `DataFetcher._get_pool_contract`
+        if asset_type == AssetType.CRYPTO:
+            self.pool = interface.ICurvePoolV2(address)
+        else:
+            self.pool = interface.ICurvePoolV1(address)
+
+    def fetch_block(self, block: int) -> Dict:
+        oracle = self.oracles[1 if block >= NEW_ORACLE_DEPLOYMENT_BLOCK else 0]
+        multicall = Multicall(web3, cache=self.cache, rate_limiter=self.rate_limiter)
+        for coin in self.coins:
+            multicall.add(oracle.getUSDPrice, coin)
+        multicall.add(self.pool.fee)
+        for i, j in pairs(len(self.coins)):
+            multicall.add(self.pool.get_dy, i, j, 10 ** self.decimals[i])
+        results = multicall.execute(block)
+        n_coins = len(self.coins)
+        return {
+            "prices": results[:n_coins],
+            "fee": results[n_coins],
+            "quotes": results[n_coins + 1 :],
+        }
+
+    async def fetch_states(self, blocks: range) -> Dict:
+        block_fetcher = BlockFetcher(self.fetch_block, CONCURRENCY)
+        states: Dict = {
+            "decimals": self.decimals,
+            "asset_type": self.asset_type,
+            "blocks": [],
+            "prices": [],
+            "fees": [],
+            "quotes": [],
+        }
+        async for block, state in block_fetcher.run(blocks):
+            states["blocks"].append(block)
+            states["prices"].append(state["prices"])
+            states["fees"].append(state["fee"])
+            states["quotes"].append(state["quotes"])
+        return states
+
+
+def states_path(pool: str) -> str:
+    return path.join(STATES_DIR, f"{pool}.json")
+
+
+def calibrate(address: str, states: Dict) -> Optional[Dict]:
+    """Revert rate of `ensurePoolBalanced` for every buffer of `BUFFER_GRID`,
+    the same buffer being set on every coin of the pool."""
+    pool = OraclePool(address, states["decimals"], states["asset_type"])
+    # blocks where the pool did not exist yet are left out, while a price or
+    # a quote that reverted makes the oracle revert whatever the buffer
+    available = [row for row, fee in enumerate(states["fees"]) if fee is not None]
+    if not available:
+        return None
+
+    prices = np.array([states["prices"][row] for row in available], dtype=object)
+    unpriced = np.array([None in row for row in prices], dtype=bool)
+    prices[unpriced] = ONE
+    fees = np.array([states["fees"][row] for row in available], dtype=object)
+    quotes = {
+        pair: np.array([states["quotes"][row][k] for row in available], dtype=object)
+        for k, pair in enumerate(pairs(pool.n_coins))
+    }
+    required = required_imbalance_buffers(pool, prices, fees, quotes)
+    required[unpriced] = NEVER_BALANCED
+    required = np.sort(required)
+
+    # a row passes iff its required buffer is at most the effective buffer
+    grid = np.array(BUFFER_GRID, dtype=object)
+    effective = np.where(grid == 0, DEFAULT_IMBALANCE_BUFFER, grid)
+    passing = np.searchsorted(required, effective, side="right")
+    revert_rates = 1 - passing / len(required)
+
+    median_fee = int(np.median(fees.astype(np.float64)))
+    fee_allowance = (
+        convert_scale(median_fee, CURVE_POOL_FEE_DECIMALS, 18)
+        * FEE_IMBALANCE_MULTIPLIER
+    )
+    return {
+        "blocks": len(available),
+        "missing_blocks": len(states["blocks"]) - len(available),
+        "reverted_blocks": int((required == NEVER_BALANCED).sum()),
+        "buffers": BUFFER_GRID,
+        "allowed_deviations": [int(buffer + fee_allowance) for buffer in effective],
+        "revert_rates": revert_rates.tolist(),
+    }
+
+
+def recommended_buffer(calibration: Dict) -> Optional[int]:
+    for buffer, rate in zip(calibration["buffers"], calibration["revert_rates"]):
+        if rate <= TARGET_REVERT_RATE:
+            return buffer
+    return None
+
+
+def report():
+    """Calibrates the buffers from the pool states saved by `main`, offline."""
+    calibrations = {}
+    for pool in SUPPORTED_CURVE_POOLS:
+        if not path.exists(states_path(pool)):
+            logging.warning("No states for %s", pool)
+            continue
+        with open(states_path(pool)) as f:
+            calibration = calibrate(pool, json.load(f))
+        if calibration is not None:
+            calibrations[pool] = calibration
+    with open(CALIBRATION_FILE, "w") as f:
+        json.dump(calibrations, f, indent=2)
+
+    results = []
+    for pool, calibration in calibrations.items():
+        rates = dict(zip(calibration["buffers"], calibration["revert_rates"]))
+        allowed = dict(zip(calibration["buffers"], calibration["allowed_deviations"]))
+        recommended = recommended_buffer(calibration)
+        results.append(
+            [pool, calibration["blocks"]]
+            + [f"{rates[buffer]:.2%}" for buffer in REPORTED_BUFFERS]
+            + [
+                "-" if recommended is None else recommended / BPS,
+                "-" if recommended is None else allowed[recommended] / BPS,
+            ]
+        )
+    headers = (
+        ["pool", "blocks"]
+        + [
+            f"revert@{buffer // BPS}bps" if buffer else "revert@default"
+            for buffer in REPORTED_BUFFERS
+        ]
+        + ["recommended (bps)", "allowed deviation (bps)"]
+    )
+    print(tabulate.tabulate(results, headers=headers, tablefmt="github"))
+
+
+def main():
+    """Fetches the missing pool states of `SUPPORTED_CURVE_POOLS` and reports
+    the revert rates for the buffer grid."""
+    os.makedirs(STATES_DIR, exist_ok=True)
+    cache = RpcCache(web3.eth.chain_id)
+    rate_limiter = TokenBucket(REQUESTS_PER_SECOND, CONCURRENCY)
+    blocks = range(START_BLOCK, END_BLOCK, BLOCK_INTERVAL)
+    for pool in SUPPORTED_CURVE_POOLS:
+        if path.exists(states_path(pool)):
+            continue
+        try:
+            fetcher = PoolStatesFetcher(pool, cache, rate_limiter)
+        except ValueError as e:
+            logging.error("Skipping %s: %s", pool, e)
+            continue
+        logging.info("Fetching states of %s", pool)
+        states = asyncio.run(fetcher.fetch_states(blocks))
+        with open(states_path(pool), "w") as f:
+            json.dump(states, f)
+    report()
@@ -0,0 +1,332 @@
+import json
+import os
+from itertools import groupby
+from os import path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import tabulate
+from brownie import CNCLockerV3, interface, web3  # type: ignore
+
+from support.cnc_locker import LockerBalances, LockerState, VoteLock
+from support.multicall import Multicall
+from support.rpc_cache import RpcCache
+from support.utils import get_mainnet_address
+from support.weight_manager import ONE
+
+LOCKER = os.environ.get("LOCKER")
+FROM_BLOCK = os.environ.get("FROM_BLOCK")
+EPOCH_BLOCKS = int(os.environ.get("EPOCH_BLOCKS", 7 * 7200))
+# operations are saved, so only blocks deep enough not to be reorged are read
+CONFIRMATIONS = int(os.environ.get("CONFIRMATIONS", 64))
+
+OUTPUT_DIR = "build/cnc-locker"
+OPERATIONS_PATH = path.join(OUTPUT_DIR, "operations.json")
+EPOCHS_PATH = path.join(OUTPUT_DIR, "epochs.json")
+LOG_BLOCK_RANGE = 100_000
+EVENTS = [
+    "Locked",
+    "Relocked",
+    "KickExecuted",
+    "UnlockExecuted",
+    "AirdropBoostClaimed",
+    "Shutdown",
+]
+
+# (block, timestamp, method of `LockerState`, arguments)
+Operation = Tuple[int, int, str, list]
+
+
+def apply(state: LockerState, operation: Operation) -> None:
+    _, timestamp, method, args = operation
+    if method == "claim_airdrop_boost":
+        state.claim_airdrop_boost(*args)
+    elif method == "shut_down":
+        state.shut_down()
+    elif method == "sync":
+        account, locks = args
+        state.sync(timestamp, account, [VoteLock(*lock) for lock in locks])
+    else:
+        getattr(state, method)(timestamp, *args)
+
+
+def call_operations(account: str, signature: str, args) -> Optional[List[Tuple]]:
+    """Operations of a direct call to the locker by `account`, None for calls
+    that cannot be replayed."""
+    if signature == "relock(uint64)":
+        return [("relock_all", [account, args[0]])]
+    if signature == "relock(uint64,uint64)":
+        return [("relock", [account, [args[0]], args[1]])]
+    if signature == "relockMultiple(uint64[],uint64)":
+        return [("relock", [account, list(args[0]), args[1]])]
+    if signature == "kick(address,uint64)":
+        return [("kick", [args[0], args[1]])]
+    if signature == "batchKick((address,uint64)[])":
+        return [("kick", [user, lock_id]) for user, lock_id in args[0]]
+    if signature in (
+        "executeAvailableUnlocks()",
+        "executeAvailableUnlocksFor(address)",
+    ):
+        return [("execute_available_unlocks", [account])]
+    if signature == "executeUnlocks(address,uint64[])":
+        return [("execute_unlocks", [account, list(args[1])])]
+    return None
+
+
+class OperationsFetcher:
+    """Turns the events of the locker into operations of `LockerState`.
+
+    Events do not tell which locks were relocked, kicked or unlocked, so these
+    are decoded from the calldata of transactions sent to the locker. When a
+    block has other transactions, for instance through a multisig, the locks
+    of every account with an event in the block are read from `userLocks` at
+    the end of the block instead.
+    """
+
+    def __init__(self, locker):
+        self.locker = locker
+        self.contract = web3.eth.contract(address=locker.address, abi=locker.abi)
+
+    def logs(self, from_block: int, to_block: int) -> list:
+        logs = []
+        for start in range(from_block, to_block + 1, LOG_BLOCK_RANGE):
+            end = min(start + LOG_BLOCK_RANGE - 1, to_block)
+            for event in EVENTS:
+                logs += self.contract.events[event].getLogs(
+                    fromBlock=start, toBlock=end
+                )
+        return sorted(logs, key=lambda log: (log.blockNumber, log.logIndex))
+
+    def transaction_operations(
+        self, logs: list, timestamp: int
+    ) -> Tuple[List[Tuple], bool]:
+        """Operations of a transaction and whether it could be replayed, which
+        is only the case for direct calls to the locker. The airdrop boost
+        used by a lock is the one of `msg.sender` of the locker, which is
+        only known for direct calls and relocks, that only the account can
+        make."""
+        tx = web3.eth.get_transaction(logs[0].transactionHash)
+        direct = tx["to"] == self.locker.address
+        sender = tx["from"]  # `msg.sender` of the locker for direct calls
+
+        operations: List[Tuple] = []
+        replayed = True
+        call_replayed = False
+        for log in logs:
+            args = log.args
+            if log.event == "AirdropBoostClaimed":
+                operations.append(("claim_airdrop_boost", [args.claimer, args.amount]))
+            elif log.event == "Shutdown":
+                operations.append(("shut_down", []))
+            elif not direct:
+                if log.event == "Locked" and args.relocked:
+                    operations.append(("claim_airdrop_boost", [args.account, ONE]))
+                replayed = False
+            elif log.event == "Locked":
+                lock_time = args.unlockTime - timestamp
+                operations.append(
+                    (
+                        "lock",
+                        [args.account, args.amount, lock_time, args.relocked, sender],
+                    )
+                )
+            elif not call_replayed:
+                # the call emits one event per lock but is replayed at once
+                signature, call_args = self.locker.decode_input(tx["input"])
+                call = call_operations(sender, signature, call_args)
+                if call is None:
+                    replayed = False
+                else:
+                    operations += call
+                    call_replayed = True
+        return operations, replayed
+
+    def block_operations(self, logs: list) -> List[Operation]:
+        """Operations of the transactions of a block, `logs` being its logs.
+
+        `userLocks` can only be read at the end of a block, so if one of its
+        transactions cannot be replayed, every account with an event in the
+        block is synced after the last transaction rather than replaying
+        any of them, which could give new locks other ids than the locker.
+        """
+        block = logs[0].blockNumber
+        timestamp = web3.eth.get_block(block).timestamp
+        operations: List[Tuple] = []
+        replayed = True
+        for _, tx_logs in groupby(logs, key=lambda log: log.transactionHash):
+            tx_operations, tx_replayed = self.transaction_operations(
+                list(tx_logs), timestamp
+            )
+            operations += tx_operations
+            replayed = replayed and tx_replayed
+
+        if not replayed:
+            synced: List[Tuple] = []
+            for method, args in operations:
+                if method == "lock":
+                    # the airdrop boost of the sender, if any, was used
+                    synced.append(("claim_airdrop_boost", [args[4], ONE]))
+                elif method in ("claim_airdrop_boost", "shut_down"):
+                    synced.append((method, args))
+            accounts = {
+                log.args.account
+                for log in logs
+                if log.event not in ("AirdropBoostClaimed", "Shutdown")
+            }
+            for account in sorted(accounts):
+                locks = self.locker.userLocks.call(account, block_identifier=block)
+                synced.append(("sync", [account, [list(lock) for lock in locks]]))
+            operations = synced
+        return [(block, timestamp, method, args) for method, args in operations]
+
+    def fetch(self, from_block: int, to_block: int) -> List[Operation]:
+        operations: List[Operation] = []
+        logs = self.logs(from_block, to_block)
+        for _, block_logs in groupby(logs, key=lambda log: log.blockNumber):
+            operations += self.block_operations(list(block_logs))
+        return operations
+
+
+def staker_boosts(
+    controller, users: List[str], block: int, cache: RpcCache
+) -> List[int]:
+    """`LpTokenStaker.getBoost` of every user, with the staker of the block."""
+    multicall = Multicall(web3, cache=cache)
+    multicall.add(controller.lpTokenStaker)
+    (staker,) = multicall.execute(block)
+    staker = interface.ILpTokenStaker(staker)
+    for user in users:
+        multicall.add(staker.getBoost, user)
+    return multicall.execute(block)
+
+
+def compute_epochs(
+    state: LockerState, controller, blocks: List[int], cache: RpcCache
+) -> List[Dict]:
+    timestamps = [web3.eth.get_block(block).timestamp for block in blocks]
+    balances = state.at(timestamps)
+    users = list(state.users)
+    staker = np.zeros(balances.rewards_boost.shape, dtype=object)
+    for row, block in enumerate(blocks):
+        locked = np.flatnonzero(balances.locked_balance[row] > 0)
+        # failed calls count as no boost
+        boosts = staker_boosts(controller, [users[i] for i in locked], block, cache)
+        staker[row, locked] = [boost or 0 for boost in boosts]
+    vote_boosts = balances.vote_boost(staker)
+
+    epochs = []
+    for row, (block, timestamp) in enumerate(zip(blocks, timestamps)):
+        locked = np.flatnonzero(balances.locked_balance[row] > 0)
+        epochs.append(
+            {
+                "block": block,
+                "timestamp": timestamp,
+                "total_locked": str(balances.total_locked[row]),
+                "total_boosted": str(balances.total_boosted[row]),
+                "users": {
+                    users[i]: {
+                        "locked": str(balances.locked_balance[row, i]),
+                        "boosted": str(balances.locked_boosted[row, i]),
+                        "rewards_boost": str(balances.rewards_boost[row, i]),
+                        "vote_boost": str(vote_boosts[row, i]),
+                    }
+                    for i in locked
+                },
+            }
+        )
+    return epochs
+
+
+def check(state: LockerState, locker, block: int) -> None:
+    """Compares the replayed state of every user with the locker at `block`."""
+    users = list(state.users)
+    multicall = Multicall(web3)
+    for user in users:
+        multicall.add(locker.userLocks, user)
+        multicall.add(locker.lockedBoosted, user)
+    results = multicall.execute(block)
+    mismatches = []
+    for user, locks, boosted in zip(users, results[::2], results[1::2]):
+        expected = [tuple(lock) for lock in locks or []]
+        if [tuple(lock) for lock in state.user_locks(user)] != expected:
+            mismatches.append(
+                [user, "userLocks", len(state.locks[user]), len(expected)]
+            )
+        if state.locked_boosted[user] != boosted:
+            mismatches.append(
+                [user, "lockedBoosted", state.locked_boosted[user], boosted]
+            )
+    print(f"{len(users)} users and {len(mismatches)} mismatches at block {block}")
+    if mismatches:
+        print(
+            tabulate.tabulate(
+                mismatches,
+                headers=["user", "view", "replayed", "locker"],
+                tablefmt="github",
+            )
+        )
+
+
+def main():
+    """Replays the locker from the saved operations and the new events, then
+    adds the balances and boosts of every user at the new epochs, one every
+    `EPOCH_BLOCKS` blocks from `FROM_BLOCK`."""
+    locker = CNCLockerV3.at(LOCKER or get_mainnet_address("CNCLockerV3"))
+    controller = interface.IController(locker.controller())
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    saved = {"from_block": None, "last_block": None, "operations": []}
+    if path.exists(OPERATIONS_PATH):
+        with open(OPERATIONS_PATH) as f:
+            saved = json.load(f)
+        assert (
+            saved["locker"] == locker.address
+        ), f"{OPERATIONS_PATH} is for another locker"
+    epochs = []
+    if path.exists(EPOCHS_PATH):
+        with open(EPOCHS_PATH) as f:
+            epochs = json.load(f)
+
+    from_block = saved["from_block"] or FROM_BLOCK
+    assert from_block, """no FROM_BLOCK env var for the first run, usage:
+FROM_BLOCK=<deployment block of the locker> brownie run scripts/cnc_locker_balances.py --network mainnet"""
+    from_block = int(from_block)
+    last_block = web3.eth.block_number - CONFIRMATIONS
+    start = saved["last_block"] + 1 if saved["last_block"] is not None else from_block
+    operations = [tuple(operation) for operation in saved["operations"]]
+    operations += OperationsFetcher(locker).fetch(start, last_block)
+    print(f"{len(operations)} operations up to block {last_block}")
+
+    state = LockerState()
+    for operation in operations:
+        apply(state, operation)
+    check(state, locker, last_block)
+
+    # epochs before `last_block` only depend on the operations before them
+    blocks = range(from_block, last_block + 1, EPOCH_BLOCKS)
+    computed = epochs[-1]["block"] if epochs else -1
+    new_blocks = [block for block in blocks if block > computed]
+    epochs += compute_epochs(state, controller, new_blocks, RpcCache(web3.eth.chain_id))
+
+    with open(OPERATIONS_PATH, "w") as f:
+        json.dump(
+            {
+                "locker": locker.address,
+                "from_block": from_block,
+                "last_block": last_block,
+                "operations": operations,
+            },
+            f,
+        )
+    with open(EPOCHS_PATH, "w") as f:
+        json.dump(epochs, f)
+    print(
+        tabulate.tabulate(
+            [
+                [epoch["block"], len(epoch["users"]), int(epoch["total_locked"]) / 1e18]
+                for epoch in epochs[len(epochs) - len(new_blocks) :]
+            ],
+            headers=["block", "lockers", "CNC locked"],
+            tablefmt="github",
+        )
+    )
+    print(f"{len(new_blocks)} new epochs written to {EPOCHS_PATH}")
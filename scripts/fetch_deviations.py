@@ -1,16 +1,36 @@
 from decimal import Decimal as D
+import asyncio
+import glob
+import gzip
 import logging
 import json
+import os
 from os import path
-from typing import Dict, List
-from brownie import CurveRegistryCache, interface  # type: ignore
+from typing import Dict, List, Optional
+from brownie import interface, web3  # type: ignore
 from dataclasses import dataclass
+from support.async_fetcher import BlockFetcher, TokenBucket
+from support.block_index import BlockIndex
+from support.constants import NEW_ORACLE_DEPLOYMENT_BLOCK
+from support.deviation_segments import read_lines, seed_segment, segment_path
+from support.multicall import Multicall
+from support.rpc_cache import RpcCache
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
 
 OUTPUT_FILE = "build/deviations.json"
-NEW_ORACLE_DEPLOYMENT_BLOCK = 17613381
+SEGMENTS_DIR = "build/deviations"
+MERGED_OUTPUT_FILE = "build/deviations.json.gz"
+START_BLOCK = 16_800_000
+END_BLOCK = 17871900
+METADATA_BLOCK = END_BLOCK
 BLOCK_INTERVAL = 3600 * 3 // 12  # 3 hours in blocks
+CONCURRENCY = 8  # blocks in flight
+REQUESTS_PER_SECOND = 10.0
+
+REGISTRY_CACHE_ADDRESS = "0x3905A3C1156f67BB55366d7A5a11D1043dcf97c9"
+NEW_ORACLE_ADDRESS = "0x286eF89cD2DA6728FD2cb3e1d1c5766Bcea344b0"
+OLD_ORACLE_ADDRESS = "0x46fa6F8CC35c1F464eA78196080f5Cfd1d76F6E9"
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -61,35 +81,105 @@ class CurvePool:
 
 
 class DataFetcher:
-    def __init__(self, registry: CurveRegistryCache, oracles: List[interface.IOracle]):
+    def __init__(
+        self,
+        registry: interface.ICurveRegistryCache,
+        oracles: List[interface.IOracle],
+        web3,
+        cache: Optional[RpcCache] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+    ):
         self.registry = registry
         self.oracles = oracles
+        # blocks can be fetched from several threads, so every fetch uses its
+        # own Multicall queue
+        self.web3 = web3
+        self.cache = cache
+        self.rate_limiter = rate_limiter
         self.curve_pools = self._fetch_curve_pools()
+        self.pool_contracts = {
+            pool.address: self._get_pool_contract(pool) for pool in self.curve_pools
+        }
 
     def _fetch_curve_pools(self) -> List[CurvePool]:
-        return [self._fetch_curve_pool(address) for address in CURVE_POOLS_ADDRESS]
+        # fetched at a fixed block so that it can be served from the cache
+        multicall = Multicall(
+            self.web3, cache=self.cache, rate_limiter=self.rate_limiter
+        )
+        addresses = list(CURVE_POOLS_ADDRESS)
+        for address in addresses:
+            multicall.add(self.registry.coins, address)
+            multicall.add(self.registry.assetType, address)
+        results = iter(multicall.execute(METADATA_BLOCK))
+        pools_meta = [(address, next(results), next(results)) for address in addresses]
+
+        for _, coin_addresses, _ in pools_meta:
+            for coin in coin_addresses:
+                multicall.add(interface.ERC20(coin).decimals)
+                multicall.add(interface.ERC20(coin).name)
+        results = iter(multicall.execute(METADATA_BLOCK))
 
-    def _fetch_curve_pool(self, address: str) -> CurvePool:
-        coin_addresses = self.registry.coins(address)
-        decimals = [interface.ERC20(coin).decimals() for coin in coin_addresses]
-        names = [interface.ERC20(coin).name() for coin in coin_addresses]
-        coins = [Coin(*args) for args in zip(coin_addresses, names, decimals)]
-        asset_type = self.registry.assetType(address)
-        return CurvePool(address, asset_type, coins)
+        curve_pools = []
+        for address, coin_addresses, asset_type in pools_meta:
+            coins = []
+            for coin_address in coin_addresses:
+                decimals, name = next(results), next(results)
+                coins.append(Coin(coin_address, name, decimals))
+            curve_pools.append(CurvePool(address, asset_type, coins))
+        return curve_pools
+
+    @staticmethod
+    def _get_pool_contract(pool: CurvePool):
+        if pool.asset_type == AssetType.CRYPTO:
+            return interface.ICurvePoolV2(pool.address)
+        return interface.ICurvePoolV1(pool.address)
 
     def fetch_all_deviations(self, block: int) -> Dict[str, List[D]]:
+        # all the prices and swap amounts of a block are fetched in one multicall
+        multicall = Multicall(
+            self.web3, cache=self.cache, rate_limiter=self.rate_limiter
+        )
+        oracle = self.get_oracle(block)
+        assets = sorted(
+            {coin.address for pool in self.curve_pools for coin in pool.coins}
+        )
+        for asset in assets:
+            multicall.add(oracle.getUSDPrice, asset)
+        for pool in self.curve_pools:
+            from_balance = 10 ** pool.coins[0].decimals
+            get_dy = self.pool_contracts[pool.address].get_dy
+            for i in range(1, len(pool.coins)):
+                multicall.add(get_dy, 0, i, from_balance)
+        results = multicall.execute(block)
+
+        prices = dict(zip(assets, results[: len(assets)]))
+        amounts_out = iter(results[len(assets) :])
         result = {}
         for pool in self.curve_pools:
+            pool_prices = [prices[coin.address] for coin in pool.coins]
+            pool_amounts_out = [next(amounts_out) for _ in pool.coins[1:]]
+            if None in pool_prices or None in pool_amounts_out:
+                logging.error(
+                    "Error fetching pool %s at block %s: call reverted",
+                    pool.address,
+                    block,
+                )
+                continue
             try:
-                result[pool.address] = self.fetch_pool_deviations(pool, block)
+                result[pool.address] = self.compute_pool_deviations(
+                    pool,
+                    [D(price) for price in pool_prices],
+                    [D(amount) for amount in pool_amounts_out],
+                )
             except Exception as e:
                 logging.error(
                     "Error fetching pool %s at block %s: %s", pool.address, block, e
                 )
         return result
 
-    def fetch_pool_deviations(self, pool: CurvePool, block: int) -> List[D]:
-        prices = self._fetch_prices(pool, block)
+    def compute_pool_deviations(
+        self, pool: CurvePool, prices: List[D], amounts_out: List[D]
+    ) -> List[D]:
         from_decimals = pool.coins[0].decimals
         from_balance = 10**from_decimals
         from_price = prices[0]
@@ -101,14 +191,7 @@ class DataFetcher:
             to_expected = self._convert_scale(
                 to_expected_unscaled, from_decimals, to_decimals
             )
-            Pool = (
-                interface.ICurvePoolV2
-                if pool.asset_type == AssetType.CRYPTO
-                else interface.ICurvePoolV1
-            )
-            to_actual = D(
-                Pool(pool.address).get_dy(0, i, from_balance, block_identifier=block)
-            )
+            to_actual = amounts_out[i - 1]
             deviation_bps = (
                 abs(to_expected - to_actual) / max(to_expected, to_actual) * 10_000
             )
@@ -124,36 +207,94 @@ class DataFetcher:
         else:
             return value * D(10 ** (to_decimals - from_decimals))
 
-    def _fetch_prices(self, pool: CurvePool, block: int) -> List[D]:
-        return [self._fetch_price(coin.address, block) for coin in pool.coins]
-
-    def _fetch_price(self, asset: str, block: int) -> D:
-        return D(self.get_oracle(block).getUSDPrice(asset, block_identifier=block))
-
     def get_oracle(self, block) -> interface.IOracle:
         if block >= NEW_ORACLE_DEPLOYMENT_BLOCK:
             return self.oracles[1]
         return self.oracles[0]
 
 
-def main():
-    registry = CurveRegistryCache.at("0x3905A3C1156f67BB55366d7A5a11D1043dcf97c9")
-    new_oracle = interface.IOracle("0x286eF89cD2DA6728FD2cb3e1d1c5766Bcea344b0")
-    old_oracle = interface.IOracle("0x46fa6F8CC35c1F464eA78196080f5Cfd1d76F6E9")
-    fetcher = DataFetcher(registry, [old_oracle, new_oracle])
+def shard_blocks(shard: int, shards: int) -> range:
+    # every shard gets a contiguous part of the block range
+    blocks = range(START_BLOCK, END_BLOCK, BLOCK_INTERVAL)
+    assert 0 <= shard < shards, "invalid shard"
+    start = len(blocks) * shard // shards
+    end = len(blocks) * (shard + 1) // shards
+    return blocks[start:end]
+
+
+async def fetch_missing_blocks(fetcher: DataFetcher, index: BlockIndex, f):
+    block_fetcher = BlockFetcher(fetcher.fetch_all_deviations, CONCURRENCY)
+    missing_blocks = (block for block in index.blocks if block not in index)
+    async for block, deviations in block_fetcher.run(missing_blocks):
+        logging.info("Fetched block %s", block)
+        encoded = json.dumps(
+            {"block": block, "deviations": deviations}, cls=DecimalEncoder
+        )
+        f.write(encoded + "\n")
+        f.flush()
+        index.add(block, f.tell())
+        index.save()
+
+
+def main(shard: str = "0", shards: str = "1"):
+    """Fetches the blocks of one shard into its own segment file, e.g.
+    `brownie run scripts/fetch_deviations.py main 2 4` for the third of four
+    shards. Segments are combined with `merge`."""
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    registry = interface.ICurveRegistryCache(REGISTRY_CACHE_ADDRESS)
+    new_oracle = interface.IOracle(NEW_ORACLE_ADDRESS)
+    old_oracle = interface.IOracle(OLD_ORACLE_ADDRESS)
+    cache = RpcCache(web3.eth.chain_id)
+    rate_limiter = TokenBucket(REQUESTS_PER_SECOND, CONCURRENCY)
+    fetcher = DataFetcher(registry, [old_oracle, new_oracle], web3, cache, rate_limiter)
+
+    blocks = shard_blocks(int(shard), int(shards))
+    output_file = segment_path(SEGMENTS_DIR, blocks)
+    seed_segment(blocks, output_file, OUTPUT_FILE)
+    index = BlockIndex.load(blocks, output_file)
+    logging.info(
+        "%s/%s blocks already fetched, contiguous until %s",
+        len(index),
+        len(blocks),
+        index.last_contiguous_block(),
+    )
+    with open(output_file, "a+") as f:
+        # terminate a line left truncated by an interrupted run, it is then
+        # skipped as invalid instead of corrupting the next one
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                f.write("\n")
+        asyncio.run(fetch_missing_blocks(fetcher, index, f))
+    logging.info("RPC cache: %s hits, %s misses", cache.hits, cache.misses)
 
-    blocks_seen = set()
+
+def merge():
+    """Merges all the segments, and the output of unsharded runs if any, into
+    a single file sorted by block."""
+    filenames = sorted(glob.glob(path.join(SEGMENTS_DIR, "*.json")))
     if path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE) as f:
-            blocks_seen = [json.loads(line)["block"] for line in f]
-    with open(OUTPUT_FILE, "a") as f:
-        for block in range(16_800_000, 17871900, BLOCK_INTERVAL):
-            if block in blocks_seen:
-                continue
-            logging.info("Fetching block %s", block)
-            deviations = fetcher.fetch_all_deviations(block)
-            encoded = json.dumps(
-                {"block": block, "deviations": deviations}, cls=DecimalEncoder
-            )
-            f.write(encoded + "\n")
-            f.flush()
+        filenames.append(OUTPUT_FILE)
+
+    lines: Dict[int, str] = {}
+    for filename in filenames:
+        for block, line in read_lines(filename):
+            if block in lines and lines[block] != line:
+                logging.warning(
+                    "Block %s differs in %s, keeping first", block, filename
+                )
+            lines.setdefault(block, line)
+
+    # written to a temporary file first so that the merged output is never
+    # left half-written
+    tmp_file = MERGED_OUTPUT_FILE + ".tmp"
+    with gzip.open(tmp_file, "wt") as f:
+        for block in sorted(lines):
+            f.write(lines[block] + "\n")
+    os.replace(tmp_file, MERGED_OUTPUT_FILE)
+    logging.info(
+        "Merged %s blocks from %s files into %s",
+        len(lines),
+        len(filenames),
+        MERGED_OUTPUT_FILE,
+    )
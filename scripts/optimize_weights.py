@@ -0,0 +1,204 @@
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+from os import path
+from typing import Dict, List
+import numpy as np
+import tabulate
+
+from scripts.analyze_deviations import (
+    CL_DEVIATION_THRESHOLDS,
+    POOL_NAMES,
+    load_from_columns,
+)
+from scripts.simulate_weights import (
+    ROOT_DIR,
+    Weights,
+    config_weights,
+    lav_weights,
+    load_omnipool_config,
+    sort_weights,
+)
+from support.deviation_columns import Series
+from support.weight_optimizer import build_objective, minimize, round_weights
+
+INPUTS_PATH = path.join(ROOT_DIR, "build", "weight-inputs.json")
+LAVS_DIR = path.join(ROOT_DIR, "config", "lavs")
+
+# price impact, as a share of the amount, of moving all the liquidity of a pool
+SLIPPAGE_FACTOR = 0.01
+# rebalancing rewards pay 5 USD per hour for every 10,000 USD of deviation
+REBALANCING_REWARD_PER_DOLLAR_PER_HOUR = 5 / 10_000
+EXPECTED_REBALANCING_HOURS = 12
+REBALANCING_COST = REBALANCING_REWARD_PER_DOLLAR_PER_HOUR * EXPECTED_REBALANCING_HOURS
+# used for the series without a numeric threshold in `CL_DEVIATION_THRESHOLDS`
+DEFAULT_DEPEG_THRESHOLD = 100
+WEIGHT_PRECISION = 10**14  # weights are multiples of 0.01%
+
+
+def depeg_risks(deviations: Dict[Series, np.ndarray]) -> Dict[str, float]:
+    """Expected loss per dollar allocated of every Curve pool (lowercase
+    address): the mean deviation beyond the Chainlink threshold of its worst
+    coin, deviations below the threshold counting as no loss."""
+    risks: Dict[str, float] = {}
+    for (pool, i), values in deviations.items():
+        threshold = CL_DEVIATION_THRESHOLDS.get(f"{POOL_NAMES[pool]}[0-{i+1}]")
+        if not isinstance(threshold, (int, float)):
+            threshold = DEFAULT_DEPEG_THRESHOLD
+        values = np.asarray(values, dtype=np.float64)
+        risk = float(np.mean(np.where(values > threshold, values, 0))) / 10_000
+        risks[pool.lower()] = max(risks.get(pool.lower(), 0.0), risk)
+    return risks
+
+
+def optimize(
+    config: Dict,
+    inputs: Dict,
+    risks: Dict[str, float],
+    current: Dict[str, Weights],
+    slippage_factor: float = SLIPPAGE_FACTOR,
+    rebalancing_cost: float = REBALANCING_COST,
+) -> Dict[str, Dict]:
+    """Optimal weights, sorted by address, of every omnipool of `inputs`,
+    together with the objective at the current and at the new weights."""
+    names = [name for name in config if name in inputs["omnipools"]]
+    liquidity = {pool.lower(): usd for pool, usd in inputs["liquidity"].items()}
+    pools = [sort_weights(current[name]) for name in names]
+    n_pools = max(len(weights) for weights in pools)
+
+    shape = (len(names), n_pools)
+    mask = np.zeros(shape, dtype=bool)
+    current_weights = np.zeros(shape)
+    pool_liquidity = np.ones(shape)
+    pool_risks = np.zeros(shape)
+    for row, (name, weights) in enumerate(zip(names, pools)):
+        known = [risks[pool.lower()] for pool, _ in weights if pool.lower() in risks]
+        for column, (pool, weight) in enumerate(weights):
+            if pool.lower() not in liquidity:
+                raise ValueError(f"no liquidity given for {pool}")
+            if pool.lower() not in risks:
+                logging.warning(
+                    "No deviations for %s, using the worst of %s", pool, name
+                )
+            mask[row, column] = True
+            current_weights[row, column] = weight / 10**18
+            pool_liquidity[row, column] = liquidity[pool.lower()]
+            pool_risks[row, column] = risks.get(pool.lower(), max(known, default=0.0))
+
+    tvl = np.array([inputs["omnipools"][name]["tvl"] for name in names])
+    objective = build_objective(
+        tvl,
+        pool_liquidity,
+        pool_risks,
+        current_weights,
+        mask,
+        slippage_factor,
+        rebalancing_cost,
+    )
+    optimal = minimize(objective)
+    costs_before = objective(current_weights)
+    rounded = np.zeros(shape)
+
+    result = {}
+    for row, (name, weights) in enumerate(zip(names, pools)):
+        # weights left unchanged by the optimum are kept as they are, so that
+        # rounding does not create deviation
+        unchanged = np.isclose(
+            optimal[row, : len(weights)], current_weights[row, : len(weights)]
+        )
+        kept = sum(weight for (_, weight), same in zip(weights, unchanged) if same)
+        new_weights = [weight for _, weight in weights]
+        if not unchanged.all():
+            changed = np.flatnonzero(~unchanged)
+            rounded_changed = round_weights(
+                optimal[row, changed], total=10**18 - kept, precision=WEIGHT_PRECISION
+            )
+            for column, weight in zip(changed, rounded_changed):
+                new_weights[column] = weight
+        rounded[row, : len(weights)] = np.array(new_weights) / 10**18
+        result[name] = {
+            "address": inputs["omnipools"][name]["address"],
+            "weights": [
+                (pool, weight) for (pool, _), weight in zip(weights, new_weights)
+            ],
+        }
+    for row, name in enumerate(names):
+        result[name]["cost_before"] = costs_before[row]
+        result[name]["cost_after"] = objective(rounded)[row]
+    return result
+
+
+def to_lav(result: Dict[str, Dict]) -> List[Dict]:
+    # format read by `encode_weights.py` through `WeightUpdate.from_dict`
+    return [
+        {
+            "address": update["address"],
+            "weights": [
+                {"poolAddress": pool, "weight": weight}
+                for pool, weight in sort_weights(update["weights"])
+            ],
+        }
+        for update in result.values()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--inputs",
+        default=INPUTS_PATH,
+        help="JSON with the address and USD TVL of every omnipool to update "
+        "and the USD liquidity of every Curve pool",
+    )
+    parser.add_argument(
+        "--current", help="LAV file with the current weights, the config otherwise"
+    )
+    parser.add_argument(
+        "--output",
+        default=path.join(LAVS_DIR, f"{dt.date.today().isoformat()}.json"),
+    )
+    parser.add_argument("--slippage-factor", type=float, default=SLIPPAGE_FACTOR)
+    parser.add_argument("--rebalancing-cost", type=float, default=REBALANCING_COST)
+    args = parser.parse_args()
+
+    config = load_omnipool_config()
+    with open(args.inputs) as f:
+        inputs = json.load(f)
+    current = {name: config_weights(omnipool) for name, omnipool in config.items()}
+    if args.current:
+        current.update(lav_weights(args.current, config))
+
+    result = optimize(
+        config,
+        inputs,
+        depeg_risks(load_from_columns()),
+        current,
+        slippage_factor=args.slippage_factor,
+        rebalancing_cost=args.rebalancing_cost,
+    )
+
+    rows = []
+    for name, update in result.items():
+        before = dict(current[name])
+        for pool, weight in update["weights"]:
+            rows.append([name, pool, before[pool] / 10**18, weight / 10**18])
+        rows.append(
+            [name, "objective (USD)", update["cost_before"], update["cost_after"]]
+        )
+    print(
+        tabulate.tabulate(
+            rows, headers=["omnipool", "pool", "current", "new"], tablefmt="github"
+        )
+    )
+
+    os.makedirs(path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(to_lav(result), f, indent=2)
+    print(f"Written to {args.output}")
+
+
+# run from the root of the repository with `python -m scripts.optimize_weights`
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import json
+import os
+from collections import defaultdict
+from os import path
+from typing import Dict, List, NamedTuple, Set, Tuple
+import numpy as np
+import tabulate
+from brownie import RewardManager, interface, web3  # type: ignore
+
+from support.addresses import CNC, CRV, CVX
+from support.multicall import Multicall
+from support.reward_manager import (
+    REWARD_KEYS,
+    AccountRewards,
+    EventKind,
+    PoolRewards,
+    Rewards,
+)
+
+POOL = os.environ.get("POOL")
+FROM_BLOCK = os.environ.get("FROM_BLOCK")
+BLOCK = os.environ.get("BLOCK")
+assert (
+    POOL and FROM_BLOCK
+), """no pool or block provided with the POOL and FROM_BLOCK env vars,
+FROM_BLOCK being the deployment block of the pool's reward manager and BLOCK the latest block by default,
+usage: POOL=0x... FROM_BLOCK=17000000 brownie run scripts/reconcile_rewards.py --network development"""
+
+OUTPUT_DIR = "build/claimable-rewards"
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+class BlockEvents(NamedTuple):
+    accounts: Set[str]  # accounts whose staked balance may have changed
+    claims: List[Tuple[str, Rewards]]
+    sold: List[int]  # CNC received for the extra rewards
+
+
+def get_logs(contract, event: str, from_block: int, to_block: int, **filters):
+    web3_contract = web3.eth.contract(address=contract.address, abi=contract.abi)
+    return web3_contract.events[event].getLogs(
+        fromBlock=from_block, toBlock=to_block, argument_filters=filters
+    )
+
+
+class RewardsReader:
+    """Reads what the `RewardManager` of a Conic pool reads, batched through
+    Multicall. Curve pools and adapters are the ones of the latest block."""
+
+    def __init__(self, conic_pool: str):
+        self.pool = interface.IConicPool(conic_pool)
+        self.reward_manager = RewardManager.at(self.pool.rewardManager())
+        controller = interface.IController(self.reward_manager.controller())
+        self.staker = interface.ILpTokenStaker(controller.lpTokenStaker())
+        self.inflation_manager = interface.IInflationManager(
+            controller.inflationManager()
+        )
+        self.convex_handler = interface.IConvexHandler(controller.convexHandler())
+        self.lp_token = interface.ILpToken(self.pool.lpToken())
+        self.curve_pools = list(self.pool.allPools())
+        self.adapters = [
+            interface.IPoolAdapter(controller.poolAdapterFor(curve_pool))
+            for curve_pool in self.curve_pools
+        ]
+        # only `balanceOf` is used, which any ERC20 ABI has
+        self.tokens = [interface.ICNCToken(token) for token in (CNC, CRV, CVX)]
+
+    def holdings(self, block: int) -> Rewards:
+        """Holdings as read by `_getHoldingsWithCliffInfo`."""
+        multicall = Multicall(web3)
+        for token in self.tokens:
+            multicall.add(token.balanceOf, self.pool.address)
+        multicall.add(self.staker.claimableCnc, self.pool.address)
+        for adapter, curve_pool in zip(self.adapters, self.curve_pools):
+            multicall.add(adapter.getCRVEarnedOnConvex, self.pool.address, curve_pool)
+        cnc, crv, cvx, claimable_cnc, *crv_earned = multicall.execute(block)
+        claimable_crv = sum(crv_earned)
+        multicall.add(self.convex_handler.computeClaimableConvex, claimable_crv)
+        (claimable_cvx,) = multicall.execute(block)
+        return cnc + claimable_cnc, crv + claimable_crv, cvx + claimable_cvx
+
+    def total_staked(self, block: int) -> int:
+        return self.staker.getBalanceForPool(self.pool.address, block_identifier=block)
+
+    def staked(self, accounts: List[str], block: int) -> List[int]:
+        multicall = Multicall(web3)
+        for account in accounts:
+            multicall.add(self.staker.getUserBalanceForPool, self.pool.address, account)
+        return multicall.execute(block)
+
+    def claimable(self, accounts: List[str], block: int) -> List[Rewards]:
+        multicall = Multicall(web3)
+        for account in accounts:
+            multicall.add(self.reward_manager.claimableRewards, account)
+        return multicall.execute(block)
+
+    def block_events(self, from_block: int, to_block: int) -> Dict[int, BlockEvents]:
+        """Events of every block where the pool was checkpointed."""
+        blocks: Dict[int, BlockEvents] = defaultdict(lambda: BlockEvents(set(), [], []))
+        ignored = {ZERO_ADDRESS, self.pool.address, self.staker.address}
+        for direction in ("to", "from"):
+            transfers = get_logs(
+                self.lp_token,
+                "Transfer",
+                from_block,
+                to_block,
+                **{direction: self.staker.address},
+            )
+            for log in transfers:
+                sender = web3.eth.get_transaction(log.transactionHash)["from"]
+                accounts = {log.args["from"], log.args["to"], sender} - ignored
+                blocks[log.blockNumber].accounts.update(accounts)
+        for log in get_logs(self.pool, "Deposit", from_block, to_block):
+            if log.blockNumber in blocks:
+                blocks[log.blockNumber].accounts.add(log.args.receiver)
+
+        rm = self.reward_manager
+        for log in get_logs(rm, "EarningsClaimed", from_block, to_block):
+            rewards = (log.args.cncEarned, log.args.crvEarned, log.args.cvxEarned)
+            blocks[log.blockNumber].claims.append((log.args.claimedBy, rewards))
+        for log in get_logs(rm, "SoldRewardTokens", from_block, to_block):
+            blocks[log.blockNumber].sold.append(log.args.targetTokenReceived)
+        # pool checkpoints without any account checkpoint
+        checkpoints = list(get_logs(rm, "ClaimedRewards", from_block, to_block))
+        checkpoints += get_logs(
+            self.inflation_manager, "PoolWeightsUpdated", from_block, to_block
+        )
+        for log in checkpoints:
+            blocks.setdefault(log.blockNumber, BlockEvents(set(), [], []))
+        return dict(sorted(blocks.items()))
+
+
+def replay(
+    reader: RewardsReader, from_block: int, to_block: int
+) -> Tuple[PoolRewards, AccountRewards, List[Tuple[str, Rewards, Rewards]]]:
+    """Replays every checkpoint of the pool from the deployment of its
+    `RewardManager` at `from_block`, and returns the state and the amounts of
+    every claim, as emitted and as replayed.
+
+    Holdings are read at the end of every block, when the contract had just
+    set its last holdings to them, so every block must hold at most one
+    checkpoint, as on a local chain mining one transaction per block.
+    """
+    pool_rewards = PoolRewards()
+    accounts: List[str] = []
+    kinds: List[int] = []
+    amounts: List[int] = []
+    integrals: List[Rewards] = []
+
+    def add(account: str, kind: int, amount: int, integral: Rewards):
+        accounts.append(account)
+        kinds.append(kind)
+        amounts.append(amount)
+        integrals.append(integral)
+
+    claims = []
+    for block, events in reader.block_events(from_block, to_block).items():
+        holdings = reader.holdings(block)
+        total_staked = reader.total_staked(block - 1)
+        candidates = sorted(events.accounts)
+        before = reader.staked(candidates, block - 1)
+        after = reader.staked(candidates, block)
+
+        # holdings when `poolCheckpoint` ran, before the claims were sent and
+        # the extra rewards sold
+        sold = sum(events.sold)
+        checkpointed = list(holdings)
+        for _, rewards in events.claims:
+            for key, amount in enumerate(rewards):
+                checkpointed[key] += amount
+        checkpointed[0] -= sold  # cnc
+        checkpoint_integrals = pool_rewards.observed_checkpoint(
+            tuple(checkpointed), total_staked
+        )
+        sold_integrals = pool_rewards.sold_reward_tokens(sold, total_staked)
+
+        for account, old, new in zip(candidates, before, after):
+            # a balance change cannot be replayed without both balances
+            assert (
+                old is not None and new is not None
+            ), f"getUserBalanceForPool reverted for {account} at block {block}"
+            if new != old:
+                kind = EventKind.STAKE if new > old else EventKind.UNSTAKE
+                add(account, kind, abs(new - old), checkpoint_integrals)
+        for account, rewards in events.claims:
+            # `claimEarnings` checkpoints the account again after selling
+            add(account, EventKind.CHECKPOINT, 0, checkpoint_integrals)
+            add(account, EventKind.CLAIM, 0, sold_integrals)
+            claims.append((account, rewards))
+        if events.claims:
+            pool_rewards.claimed(holdings)
+
+    account_rewards = AccountRewards()
+    claimed = account_rewards.fold(accounts, kinds, amounts, integrals)
+    replayed = claimed[np.array(kinds) == EventKind.CLAIM]
+    return (
+        pool_rewards,
+        account_rewards,
+        [
+            (account, emitted, tuple(int(value) for value in rewards))
+            for (account, emitted), rewards in zip(claims, replayed)
+        ],
+    )
+
+
+def main():
+    """Replays the rewards of every account of `POOL` up to `BLOCK` and checks
+    them against `claimableRewards`, writing what is claimable to a JSON file."""
+    block = int(BLOCK) if BLOCK else web3.eth.block_number
+    reader = RewardsReader(POOL)
+    pool_rewards, account_rewards, claims = replay(reader, int(FROM_BLOCK), block)
+
+    holdings = reader.holdings(block)
+    total_staked = reader.total_staked(block)
+    pool_rewards.fee_percentage = reader.reward_manager.feePercentage(
+        block_identifier=block
+    )
+    integrals = pool_rewards.pending_integrals(holdings, total_staked)
+    claimable = account_rewards.claimable(integrals)
+
+    accounts = list(account_rewards.accounts)
+    expected_staked = reader.staked(accounts, block)
+    expected = reader.claimable(accounts, block)
+    mismatches = []
+    for account, row, staked, values in zip(
+        accounts, claimable, expected_staked, expected
+    ):
+        balance = account_rewards.balances[account_rewards.accounts[account]]
+        if staked is None or balance != staked:
+            contract = "reverted" if staked is None else staked
+            mismatches.append(["staked", account, balance, contract])
+        if values is None:
+            mismatches.append(["claimable", account, tuple(row), "reverted"])
+        elif list(row) != list(values):
+            mismatches.append(["claimable", account, tuple(row), tuple(values)])
+    for account, emitted, replayed in claims:
+        if emitted != replayed:
+            mismatches.append(["claimed", account, replayed, emitted])
+    if total_staked != account_rewards.total_staked:
+        mismatches.append(
+            ["total staked", "", account_rewards.total_staked, total_staked]
+        )
+
+    print(
+        f"{len(accounts)} accounts, {len(claims)} claims and "
+        f"{len(mismatches)} mismatches at block {block}"
+    )
+    if mismatches:
+        print(
+            tabulate.tabulate(
+                mismatches,
+                headers=["check", "account", "replayed", "contract"],
+                tablefmt="github",
+            )
+        )
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output = path.join(OUTPUT_DIR, f"{POOL}-{block}.json")
+    with open(output, "w") as f:
+        json.dump(
+            {
+                account: dict(zip(REWARD_KEYS, (str(value) for value in row)))
+                for account, row in zip(accounts, claimable)
+            },
+            f,
+            indent=2,
+        )
+    print(f"Written to {output}")
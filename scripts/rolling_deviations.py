@@ -0,0 +1,189 @@
+import argparse
+from os import path
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import tabulate
+
+from scripts.analyze_deviations import (
+    CL_DEVIATION_THRESHOLDS,
+    COLUMNS_PATH,
+    POOL_NAMES,
+    ROOT_DIR,
+    update_columns,
+)
+from support import deviation_columns
+from support.constants import NEW_ORACLE_DEPLOYMENT_BLOCK
+from support.deviation_columns import Series
+
+ROLLING_PATH = path.join(ROOT_DIR, "build", "rolling-deviations.npz")
+
+BLOCKS_PER_DAY = 86400 // 12
+WINDOWS = {"7d": 7 * BLOCKS_PER_DAY, "30d": 30 * BLOCKS_PER_DAY}
+REGIME_BOUNDARIES = [NEW_ORACLE_DEPLOYMENT_BLOCK]
+# (i, n) pairs, i.e. `statistics.quantiles(data, n=n)[i - 1]`
+QUANTILES = [(99, 100), (999, 1000)]
+# maximum size of the (rows, window) matrices sorted at once
+MAX_CELLS = 1 << 24
+
+
+def sorted_quantiles(
+    sorted_rows: np.ndarray, counts: np.ndarray, quantiles=QUANTILES
+) -> np.ndarray:
+    """Same as `analyze_deviations.quantile` for every row of `sorted_rows`,
+    of which only the first `counts[row]` values are used. Rows with less
+    than two values are NaN."""
+    rows = np.arange(len(sorted_rows))
+    result = np.full((len(sorted_rows), len(quantiles)), np.nan)
+    valid = counts >= 2
+    m = counts[valid] + 1
+    for k, (i, n) in enumerate(quantiles):
+        j = np.clip(i * m // n, 1, m - 2)
+        delta = i * m - j * n
+        low = sorted_rows[rows[valid], j - 1]
+        high = sorted_rows[rows[valid], j]
+        result[valid, k] = (low * (n - delta) + high * delta) / n
+    return result
+
+
+def rolling_quantiles(
+    blocks: np.ndarray, values: np.ndarray, window: int, quantiles=QUANTILES
+) -> np.ndarray:
+    """Quantiles of the values of the `window` blocks up to and including
+    every block. `blocks` must be sorted."""
+    n_rows = len(blocks)
+    result = np.full((n_rows, len(quantiles)), np.nan)
+    if n_rows == 0:
+        return result
+
+    starts = np.searchsorted(blocks, blocks - window, side="right")
+    ends = np.arange(1, n_rows + 1)
+    counts = ends - starts
+    width = int(counts.max())
+    # windows are laid out as rows of a matrix, padded with inf so that the
+    # padding is sorted last
+    chunk = max(1, MAX_CELLS // width)
+    for start in range(0, n_rows, chunk):
+        end = min(start + chunk, n_rows)
+        indices = starts[start:end, None] + np.arange(width)
+        padded = np.where(
+            indices < ends[start:end, None],
+            values[np.minimum(indices, n_rows - 1)],
+            np.inf,
+        )
+        padded.sort(axis=1)
+        result[start:end] = sorted_quantiles(padded, counts[start:end], quantiles)
+    return result
+
+
+def regime_quantiles(
+    blocks: np.ndarray,
+    values: np.ndarray,
+    boundaries: Sequence[int] = REGIME_BOUNDARIES,
+    quantiles=QUANTILES,
+) -> List[Tuple[int, np.ndarray]]:
+    """Quantiles of the values between consecutive `boundaries`, returned with
+    the number of values of every regime."""
+    edges = np.searchsorted(blocks, boundaries)
+    result = []
+    for chunk in np.split(values, edges):
+        sorted_chunk = np.sort(chunk)[None, :]
+        counts = np.array([len(chunk)])
+        result.append(
+            (len(chunk), sorted_quantiles(sorted_chunk, counts, quantiles)[0])
+        )
+    return result
+
+
+def series_name(series: Series) -> str:
+    pool, i = series
+    return f"{POOL_NAMES[pool]}[0-{i+1}]"
+
+
+def compute_all(
+    windows: Dict[str, int] = WINDOWS,
+) -> Dict[Series, Dict[str, np.ndarray]]:
+    update_columns()
+    result = {}
+    for series in deviation_columns.list_series(COLUMNS_PATH):
+        blocks, deviations = deviation_columns.load_series(COLUMNS_PATH, series)
+        result[series] = {"blocks": np.asarray(blocks)}
+        for window_name, window in windows.items():
+            result[series][window_name] = rolling_quantiles(blocks, deviations, window)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help=f"save the rolling quantiles to {ROLLING_PATH}",
+    )
+    args = parser.parse_args()
+
+    rolling = compute_all()
+
+    summary = []
+    for series, columns in rolling.items():
+        name = series_name(series)
+        threshold = CL_DEVIATION_THRESHOLDS[name]
+        for window_name in WINDOWS:
+            q99, q999 = columns[window_name].T
+            above = (
+                np.mean(q999[~np.isnan(q999)] > threshold)
+                if isinstance(threshold, (int, float))
+                else np.nan
+            )
+            summary.append(
+                [
+                    name,
+                    window_name,
+                    np.nanmax(q99),
+                    np.nanmax(q999),
+                    np.nanmedian(q999),
+                    threshold,
+                    above,
+                ]
+            )
+    print(
+        tabulate.tabulate(
+            summary,
+            headers=[
+                "name",
+                "window",
+                "max q99",
+                "max q999",
+                "median q999",
+                "cl threshold",
+                "time above",
+            ],
+            tablefmt="github",
+        )
+    )
+    print()
+
+    regimes = []
+    for series in rolling:
+        blocks, deviations = deviation_columns.load_series(COLUMNS_PATH, series)
+        name = series_name(series)
+        for k, (count, (q99, q999)) in enumerate(regime_quantiles(blocks, deviations)):
+            regimes.append([name, k, count, q99, q999, CL_DEVIATION_THRESHOLDS[name]])
+    print(
+        tabulate.tabulate(
+            regimes,
+            headers=["name", "regime", "count", "q99", "q999", "cl threshold"],
+            tablefmt="github",
+        )
+    )
+
+    if args.save:
+        arrays = {}
+        for (pool, i), columns in rolling.items():
+            for column, values in columns.items():
+                arrays[f"{pool}-{i}.{column}"] = values
+        np.savez(ROLLING_PATH, **arrays)
+
+
+# run from the root of the repository with `python -m scripts.rolling_deviations`
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from typing import Dict, List
+import numpy as np
+import tabulate
+
+from scripts.simulate_weights import (
+    ROOT_DIR,
+    Weights,
+    config_weights,
+    create_manager,
+    load_omnipool_config,
+    sample_flows,
+    sort_weights,
+)
+from support.rebalancing_rewards import (
+    compute_rebalancing_rewards,
+    distribute_rebalancing_rewards,
+)
+from support.weight_manager import ONE, OmnipoolSimulation
+
+REWARDS_PATH = path.join(ROOT_DIR, "build", "rebalancing-rewards.npz")
+
+SCENARIOS = 16  # weight update sequences sampled per omnipool
+PATHS = 256  # deposit flows simulated per scenario
+WEEKS = 4
+TVL_USD = 10_000_000  # for every omnipool
+
+STEP = 3600
+STEPS_PER_WEEK = 7 * 86400 // STEP
+# every hour, a flow happens with `FLOW_PROBABILITY` and has a median size of
+# `HOURLY_FLOW` of the TVL
+FLOW_PROBABILITY = 0.2
+HOURLY_FLOW = 0.002
+# weekly weights are drawn from a Dirichlet distribution centered on the
+# weights of the config, higher concentrations giving smaller updates
+WEIGHT_CONCENTRATION = 200
+PERCENTILES = [5, 50, 95, 99]
+
+
+def sample_weights(
+    rng: np.random.Generator, weights: Weights, concentration: float
+) -> Weights:
+    pools = [pool for pool, _ in weights]
+    mean = np.array([weight / ONE for _, weight in weights])
+    sampled = rng.dirichlet(concentration * mean + 1e-3)
+    new_weights = [int(weight * ONE) for weight in sampled]
+    new_weights[-1] = ONE - sum(new_weights[:-1])
+    return sort_weights(list(zip(pools, new_weights)))
+
+
+def simulate_scenario(
+    name: str, omnipool: Dict, seed: int, paths: int, weeks: int, tvl_usd: int
+) -> np.ndarray:
+    """CNC minted by rebalancing rewards, shape `(paths, weeks)`, for one
+    sequence of weekly weight updates and `paths` sampled deposit flows.
+
+    Weights are updated at the start of every week, which is also when
+    rebalancing rewards are activated. Paths start balanced at the weights of
+    the config and every omnipool is capped by `MAX_REBALANCING_REWARDS` on
+    its own.
+    """
+    rng = np.random.default_rng(seed)
+    manager = create_manager(name, omnipool)
+    decimals = manager.underlying_decimals
+    tvl = tvl_usd * ONE // manager.underlying_price
+    initial = tvl * 10**decimals * manager.weights // ONE
+    simulation = OmnipoolSimulation(manager, np.tile(initial, (paths, 1)))
+    base_weights = config_weights(omnipool)
+
+    total_cnc_minted = np.zeros(paths, dtype=object)
+    minted = np.zeros((paths, weeks))
+    for week in range(weeks):
+        simulation.update_weights(
+            sample_weights(rng, base_weights, WEIGHT_CONCENTRATION)
+        )
+        flows = sample_flows(
+            rng, paths, STEPS_PER_WEEK, decimals, tvl, median_flow=HOURLY_FLOW
+        )
+        flows = np.where(rng.random(flows.shape) < FLOW_PROBABILITY, flows, 0)
+        offsets = rng.integers(0, STEP, flows.shape)
+        for step, step_flows in enumerate(flows):
+            depositing = step_flows > 0
+            result = simulation.deposit(np.where(depositing, step_flows, 0))
+            rewards = compute_rebalancing_rewards(
+                result.deviation_before,
+                result.deviation_after,
+                (step * STEP + offsets[step]).astype(object),
+                decimals,
+                manager.underlying_price,
+            )
+            step_minted = distribute_rebalancing_rewards(rewards, total_cnc_minted)
+            minted[:, week] += step_minted.astype(np.float64) / ONE
+            simulation.withdraw(np.where(depositing, 0, -step_flows))
+    return minted
+
+
+def run(
+    config: Dict,
+    scenarios: int = SCENARIOS,
+    paths: int = PATHS,
+    weeks: int = WEEKS,
+    tvl_usd: int = TVL_USD,
+    seed: int = 0,
+    workers=None,
+) -> Dict[str, np.ndarray]:
+    """Weekly CNC minted per omnipool, shape `(scenarios * paths, weeks)`.
+    Scenarios are spread over a process pool, `workers=None` using one
+    process per core."""
+    seeds = np.random.SeedSequence(seed).generate_state(len(config) * scenarios)
+    tasks = [
+        (name, omnipool, int(seeds[k * scenarios + scenario]), paths, weeks, tvl_usd)
+        for k, (name, omnipool) in enumerate(config.items())
+        for scenario in range(scenarios)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [simulate_scenario(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(simulate_scenario, *zip(*tasks)))
+
+    minted: Dict[str, List[np.ndarray]] = {name: [] for name in config}
+    for task, result in zip(tasks, results):
+        minted[task[0]].append(result)
+    return {name: np.concatenate(results) for name, results in minted.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", type=int, default=SCENARIOS)
+    parser.add_argument("--paths", type=int, default=PATHS)
+    parser.add_argument("--weeks", type=int, default=WEEKS)
+    parser.add_argument(
+        "--tvl-usd", type=int, default=TVL_USD, help="initial TVL of every omnipool"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help=f"save the weekly CNC minted of every path to {REWARDS_PATH}",
+    )
+    args = parser.parse_args()
+
+    minted = run(
+        load_omnipool_config(),
+        scenarios=args.scenarios,
+        paths=args.paths,
+        weeks=args.weeks,
+        tvl_usd=args.tvl_usd,
+        seed=args.seed,
+        workers=args.workers,
+    )
+
+    results = []
+    for name, weekly in minted.items():
+        values = weekly.ravel()
+        results.append(
+            [name, len(values), values.mean()]
+            + list(np.percentile(values, PERCENTILES))
+        )
+    print(
+        tabulate.tabulate(
+            results,
+            headers=["omnipool", "pool-weeks", "mean CNC"]
+            + [f"p{p} CNC" for p in PERCENTILES],
+            tablefmt="github",
+            floatfmt=".1f",
+        )
+    )
+
+    if args.save:
+        np.savez(REWARDS_PATH, **minted)
+
+
+# run from the root of the repository with
+# `python -m scripts.simulate_rebalancing_rewards`
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import json
+import time
+from decimal import Decimal
+from os import path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import tabulate
+
+from support.addresses import USDC, USDT
+from support.weight_manager import ONE, OmnipoolSimulation, WeightManager
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+OMNIPOOL_CONFIG_PATH = path.join(
+    ROOT_DIR, "scripts", "deployment", "omnipool-config.json"
+)
+
+UNDERLYING_DECIMALS = {USDC.lower(): 6, USDT.lower(): 6}
+# USD prices with 18 decimals, only used for pools being removed
+UNDERLYING_PRICES = {"eth": 2_000 * ONE}
+
+PATHS = 10_000
+STEPS = 50
+TVL = 10_000_000  # in underlying units, for every omnipool
+# flows are drawn as a share of the TVL of the omnipool
+MEDIAN_FLOW = 0.005
+FLOW_SIGMA = 1.5
+DEPOSIT_PROBABILITY = 0.5
+
+Weights = List[Tuple[str, int]]  # (curve pool, weight) sorted by address
+
+
+def load_omnipool_config() -> Dict:
+    with open(OMNIPOOL_CONFIG_PATH) as f:
+        return json.load(f)
+
+
+def sort_weights(weights: Weights) -> Weights:
+    # ConicPoolWeightManager.updateWeights expects the pools sorted by address
+    return sorted(weights, key=lambda x: x[0].lower())
+
+
+def config_weights(omnipool: Dict) -> Weights:
+    """Weights of the config, pools without one sharing what is left equally,
+    the last of them taking the rounding remainder."""
+    curve_pools = omnipool["curvePools"]
+    weights = {
+        pool["address"]: int(Decimal(pool["weight"]) * ONE)
+        for pool in curve_pools
+        if "weight" in pool
+    }
+    missing = [pool["address"] for pool in curve_pools if "weight" not in pool]
+    remaining = ONE - sum(weights.values())
+    for k, pool in enumerate(missing):
+        weights[pool] = remaining // len(missing)
+        if k == len(missing) - 1:
+            weights[pool] = remaining - remaining // len(missing) * k
+    return sort_weights(list(weights.items()))
+
+
+def lav_weights(lav_file: str, config: Dict) -> Dict[str, Weights]:
+    """Weights of a LAV file as read by `encode_weights.py`, keyed by the
+    omnipool of the config that has the same Curve pools."""
+    with open(lav_file) as f:
+        updates = json.load(f)
+    by_pools = {
+        frozenset(pool["address"].lower() for pool in omnipool["curvePools"]): name
+        for name, omnipool in config.items()
+    }
+    result = {}
+    for update in updates:
+        weights = [(w["poolAddress"], int(w["weight"])) for w in update["weights"]]
+        key = frozenset(pool.lower() for pool, _ in weights)
+        if key not in by_pools:
+            raise ValueError(f"no omnipool with the pools of {update['address']}")
+        result[by_pools[key]] = weights
+    return result
+
+
+def create_manager(name: str, omnipool: Dict) -> WeightManager:
+    """Weight manager of the omnipool with the weights of the config, the
+    pools being in the order in which they are added on deployment."""
+    pools = [pool["address"] for pool in omnipool["curvePools"]]
+    weights = {pool.lower(): weight for pool, weight in config_weights(omnipool)}
+    underlying = omnipool["underlying"].lower()
+    return WeightManager(
+        pools,
+        [weights[pool.lower()] for pool in pools],
+        underlying_decimals=UNDERLYING_DECIMALS.get(underlying, 18),
+        underlying_price=UNDERLYING_PRICES.get(name, ONE),
+    )
+
+
+def sample_flows(
+    rng: np.random.Generator,
+    paths: int,
+    steps: int,
+    decimals: int,
+    tvl: int,
+    median_flow: float = MEDIAN_FLOW,
+    deposit_probability: float = DEPOSIT_PROBABILITY,
+) -> np.ndarray:
+    """Signed flows of shape `(steps, paths)`, deposits being positive."""
+    sizes = tvl * median_flow * rng.lognormal(0, FLOW_SIGMA, (steps, paths))
+    signs = np.where(rng.random((steps, paths)) < deposit_probability, 1, -1)
+    # amounts are drawn with 6 decimals, enough for flows of this size
+    micro_units = np.minimum(sizes, tvl) * 10**6
+    flows = (signs * micro_units.astype(np.int64)).astype(object)
+    return flows * 10**decimals // 10**6
+
+
+def simulate(
+    manager: WeightManager,
+    new_weights: Optional[Weights],
+    paths: int,
+    steps: int,
+    tvl: int,
+    rng: np.random.Generator,
+) -> Dict:
+    """Starts every path balanced at the current weights, applies
+    `new_weights` and runs `steps` random deposits and withdrawals."""
+    decimals = manager.underlying_decimals
+    initial = tvl * 10**decimals * manager.weights // ONE
+    simulation = OmnipoolSimulation(manager, np.tile(initial, (paths, 1)))
+    if new_weights is not None:
+        simulation.update_weights(new_weights)
+    initial_deviation = simulation.total_deviation_after_weight_update.copy()
+
+    flows = sample_flows(rng, paths, steps, decimals, tvl)
+    deposit_reverts = withdraw_reverts = deposits = withdrawals = 0
+    balanced_at = np.where(simulation.is_balanced(), 0, -1)
+    for step, step_flows in enumerate(flows, start=1):
+        depositing = step_flows > 0
+        result = simulation.deposit(np.where(depositing, step_flows, 0))
+        reverted = simulation.withdraw(np.where(depositing, 0, -step_flows))
+        deposits += int(depositing.sum())
+        withdrawals += int((~depositing).sum())
+        deposit_reverts += int(result.reverted.sum())
+        withdraw_reverts += int(reverted.sum())
+        balanced_at[(balanced_at < 0) & simulation.is_balanced()] = step
+
+    final_deviation = manager.compute_total_deviation(
+        simulation.total_allocated, simulation.allocated
+    )
+    total = simulation.total_underlying.astype(np.float64)
+    # paths that withdrew everything have no deviation
+    funded = total > 0
+    return {
+        "initial_deviation": np.median(initial_deviation.astype(np.float64))
+        / (tvl * 10**decimals),
+        "final_deviation": np.median(
+            final_deviation[funded].astype(np.float64) / total[funded]
+        ),
+        "deposit_revert_rate": deposit_reverts / max(deposits, 1),
+        "withdraw_revert_rate": withdraw_reverts / max(withdrawals, 1),
+        "balanced": np.mean(balanced_at >= 0),
+        "steps_to_balance": (
+            np.median(balanced_at[balanced_at >= 0])
+            if (balanced_at >= 0).any()
+            else np.nan
+        ),
+        "convex_deposits": np.mean(simulation.convex_deposits) / steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--lav", help="LAV file, as passed to encode_weights.py, to stress-test"
+    )
+    parser.add_argument("--paths", type=int, default=PATHS)
+    parser.add_argument("--steps", type=int, default=STEPS)
+    parser.add_argument(
+        "--tvl", type=int, default=TVL, help="initial TVL in underlying units"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = load_omnipool_config()
+    new_weights = lav_weights(args.lav, config) if args.lav else {}
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for name, omnipool in config.items():
+        manager = create_manager(name, omnipool)
+        start = time.monotonic()
+        stats = simulate(
+            manager, new_weights.get(name), args.paths, args.steps, args.tvl, rng
+        )
+        elapsed = time.monotonic() - start
+        results.append(
+            [
+                name,
+                f"{stats['initial_deviation']:.2%}",
+                f"{stats['final_deviation']:.2%}",
+                f"{stats['deposit_revert_rate']:.2%}",
+                f"{stats['withdraw_revert_rate']:.2%}",
+                f"{stats['balanced']:.2%}",
+                stats["steps_to_balance"],
+                stats["convex_deposits"],
+                round(args.paths / elapsed),
+            ]
+        )
+    print(
+        tabulate.tabulate(
+            results,
+            headers=[
+                "omnipool",
+                "initial deviation",
+                "final deviation",
+                "deposit reverts",
+                "withdraw reverts",
+                "balanced",
+                "median steps to balance",
+                "convex deposits per step",
+                "paths/s",
+            ],
+            tablefmt="github",
+        )
+    )
+
+
+# run from the root of the repository with `python -m scripts.simulate_weights`
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,143 @@
-from typing import List
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional, Sequence, Tuple
 
 A_PREC = 100
 FEE_DENOMINATOR = 10**10
 RATES = [1000000000000000000, 1000000000000000000]
 PRECISION = 10**18  # The precision to convert to
 N_COINS = 2
+D_CACHE_SIZE = 256
+# relative change of sum(xp) below which the last D is used as initial guess
+WARM_START_MAX_CHANGE = 100  # 1 / 100 = 1%
+
+
+def rates_from_decimals(decimals: Sequence[int]) -> List[int]:
+    # same as Curve's RATES: scales every coin to 18 decimals
+    return [PRECISION * 10 ** (18 - d) for d in decimals]
+
+
+@dataclass
+class DCacheStats:
+    hits: int = 0
+    misses: int = 0
+    warm_starts: int = 0
+    iterations: int = 0
+
+    def reset(self) -> None:
+        self.hits = self.misses = self.warm_starts = self.iterations = 0
+
+
+class DyQuote(NamedTuple):
+    dx: int
+    dy: int
+    price: int  # dy / dx, both scaled to 18 decimals, with 18 decimals
+    fee: int  # in coin j
 
 
 class CurvePool:
-    def __init__(self, _A: int) -> None:
+    def __init__(
+        self,
+        _A: int,
+        rates: Sequence[int] = RATES,
+        d_cache_size: int = D_CACHE_SIZE,
+        warm_start: bool = False,
+    ) -> None:
+        assert len(rates) >= 2, "at least two coins are required"
+        # D is memoized per (xp, Ann) in a LRU of at most d_cache_size entries
+        # NOTE: warm-starting Newton from the last D can converge to a value
+        # 1 wei away from the one the contract would compute, so it is opt-in
+        self.d_cache_size = d_cache_size
+        self.warm_start = warm_start
+        self.d_cache_stats = DCacheStats()
+        self._d_cache: "OrderedDict[Tuple[Tuple[int, ...], int], int]" = OrderedDict()
+        self._last_D: Optional[Tuple[int, int, int]] = None  # (Ann, S, D)
+        self.n_coins = len(rates)
+        self.rates = tuple(rates)
         self.A = _A * A_PREC
-        self.balances = [0, 0]
+        self.balances = [0] * self.n_coins
         self.token_supply = 0
         self.fee = 0
         self.admin_fee = 0
 
-    def _xp(self) -> List[int]:
-        result = RATES.copy()
-        for i in range(N_COINS):
-            result[i] = result[i] * self.balances[i] // PRECISION
-        return result
+    @classmethod
+    def from_decimals(cls, _A: int, decimals: Sequence[int], **kwargs) -> "CurvePool":
+        return cls(_A, rates_from_decimals(decimals), **kwargs)
+
+    # NOTE: the setters below precompute everything that only depends on the
+    # state they change so that get_D/get_dy do not recompute it on every call
+
+    @property
+    def A(self) -> int:
+        return self._A
+
+    @A.setter
+    def A(self, value: int) -> None:
+        self._A = value
+        self.Ann = value * self.n_coins
+
+    @property
+    def fee(self) -> int:
+        return self._fee
+
+    @fee.setter
+    def fee(self, value: int) -> None:
+        self._fee = value
+        # fee charged on imbalanced deposits
+        self.imbalance_fee = value * self.n_coins // (4 * (self.n_coins - 1))
+
+    @property
+    def balances(self) -> Tuple[int, ...]:
+        return self._balances
+
+    @balances.setter
+    def balances(self, value: Sequence[int]) -> None:
+        assert len(value) == self.n_coins, "wrong number of balances"
+        self._balances = tuple(value)
+        self._xp_cached = self._xp_mem(self._balances)
+
+    def _xp(self) -> Tuple[int, ...]:
+        return self._xp_cached
+
+    def _xp_mem(self, _balances: Sequence[int]) -> Tuple[int, ...]:
+        return tuple(
+            rate * balance // PRECISION for rate, balance in zip(self.rates, _balances)
+        )
+
+    def get_D(self, _xp: Sequence[int], _amp: int) -> int:
+        return self._get_D(_xp, _amp * self.n_coins)
+
+    def _get_D(self, _xp: Sequence[int], Ann: int) -> int:
+        key = (tuple(_xp), Ann)
+        D = self._d_cache.get(key)
+        if D is not None:
+            self._d_cache.move_to_end(key)
+            self.d_cache_stats.hits += 1
+            return D
 
-    def _xp_mem(self, _balances: List[int]):
-        result = RATES.copy()
-        for i in range(N_COINS):
-            result[i] = result[i] * _balances[i] // PRECISION
-        return result
+        self.d_cache_stats.misses += 1
+        D = self._solve_D(key[0], Ann)
+        if self.d_cache_size > 0:
+            self._d_cache[key] = D
+            if len(self._d_cache) > self.d_cache_size:
+                self._d_cache.popitem(last=False)
+        return D
 
-    def get_D(self, _xp: List[int], _amp: int) -> int:
+    def clear_d_cache(self) -> None:
+        self._d_cache.clear()
+        self._last_D = None
+
+    def _initial_D(self, S: int, Ann: int) -> int:
+        if not self.warm_start or self._last_D is None:
+            return S
+        last_Ann, last_S, last_D = self._last_D
+        if last_Ann != Ann or abs(S - last_S) * WARM_START_MAX_CHANGE > last_S:
+            return S
+        self.d_cache_stats.warm_starts += 1
+        return last_D * S // last_S
+
+    def _solve_D(self, _xp: Sequence[int], Ann: int) -> int:
+        n_coins = self.n_coins
         S = 0
         D_prev = 0
 
@@ -36,45 +146,49 @@ class CurvePool:
         if S == 0:
             return 0
 
-        D = S
-        Ann = _amp * N_COINS
+        D = self._initial_D(S, Ann)
         for _ in range(255):
+            self.d_cache_stats.iterations += 1
             D_P = D
             for _x in _xp:
-                D_P = D_P * D // (_x * N_COINS)
+                D_P = D_P * D // (_x * n_coins)
             D_prev = D
             D = (
-                (Ann * S // A_PREC + D_P * N_COINS)
+                (Ann * S // A_PREC + D_P * n_coins)
                 * D
-                // ((Ann - A_PREC) * D // A_PREC + (N_COINS + 1) * D_P)
+                // ((Ann - A_PREC) * D // A_PREC + (n_coins + 1) * D_P)
             )
 
             if D > D_prev:
                 if D - D_prev <= 1:
-                    return D
+                    break
             else:
                 if D_prev - D <= 1:
-                    return D
-        raise
+                    break
+        else:
+            raise
+
+        self._last_D = (Ann, S, D)
+        return D
 
     def _get_D_mem(self, _balances, _amp):
         return self.get_D(self._xp_mem(_balances), _amp)
 
     def get_virtual_price(self) -> int:
-        D = self.get_D(self._xp(), self.A)
+        D = self._get_D(self._xp(), self.Ann)
         token_supply = self.token_supply
         return D * 10**18 // token_supply
 
     def calc_token_amount(self, _amounts: List[int], _is_deposit: bool) -> int:
         amp = self.A
-        balances = self.balances
-        D0 = self.get_D(balances, amp)
-        for i in range(N_COINS):
+        balances = list(self.balances)
+        D0 = self._get_D_mem(balances, amp)
+        for i in range(self.n_coins):
             if _is_deposit:
                 balances[i] += _amounts[i]
             else:
                 balances[i] -= _amounts[i]
-        D1 = self.get_D(balances, amp)
+        D1 = self._get_D_mem(balances, amp)
         token_amount = self.token_supply
         diff = 0
         if _is_deposit:
@@ -85,13 +199,13 @@ class CurvePool:
 
     def add_liquidity(self, _amounts: List[int], _min_mint_amount: int) -> int:
         amp = self.A
-        old_balances = self.balances.copy()
+        old_balances = list(self.balances)
         # Initial invariant
         D0 = self._get_D_mem(old_balances, amp)
 
         token_supply = self.token_supply
         new_balances = old_balances.copy()
-        for i in range(N_COINS):
+        for i in range(self.n_coins):
             if token_supply == 0:
                 assert _amounts[i] > 0  # dev: initial deposit requires all coins
             # balances store amounts of c-tokens
@@ -104,13 +218,14 @@ class CurvePool:
         # We need to recalculate the invariant accounting for fees
         # to calculate fair user's share
         D2 = D1
-        fees = []
         mint_amount = 0
         if token_supply > 0:
             # Only account for fees if we are not the first to deposit
-            fee = self.fee * N_COINS // (4 * (N_COINS - 1))
+            fee = self.imbalance_fee
             admin_fee = self.admin_fee
-            for i in range(N_COINS):
+            fees = [0] * self.n_coins
+            stored_balances = new_balances.copy()
+            for i in range(self.n_coins):
                 ideal_balance = D1 * old_balances[i] // D0
                 difference = 0
                 new_balance = new_balances[i]
@@ -119,10 +234,11 @@ class CurvePool:
                 else:
                     difference = new_balance - ideal_balance
                 fees[i] = fee * difference // FEE_DENOMINATOR
-                self.balances[i] = new_balance - (
+                stored_balances[i] = new_balance - (
                     fees[i] * admin_fee // FEE_DENOMINATOR
                 )
                 new_balances[i] -= fees[i]
+            self.balances = stored_balances
             D2 = self._get_D_mem(new_balances, amp)
             mint_amount = token_supply * (D2 - D0) // D0
         else:
@@ -133,24 +249,23 @@ class CurvePool:
         self.token_supply += mint_amount
         return mint_amount
 
-    def _get_y(self, i: int, j: int, x: int, _xp: List[int]) -> int:
+    def _get_y(self, i: int, j: int, x: int, _xp: Sequence[int]) -> int:
+        n_coins = self.n_coins
         assert i != j  # dev: same coin
         assert j >= 0  # dev: j below zero
-        assert j < N_COINS  # dev: j above N_COINS
+        assert j < n_coins  # dev: j above N_COINS
 
         # should be unreachable, but good for safety
         assert i >= 0
-        assert i < N_COINS
+        assert i < n_coins
 
-        A = self.A
-        D = self.get_D(_xp, A)
-        Ann = A * N_COINS
+        Ann = self.Ann
+        D = self._get_D(_xp, Ann)
         c = D
         S = 0
         _x = 0
-        y_prev = 0
 
-        for _i in range(N_COINS):
+        for _i in range(n_coins):
             if _i == i:
                 _x = x
             elif _i != j:
@@ -158,10 +273,13 @@ class CurvePool:
             else:
                 continue
             S += _x
-            c = c * D // (_x * N_COINS)
-        c = c * D * A_PREC // (Ann * N_COINS)
+            c = c * D // (_x * n_coins)
+        c = c * D * A_PREC // (Ann * n_coins)
         b = S + D * A_PREC // Ann  # - D
-        y = D
+        return self._solve_y(b, c, D, D)
+
+    def _solve_y(self, b: int, c: int, D: int, y: int) -> int:
+        y_prev = 0
         for _i in range(255):
             y_prev = y
             y = (y * y + c) // (2 * y + b - D)
@@ -176,10 +294,61 @@ class CurvePool:
 
     def get_dy(self, i: int, j: int, _dx: int) -> int:
         xp = self._xp()
-        rates = RATES
+        rates = self.rates
 
         x = xp[i] + (_dx * rates[i] // PRECISION)
         y = self._get_y(i, j, x, xp)
         dy = xp[j] - y - 1
-        fee = self.fee * dy // FEE_DENOMINATOR
+        fee = self._fee * dy // FEE_DENOMINATOR
         return (dy - fee) * PRECISION // rates[j]
+
+    def get_dy_curve(self, i: int, j: int, sizes: Sequence[int]) -> List[DyQuote]:
+        n_coins = self.n_coins
+        assert i != j  # dev: same coin
+        assert 0 <= i < n_coins and 0 <= j < n_coins
+
+        xp = self._xp()
+        rates = self.rates
+        Ann = self.Ann
+        D = self._get_D(xp, Ann)
+
+        # the part of c and S that does not depend on the input size; c is
+        # accumulated in the same order as in _get_y to get the same roundings
+        c_prefix = D
+        S_others = 0
+        for _i in range(i):
+            if _i != j:
+                S_others += xp[_i]
+                c_prefix = c_prefix * D // (xp[_i] * n_coins)
+        suffix = [xp[_i] for _i in range(i + 1, n_coins) if _i != j]
+        S_others += sum(suffix)
+        D_term = D * A_PREC // Ann
+
+        quotes = []
+        y = D
+        prev_dx = 0
+        for dx in sizes:
+            dx_xp = dx * rates[i] // PRECISION
+            x = xp[i] + dx_xp
+            c = c_prefix * D // (x * n_coins)
+            for _x in suffix:
+                c = c * D // (_x * n_coins)
+            c = c * D * A_PREC // (Ann * n_coins)
+            # y decreases with dx so, for growing sizes, the previous y is
+            # still above the solution and Newton converges from the same
+            # side as when starting from D
+            y_start = y if dx >= prev_dx else D
+            y = self._solve_y(S_others + x + D_term, c, D, y_start)
+            prev_dx = dx
+            dy = xp[j] - y - 1
+            fee = self._fee * dy // FEE_DENOMINATOR
+            price = (dy - fee) * PRECISION // dx_xp if dx_xp > 0 else 0
+            quotes.append(
+                DyQuote(
+                    dx=dx,
+                    dy=(dy - fee) * PRECISION // rates[j],
+                    price=price,
+                    fee=fee * PRECISION // rates[j],
+                )
+            )
+        return quotes
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Deque, Iterable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+CONCURRENCY = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds, doubled after every failed attempt
+BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to
+    `capacity`.
+
+    `acquire` blocks, and can be called from the threads running the fetches,
+    e.g. by `Multicall` before every request it sends.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        assert rate > 0, "rate must be positive"
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def acquire(self) -> None:
+        # waiting with the lock held makes the other threads queue behind
+        with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                time.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class BlockFetcher:
+    """Runs a blocking `fetch(block)` function for many blocks concurrently.
+
+    At most `concurrency` calls run at the same time and failed calls are
+    retried with exponential backoff. Results are yielded in the order of the
+    input blocks. A call can send any number of requests, so rate limiting is
+    left to `fetch`, which should take a token of a shared `TokenBucket` for
+    every request it sends.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[int], T],
+        concurrency: int = CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+    ):
+        assert concurrency > 0, "concurrency must be positive"
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+    async def _fetch_with_retries(
+        self,
+        block: int,
+        executor: ThreadPoolExecutor,
+        semaphore: asyncio.Semaphore,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await loop.run_in_executor(executor, self.fetch, block)
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = min(BACKOFF_MAX, self.backoff_base * 2**attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                    logging.warning(
+                        "Error fetching block %s (attempt %s): %s, retrying in %.1fs",
+                        block,
+                        attempt + 1,
+                        e,
+                        delay,
+                    )
+                    await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def run(self, blocks: Iterable[int]) -> AsyncIterator[Tuple[int, T]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # results are only yielded in order, so the number of scheduled blocks
+        # is bounded to keep a slow block from buffering the whole range
+        max_pending = 4 * self.concurrency
+        pending: Deque[Tuple[int, asyncio.Task]] = deque()
+        blocks_iter = iter(blocks)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                while True:
+                    while len(pending) < max_pending:
+                        block = next(blocks_iter, None)
+                        if block is None:
+                            break
+                        task = asyncio.ensure_future(
+                            self._fetch_with_retries(block, executor, semaphore)
+                        )
+                        pending.append((block, task))
+                    if not pending:
+                        return
+                    block, task = pending.popleft()
+                    yield block, await task
+            finally:
+                for _, task in pending:
+                    task.cancel()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from os import path
+from typing import Optional
+
+INDEX_SUFFIX = ".index"
+
+
+class BlockIndex:
+    """Bitmap of the blocks of `blocks` already written to a JSON lines output
+    file, where every line has a "block" key.
+
+    The index is saved next to the output file together with the number of
+    bytes of the output it covers, so resuming only parses the lines appended
+    after the last save instead of the whole output.
+    """
+
+    def __init__(self, blocks: range, output_file: str):
+        self.blocks = blocks
+        self.output_file = output_file
+        self.bitmap = bytearray((len(blocks) + 7) // 8)
+        self.count = 0
+        self.offset = 0  # bytes of the output file covered by the index
+
+    @property
+    def index_file(self) -> str:
+        return self.output_file + INDEX_SUFFIX
+
+    @classmethod
+    def load(cls, blocks: range, output_file: str) -> BlockIndex:
+        index = cls(blocks, output_file)
+        if path.exists(index.index_file):
+            with open(index.index_file) as f:
+                saved = json.load(f)
+            size = path.getsize(output_file) if path.exists(output_file) else 0
+            if saved["blocks"] != [blocks.start, blocks.stop, blocks.step]:
+                logging.warning("Ignoring %s, block range changed", index.index_file)
+            elif saved["offset"] > size:
+                logging.warning(
+                    "Ignoring %s, %s was truncated", index.index_file, output_file
+                )
+            else:
+                index.bitmap = bytearray.fromhex(saved["bitmap"])
+                index.count = saved["count"]
+                index.offset = saved["offset"]
+        if path.exists(output_file):
+            index.catch_up()
+        return index
+
+    def catch_up(self) -> None:
+        """Adds the blocks of the lines written after `offset`."""
+        with open(self.output_file, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # truncated line, never covered by the index
+                try:
+                    block = json.loads(line)["block"]
+                except (json.JSONDecodeError, KeyError):
+                    block = None
+                self.add(block, self.offset + len(line))
+
+    def _position(self, block: Optional[int]) -> Optional[int]:
+        if block is None or block not in self.blocks:
+            return None
+        return (block - self.blocks.start) // self.blocks.step
+
+    def __contains__(self, block: int) -> bool:
+        position = self._position(block)
+        if position is None:
+            return False
+        return bool(self.bitmap[position >> 3] & (1 << (position & 7)))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, block: Optional[int], offset: int) -> None:
+        """Marks `block` as written, `offset` being the size of the output
+        file once its line is written. Blocks outside of the range only move
+        the offset."""
+        self.offset = offset
+        position = self._position(block)
+        if position is None or block in self:
+            return
+        self.bitmap[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def last_contiguous_block(self) -> Optional[int]:
+        """Returns the last block before the first missing one, if any."""
+        last = None
+        for block in self.blocks:
+            if block not in self:
+                break
+            last = block
+        return last
+
+    def save(self) -> None:
+        saved = {
+            "blocks": [self.blocks.start, self.blocks.stop, self.blocks.step],
+            "count": self.count,
+            "offset": self.offset,
+            "bitmap": self.bitmap.hex(),
+        }
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(saved, f)
+        os.replace(tmp_file, self.index_file)
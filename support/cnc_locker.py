@@ -0,0 +1,327 @@
+"""Replica of the lock accounting of `CNCLockerV3`.
+
+`LockerState` replays the operations of the locker one at a time, keeping the
+locks of every user in the order of `userLocks`, including the swap-and-pop
+removals. Every lock ever created is also recorded in flat arrays (owner,
+amount, unlock time, boost, creation and removal time) so that the balances
+and boosts of all users can be computed at many timestamps at once with
+`LockerState.at`, without replaying anything.
+
+Amounts are Python ints, in NumPy object arrays for the bulk computations, so
+that every `mulDown` and `divDown` rounds like the contract.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from support.weight_manager import ONE, div_down, mul_down
+
+DAY = 86400
+MIN_LOCK_AMOUNT = 10 * ONE
+MAX_LOCKS = 10
+MIN_LOCK_TIME = 120 * DAY
+MAX_LOCK_TIME = 240 * DAY
+GRACE_PERIOD = 28 * DAY
+MIN_BOOST = ONE
+MAX_BOOST = 15 * ONE // 10
+KICK_PENALTY = ONE // 10
+MAX_KICK_PENALTY_AMOUNT = 1000 * ONE
+
+NEVER = np.iinfo(np.int64).max  # removal time of the locks still stored
+# bound on the size of the (timestamps, locks) arrays of `LockerState.at`
+MAX_CHUNK_SIZE = 1 << 20
+
+
+def compute_boost(lock_time):
+    """`computeBoost`, for an int or an object array of lock times."""
+    return (
+        mul_down(
+            MAX_BOOST - MIN_BOOST,
+            div_down(lock_time - MIN_LOCK_TIME, MAX_LOCK_TIME - MIN_LOCK_TIME),
+        )
+        + MIN_BOOST
+    )
+
+
+class VoteLock(NamedTuple):
+    amount: int
+    unlock_time: int
+    boost: int
+    id: int
+
+
+class LockerBalances(NamedTuple):
+    """Views of every user (columns, in the order of `LockerState.users`) at
+    every timestamp (rows)."""
+
+    locked_balance: np.ndarray
+    locked_boosted: np.ndarray  # `totalStreamBoost`
+    rewards_boost: np.ndarray  # `totalRewardsBoost`
+
+    @property
+    def total_locked(self) -> np.ndarray:
+        return self.locked_balance.sum(axis=1)
+
+    @property
+    def total_boosted(self) -> np.ndarray:
+        return self.locked_boosted.sum(axis=1)
+
+    def vote_boost(self, staker_boosts: np.ndarray) -> np.ndarray:
+        """`totalVoteBoost`, given `LpTokenStaker.getBoost` of every user at
+        every timestamp."""
+        return mul_down(self.rewards_boost, np.asarray(staker_boosts, dtype=object))
+
+
+class LockerState:
+    def __init__(self):
+        self.users: Dict[str, int] = {}
+        self.next_id = 0
+        self.is_shutdown = False
+        self.airdropped_boost: Dict[str, int] = {}
+        self.locked_balance: Dict[str, int] = defaultdict(int)
+        self.locked_boosted: Dict[str, int] = defaultdict(int)
+        self.total_locked = 0
+        self.total_boosted = 0
+        # records of the locks stored for every user, in `userLocks` order
+        self.locks: Dict[str, List[int]] = defaultdict(list)
+
+        # history of every lock, one entry per record
+        self.owners: List[int] = []
+        self.amounts: List[int] = []
+        self.unlock_times: List[int] = []
+        self.boosts: List[int] = []
+        self.ids: List[int] = []
+        self.created: List[int] = []
+        self.removed: List[int] = []
+
+    def _user(self, account: str) -> int:
+        return self.users.setdefault(account, len(self.users))
+
+    def _add_vote_lock(
+        self, now: int, account: str, amount: int, unlock_time: int, boost: int
+    ) -> None:
+        self.locks[account].append(len(self.owners))
+        self.owners.append(self._user(account))
+        self.amounts.append(amount)
+        self.unlock_times.append(unlock_time)
+        self.boosts.append(boost)
+        self.ids.append(self.next_id)
+        self.created.append(now)
+        self.removed.append(NEVER)
+        self.next_id += 1
+
+    def _remove(self, now: int, account: str, index: int) -> int:
+        # `_pending[i] = _pending[_pending.length - 1]; _pending.pop()`
+        records = self.locks[account]
+        record = records[index]
+        records[index] = records[-1]
+        records.pop()
+        self.removed[record] = now
+        return record
+
+    def _index(self, account: str, lock_id: int) -> int:
+        for index, record in enumerate(self.locks[account]):
+            if self.ids[record] == lock_id:
+                return index
+        raise ValueError(f"lock {lock_id} of {account} doesn't exist")
+
+    def _boosted(self, record: int) -> int:
+        return mul_down(self.amounts[record], self.boosts[record])
+
+    def _update_balances(self, account: str, amount: int, boosted: int) -> None:
+        self.total_locked += amount
+        self.total_boosted += boosted
+        self.locked_balance[account] += amount
+        self.locked_boosted[account] += boosted
+
+    def user_locks(self, account: str) -> List[VoteLock]:
+        return [
+            VoteLock(
+                self.amounts[record],
+                self.unlock_times[record],
+                self.boosts[record],
+                self.ids[record],
+            )
+            for record in self.locks[account]
+        ]
+
+    def claim_airdrop_boost(self, account: str, amount: int) -> None:
+        self.airdropped_boost[account] = amount
+
+    def shut_down(self) -> None:
+        self.is_shutdown = True
+
+    def lock(
+        self,
+        now: int,
+        account: str,
+        amount: int,
+        lock_time: int,
+        relock: bool = False,
+        sender: Optional[str] = None,
+    ) -> None:
+        """`lockFor`, the airdrop boost being the one of `sender`, the account
+        by default."""
+        assert not self.is_shutdown, "locker suspended"
+        assert amount >= MIN_LOCK_AMOUNT, "amount too small"
+        assert MIN_LOCK_TIME <= lock_time <= MAX_LOCK_TIME, "lock time invalid"
+        assert len(self.locks[account]) < MAX_LOCKS, "too many locks"
+        boost = compute_boost(lock_time)
+        sender = account if sender is None else sender
+        if self.airdropped_boost.get(sender, ONE) > ONE:
+            boost = mul_down(boost, self.airdropped_boost.pop(sender))
+        unlock_time = now + lock_time
+
+        if relock:
+            for record in self.locks[account]:
+                assert (
+                    self.unlock_times[record] < unlock_time
+                ), "cannot move the unlock time up"
+            while self.locks[account]:
+                self._remove(now, account, len(self.locks[account]) - 1)
+            self._update_balances(account, 0, -self.locked_boosted[account])
+            total = self.locked_balance[account] + amount
+            self._add_vote_lock(now, account, total, unlock_time, boost)
+            boosted = mul_down(total, boost)
+        else:
+            self._add_vote_lock(now, account, amount, unlock_time, boost)
+            boosted = mul_down(amount, boost)
+        self._update_balances(account, amount, boosted)
+
+    def relock(
+        self, now: int, account: str, lock_ids: Sequence[int], lock_time: int
+    ) -> None:
+        """`relock(lockId, lockTime)` and `relockMultiple`."""
+        assert not self.is_shutdown, "locker suspended"
+        assert MIN_LOCK_TIME <= lock_time <= MAX_LOCK_TIME, "lock time invalid"
+        boost = compute_boost(lock_time)
+        unlock_time = now + lock_time
+        for lock_id in lock_ids:
+            index = self._index(account, lock_id)
+            record = self.locks[account][index]
+            assert (
+                self.unlock_times[record] < unlock_time
+            ), "cannot move the unlock time up"
+            self._remove(now, account, index)
+            amount = self.amounts[record]
+            self._add_vote_lock(now, account, amount, unlock_time, boost)
+            boosted = mul_down(amount, boost)
+            self._update_balances(account, 0, boosted - self._boosted(record))
+
+    def relock_all(self, now: int, account: str, lock_time: int) -> None:
+        """`relock(lockTime)`."""
+        assert not self.is_shutdown, "locker suspended"
+        assert MIN_LOCK_TIME <= lock_time <= MAX_LOCK_TIME, "lock time invalid"
+        boost = compute_boost(lock_time)
+        unlock_time = now + lock_time
+        for record in self.locks[account]:
+            assert (
+                self.unlock_times[record] < unlock_time
+            ), "cannot move the unlock time up"
+        while self.locks[account]:
+            self._remove(now, account, len(self.locks[account]) - 1)
+        balance = self.locked_balance[account]
+        self._add_vote_lock(now, account, balance, unlock_time, boost)
+        self._update_balances(
+            account, 0, mul_down(balance, boost) - self.locked_boosted[account]
+        )
+
+    def kick(self, now: int, account: str, lock_id: int) -> int:
+        """`kick`, returns the penalty paid to the kicker."""
+        index = self._index(account, lock_id)
+        record = self.locks[account][index]
+        assert self.unlock_times[record] + GRACE_PERIOD <= now, "cannot kick this lock"
+        amount = self.amounts[record]
+        self._update_balances(account, -amount, -self._boosted(record))
+        self._remove(now, account, index)
+        return min(mul_down(amount, KICK_PENALTY), MAX_KICK_PENALTY_AMOUNT)
+
+    def execute_available_unlocks(self, now: int, account: str) -> int:
+        """`executeAvailableUnlocksFor`, returns the amount unlocked."""
+        unlocked = boosted = 0
+        index = len(self.locks[account])
+        while index > 0:
+            index -= 1
+            record = self.locks[account][index]
+            if self.is_shutdown or self.unlock_times[record] <= now:
+                unlocked += self.amounts[record]
+                boosted += self._boosted(record)
+                self._remove(now, account, index)
+        self._update_balances(account, -unlocked, -boosted)
+        return unlocked
+
+    def execute_unlocks(self, now: int, account: str, lock_ids: Sequence[int]) -> int:
+        """`executeUnlocks`, returns the amount unlocked."""
+        unlocked = boosted = 0
+        for lock_id in lock_ids:
+            index = self._index(account, lock_id)
+            record = self.locks[account][index]
+            assert (
+                self.is_shutdown or self.unlock_times[record] <= now
+            ), "lock not expired"
+            unlocked += self.amounts[record]
+            boosted += self._boosted(record)
+            self._remove(now, account, index)
+        self._update_balances(account, -unlocked, -boosted)
+        return unlocked
+
+    def sync(self, now: int, account: str, locks: Sequence[VoteLock]) -> None:
+        """Replaces the locks of `account` by the ones read from `userLocks`,
+        for operations that cannot be replayed from their events alone."""
+        while self.locks[account]:
+            self._remove(now, account, len(self.locks[account]) - 1)
+        self._update_balances(
+            account, -self.locked_balance[account], -self.locked_boosted[account]
+        )
+        for amount, unlock_time, boost, lock_id in locks:
+            self.locks[account].append(len(self.owners))
+            self.owners.append(self._user(account))
+            self.amounts.append(amount)
+            self.unlock_times.append(unlock_time)
+            self.boosts.append(boost)
+            self.ids.append(lock_id)
+            self.created.append(now)
+            self.removed.append(NEVER)
+            self.next_id = max(self.next_id, lock_id + 1)
+            self._update_balances(account, amount, mul_down(amount, boost))
+
+    def at(self, timestamps: Sequence[int]) -> LockerBalances:
+        """Views of every user after all the operations up to every timestamp,
+        computed from the history of the locks, chunked over timestamps."""
+        users = len(self.users)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        shape = (len(timestamps), users)
+        balances = LockerBalances(
+            np.zeros(shape, dtype=object),
+            np.zeros(shape, dtype=object),
+            np.zeros(shape, dtype=object),
+        )
+        if not self.owners:
+            return balances
+
+        # records grouped by owner, every user having at least one record
+        order = np.argsort(np.array(self.owners), kind="stable")
+        owners = np.array(self.owners)[order]
+        starts = np.flatnonzero(np.concatenate([[True], owners[1:] != owners[:-1]]))
+        amounts = np.array(self.amounts, dtype=object)[order]
+        boosted = mul_down(amounts, np.array(self.boosts, dtype=object)[order])
+        unlock_times = np.array(self.unlock_times, dtype=np.int64)[order]
+        created = np.array(self.created, dtype=np.int64)[order]
+        removed = np.array(self.removed, dtype=np.int64)[order]
+
+        chunk = max(MAX_CHUNK_SIZE // len(owners), 1)
+        for start in range(0, len(timestamps), chunk):
+            now = timestamps[start : start + chunk, None]
+            stored = (created <= now) & (now < removed)
+            locked = stored & (now < unlock_times)
+            rows = slice(start, start + chunk)
+            for values, mask, result in (
+                (amounts, stored, balances.locked_balance),
+                (boosted, stored, balances.locked_boosted),
+                (boosted, locked, balances.rewards_boost),
+            ):
+                summed = np.add.reduceat(np.where(mask, values, 0), starts, axis=1)
+                result[rows, owners[starts]] = summed
+        return balances
@@ -38,3 +38,6 @@ REFUNDS_MERKLE_ROOT = (
 DEBT_TOKEN_MERKLE_ROOT = (
     "0xe2520b7aa640dc81622dee43fdb344a15a6ab069853ab0a50844e0a9e95e99cd"
 )
+
+# block from which the deviations are computed with the new oracle
+NEW_ORACLE_DEPLOYMENT_BLOCK = 17613381
@@ -0,0 +1,250 @@
+"""Off-chain replica of `CurveLPOracle._getUSDPrice` over many pool states.
+
+Every argument holding per-block data has one row per state and values are
+kept as Python ints in NumPy object arrays, so that every rounding is the
+same as in `ScaledMath` and `CurvePoolUtils`. States for which the contract
+would revert get a price of 0, `reverted` set and the revert reason.
+
+The `get_dy` quotes used by `ensurePoolBalanced` are inputs, typically read
+from the RPC cache; `stableswap_quotes` computes them for plain StableSwap
+pools.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from support.CurvePoolV1 import rates_from_decimals
+from support.curve_pool_batch import get_dy_batch
+
+ONE = 10**18
+MAX_IMBALANCE_BUFFER = 10**17  # CurveLPOracle._MAX_IMBALANCE_BUFFER
+DEFAULT_IMBALANCE_BUFFER = 30 * 10**14
+CURVE_POOL_FEE_DECIMALS = 10
+FEE_IMBALANCE_MULTIPLIER = 3
+NEVER_BALANCED = 2**256  # above any imbalance buffer
+
+IntArray = Union[Sequence[int], np.ndarray]
+Quotes = Dict[Tuple[int, int], IntArray]  # (i, j) -> get_dy(i, j, 10 ** decimals[i])
+
+
+class AssetType:
+    USD = 0
+    ETH = 1
+    BTC = 2
+    OTHER = 3
+    CRYPTO = 4
+
+
+def convert_scale(a, from_decimals: int, to_decimals: int):
+    if from_decimals == to_decimals:
+        return a
+    if from_decimals > to_decimals:
+        return a // 10 ** (from_decimals - to_decimals)
+    return a * 10 ** (to_decimals - from_decimals)
+
+
+def mul_down(a, b):
+    return a * b // ONE
+
+
+def div_down(a, b):
+    return a * ONE // b
+
+
+def _column(values, rows: int) -> np.ndarray:
+    return np.broadcast_to(np.asarray(values, dtype=object), (rows,)).copy()
+
+
+def _is_none(values: np.ndarray) -> np.ndarray:
+    return np.asarray(values == None, dtype=bool)  # noqa: E711 (element-wise)
+
+
+def _safe(values: np.ndarray) -> np.ndarray:
+    # denominators of rows that revert anyway, avoids ZeroDivisionError
+    return np.where(values == 0, 1, values)
+
+
+@dataclass
+class OraclePool:
+    address: str
+    decimals: List[int]
+    asset_type: int = AssetType.USD
+    # customImbalanceBuffers (or customInternalImbalanceBuffers) of every coin
+    imbalance_buffers: List[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.imbalance_buffers:
+            self.imbalance_buffers = [0] * len(self.decimals)
+        assert len(self.imbalance_buffers) == len(self.decimals)
+        for buffer in self.imbalance_buffers:
+            assert buffer <= MAX_IMBALANCE_BUFFER, "buffer too high"
+
+    @property
+    def n_coins(self) -> int:
+        return len(self.decimals)
+
+
+class OraclePrices(NamedTuple):
+    prices: np.ndarray  # LP token prices with 18 decimals, 0 when reverted
+    reverted: np.ndarray  # bool
+    reasons: np.ndarray  # revert reason of every reverted row, None otherwise
+
+
+def is_within_threshold(
+    a: np.ndarray, b: np.ndarray, pool_fee: np.ndarray, imbalance_buffer: int
+) -> np.ndarray:
+    """`CurvePoolUtils._isWithinThreshold`, rows where the contract would
+    divide by zero are returned as not within the threshold."""
+    if imbalance_buffer == 0:
+        imbalance_buffer = DEFAULT_IMBALANCE_BUFFER
+    threshold = imbalance_buffer + pool_fee * FEE_IMBALANCE_MULTIPLIER
+    larger = np.where(a > b, a, b)
+    deviation = div_down(np.abs(a - b), _safe(larger))
+    return (deviation <= threshold) & (larger != 0)
+
+
+def ensure_pool_balanced(
+    pool: OraclePool,
+    prices: IntArray,
+    fee: IntArray,
+    quotes: Quotes,
+    imbalance_buffers: Optional[Sequence[int]] = None,
+) -> np.ndarray:
+    """Returns, for every row, the first pair (i, j) for which
+    `CurvePoolUtils.ensurePoolBalanced` reverts, or None.
+
+    `imbalance_buffers` overrides the buffers of `pool`. Quotes of None stand
+    for `get_dy` calls that reverted.
+    """
+    prices = np.asarray(prices, dtype=object)
+    rows = prices.shape[0]
+    buffers = pool.imbalance_buffers if imbalance_buffers is None else imbalance_buffers
+    pool_fee = convert_scale(_column(fee, rows), CURVE_POOL_FEE_DECIMALS, 18)
+
+    failures = np.full(rows, None, dtype=object)
+    for i in range(pool.n_coins - 1):
+        from_decimals = pool.decimals[i]
+        from_balance = 10**from_decimals
+        for j in range(i + 1, pool.n_coins):
+            to_expected = convert_scale(
+                from_balance * prices[:, i] // _safe(prices[:, j]),
+                from_decimals,
+                pool.decimals[j],
+            )
+            to_actual = _column(quotes[(i, j)], rows)
+            quoted = ~_is_none(to_actual)
+            within = np.zeros(rows, dtype=bool)
+            within[quoted] = is_within_threshold(
+                to_expected[quoted],
+                to_actual[quoted],
+                pool_fee[quoted],
+                max(buffers[i], buffers[j]),
+            )
+            for row in np.flatnonzero(~within & _is_none(failures)):
+                failures[row] = (i, j)
+    return failures
+
+
+def required_imbalance_buffers(
+    pool: OraclePool, prices: IntArray, fee: IntArray, quotes: Quotes
+) -> np.ndarray:
+    """Smallest imbalance buffer, set on every coin of `pool`, for which
+    `ensurePoolBalanced` does not revert, for every row. Rows that revert
+    whatever the buffer get `NEVER_BALANCED`.
+
+    A row passes with buffer `b` iff `(b or DEFAULT_IMBALANCE_BUFFER)` is at
+    least its required buffer.
+    """
+    prices = np.asarray(prices, dtype=object)
+    rows = prices.shape[0]
+    pool_fee = convert_scale(_column(fee, rows), CURVE_POOL_FEE_DECIMALS, 18)
+
+    required = np.zeros(rows, dtype=object)
+    for i in range(pool.n_coins - 1):
+        from_decimals = pool.decimals[i]
+        from_balance = 10**from_decimals
+        for j in range(i + 1, pool.n_coins):
+            to_expected = convert_scale(
+                from_balance * prices[:, i] // _safe(prices[:, j]),
+                from_decimals,
+                pool.decimals[j],
+            )
+            to_actual = _column(quotes[(i, j)], rows)
+            pair_required = np.full(rows, NEVER_BALANCED, dtype=object)
+            quoted = np.flatnonzero(~_is_none(to_actual))
+            a, b = to_expected[quoted], to_actual[quoted]
+            larger = np.where(a > b, a, b)
+            deviation = div_down(np.abs(a - b), _safe(larger))
+            pair_required[quoted] = np.where(
+                larger == 0,
+                NEVER_BALANCED,
+                np.maximum(deviation - pool_fee[quoted] * FEE_IMBALANCE_MULTIPLIER, 0),
+            )
+            required = np.maximum(required, pair_required)
+    return required
+
+
+def get_usd_prices(
+    pool: OraclePool,
+    balances: IntArray,
+    prices: IntArray,
+    total_supply: IntArray,
+    fee: IntArray,
+    quotes: Quotes,
+) -> OraclePrices:
+    """Replays `CurveLPOracle._getUSDPrice` for every row.
+
+    `balances` and `prices` have one column per coin, prices having 18
+    decimals. Coins priced by the Curve LP oracle itself (e.g. the base pool
+    of a metapool) must be given the price computed with the internal
+    imbalance buffers.
+    """
+    balances = np.asarray(balances, dtype=object)
+    prices = np.asarray(prices, dtype=object)
+    rows = balances.shape[0]
+    assert balances.shape == prices.shape == (rows, pool.n_coins)
+    total_supply = _column(total_supply, rows)
+
+    reasons = np.full(rows, None, dtype=object)
+    value = np.zeros(rows, dtype=object)
+    for i in range(pool.n_coins):
+        # the price is checked before the balance of every coin
+        reasons[(prices[:, i] == 0) & _is_none(reasons)] = "price is 0"
+        reasons[(balances[:, i] == 0) & _is_none(reasons)] = "balance is 0"
+        value = value + mul_down(
+            convert_scale(balances[:, i], pool.decimals[i], 18), prices[:, i]
+        )
+
+    failures = ensure_pool_balanced(pool, prices, fee, quotes)
+    for row in np.flatnonzero(~_is_none(failures) & _is_none(reasons)):
+        i, j = failures[row]
+        if _column(quotes[(i, j)], rows)[row] is None:
+            # the revert of the pool is bubbled up by the oracle
+            reasons[row] = f"get_dy({i}, {j}) reverted in {pool.address}"
+        else:
+            reasons[row] = f"NotWithinThreshold({pool.address}, {i}, {j})"
+    reasons[(total_supply == 0) & _is_none(reasons)] = "division by zero"
+
+    reverted = ~_is_none(reasons)
+    lp_prices = np.where(reverted, 0, div_down(value, _safe(total_supply)))
+    return OraclePrices(lp_prices, reverted, reasons)
+
+
+def stableswap_quotes(
+    pool: OraclePool, balances: IntArray, amp: IntArray, fee: IntArray
+) -> Quotes:
+    """`get_dy` quotes used by `ensurePoolBalanced` for plain StableSwap pools
+    (not metapools nor crypto pools). `amp` is in `A * A_PREC` units and
+    quotes for which the pool would revert are None."""
+    assert pool.asset_type != AssetType.CRYPTO, "not a StableSwap pool"
+    balances = np.asarray(balances, dtype=object)
+    rates = rates_from_decimals(pool.decimals)
+    return {
+        (i, j): get_dy_batch(
+            i, j, 10 ** pool.decimals[i], balances, amp, fee, rates, strict=False
+        )
+        for i in range(pool.n_coins - 1)
+        for j in range(i + 1, pool.n_coins)
+    }
@@ -0,0 +1,190 @@
+"""Batched version of the StableSwap math in ``support.CurvePoolV1``.
+
+Every function takes one pool state per row and works on NumPy object arrays
+so that values stay arbitrary-precision Python ints: results are bit-for-bit
+identical to the scalar ``CurvePool`` methods. Rows are dropped from the
+working set as soon as their Newton iteration has converged.
+
+Amplification values are expected in the same precise units as
+``CurvePool.A`` (i.e. already multiplied by ``A_PREC``).
+"""
+
+from typing import Sequence, Union
+
+import numpy as np
+
+from support.CurvePoolV1 import A_PREC, FEE_DENOMINATOR, PRECISION, RATES
+
+MAX_ITERATIONS = 255
+
+IntArray = Union[Sequence[int], np.ndarray]
+
+
+def _to_object_array(values, ndim: int) -> np.ndarray:
+    array = np.asarray(values)
+    if array.dtype != object:
+        array = array.astype(object)
+    if array.ndim != ndim:
+        raise ValueError(f"expected a {ndim}-dimensional array, got {array.ndim}")
+    return array
+
+
+def _is_not_none(values: np.ndarray) -> np.ndarray:
+    return np.asarray(values != None, dtype=bool)  # noqa: E711 (element-wise)
+
+
+def _broadcast_rows(values, rows: int) -> np.ndarray:
+    return np.broadcast_to(np.asarray(values, dtype=object), (rows,)).copy()
+
+
+def get_D_batch(xp: IntArray, amp: IntArray, strict: bool = True) -> np.ndarray:
+    xp = _to_object_array(xp, 2)
+    rows, n_coins = xp.shape
+    amp = _broadcast_rows(amp, rows)
+
+    S = xp.sum(axis=1) if n_coins else np.zeros(rows, dtype=object)
+    result = np.zeros(rows, dtype=object)
+
+    # the contract divides by every balance, unless they are all 0
+    zero = np.asarray((xp == 0).any(axis=1) & (S != 0), dtype=bool)
+    if zero.any():
+        if strict:
+            raise ZeroDivisionError(
+                f"get_D divides by zero for rows {np.flatnonzero(zero).tolist()}"
+            )
+        result[zero] = None
+    active = np.flatnonzero(np.asarray(S != 0, dtype=bool) & ~zero)
+    xp, S, D = xp[active], S[active], S[active].copy()
+    Ann = amp[active] * n_coins
+
+    for _ in range(MAX_ITERATIONS):
+        if active.size == 0:
+            return result
+        D_P = D.copy()
+        for k in range(n_coins):
+            D_P = D_P * D // (xp[:, k] * n_coins)
+        D_prev = D
+        D = (
+            (Ann * S // A_PREC + D_P * n_coins)
+            * D
+            // ((Ann - A_PREC) * D // A_PREC + (n_coins + 1) * D_P)
+        )
+
+        converged = np.abs(D - D_prev) <= 1
+        result[active[converged]] = D[converged]
+        pending = ~converged
+        active, xp, S, D, Ann = (
+            active[pending],
+            xp[pending],
+            S[pending],
+            D[pending],
+            Ann[pending],
+        )
+
+    if active.size and strict:
+        raise RuntimeError(f"get_D did not converge for rows {active.tolist()}")
+    result[active] = None
+    return result
+
+
+def get_y_batch(
+    i: int, j: int, x: IntArray, xp: IntArray, amp: IntArray, strict: bool = True
+) -> np.ndarray:
+    xp = _to_object_array(xp, 2)
+    rows, n_coins = xp.shape
+    assert i != j  # dev: same coin
+    assert 0 <= j < n_coins  # dev: j out of range
+    assert 0 <= i < n_coins
+
+    x = _broadcast_rows(x, rows)
+    amp = _broadcast_rows(amp, rows)
+
+    D = get_D_batch(xp, amp, strict)
+    # every balance but the one of j is divided by, x taking the place of i
+    zero = x == 0
+    for k in range(n_coins):
+        if k != i and k != j:
+            zero = zero | (xp[:, k] == 0)
+    zero = np.asarray(zero, dtype=bool)
+    if strict and zero.any():
+        raise ZeroDivisionError(
+            f"get_y divides by zero for rows {np.flatnonzero(zero).tolist()}"
+        )
+    valid = np.flatnonzero(_is_not_none(D) & ~zero)
+    if valid.size < rows:
+        result = np.full(rows, None, dtype=object)
+        if valid.size:
+            result[valid] = get_y_batch(i, j, x[valid], xp[valid], amp[valid], strict)
+        return result
+    Ann = amp * n_coins
+    c = D.copy()
+    S = np.zeros(rows, dtype=object)
+    for k in range(n_coins):
+        if k == i:
+            _x = x
+        elif k != j:
+            _x = xp[:, k]
+        else:
+            continue
+        S = S + _x
+        c = c * D // (_x * n_coins)
+    c = c * D * A_PREC // (Ann * n_coins)
+    b = S + D * A_PREC // Ann
+
+    result = np.zeros(rows, dtype=object)
+    active = np.arange(rows)
+    y = D.copy()
+    for _ in range(MAX_ITERATIONS):
+        if active.size == 0:
+            return result
+        y_prev = y
+        y = (y * y + c) // (2 * y + b - D)
+
+        converged = np.abs(y - y_prev) <= 1
+        result[active[converged]] = y[converged]
+        pending = ~converged
+        active, y, b, c, D = (
+            active[pending],
+            y[pending],
+            b[pending],
+            c[pending],
+            D[pending],
+        )
+
+    if active.size and strict:
+        raise RuntimeError(f"get_y did not converge for rows {active.tolist()}")
+    result[active] = None
+    return result
+
+
+def get_dy_batch(
+    i: int,
+    j: int,
+    dx: IntArray,
+    balances: IntArray,
+    amp: IntArray,
+    fee: IntArray = 0,
+    rates: Sequence[int] = RATES,
+    strict: bool = True,
+) -> np.ndarray:
+    """With `strict=False`, rows for which get_D or get_y do not converge, and
+    for which the contract would revert (dividing by a zero balance or
+    quoting a negative amount), are None instead of raising."""
+    balances = _to_object_array(balances, 2)
+    rows = balances.shape[0]
+    dx = _broadcast_rows(dx, rows)
+    fee = _broadcast_rows(fee, rows)
+    rates = _to_object_array(rates, 1)
+
+    xp = rates * balances // PRECISION
+    x = xp[:, i] + dx * rates[i] // PRECISION
+    y = get_y_batch(i, j, x, xp, amp, strict)
+    result = np.full(rows, None, dtype=object)
+    converged = np.flatnonzero(_is_not_none(y))
+    dy = xp[converged, j] - y[converged] - 1
+    _fee = fee[converged] * dy // FEE_DENOMINATOR
+    result[converged] = (dy - _fee) * PRECISION // rates[j]
+    if not strict:
+        # the subtraction underflows in the contract
+        result[converged[np.asarray(dy < 0, dtype=bool)]] = None
+    return result
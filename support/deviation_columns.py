@@ -0,0 +1,89 @@
+"""Columnar storage of the deviations fetched by `scripts/fetch_deviations.py`.
+
+Every series, i.e. the deviations between coin 0 and coin `i` of a pool, is
+stored as two `.npy` files, one with the block numbers and one with the
+deviations in bps, so that they can be memory-mapped and that readers only
+load the columns they need. `series.json` lists the series of a directory.
+"""
+
+import gzip
+import json
+import os
+from array import array
+from os import path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+MANIFEST_FILE = "series.json"
+BLOCKS = "blocks"
+DEVIATIONS = "deviations"
+
+Series = Tuple[str, int]  # (pool, coin index)
+
+
+def column_path(directory: str, series: Series, column: str) -> str:
+    pool, i = series
+    return path.join(directory, f"{pool}-{i}.{column}.npy")
+
+
+def _open_lines(filename: str):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    return open(filename)
+
+
+def convert_jsonl(jsonl_path: str, directory: str) -> List[Series]:
+    """Converts the JSON lines output of `fetch_deviations`, gzipped or not,
+    into columns. Rows of every series are sorted by block."""
+    blocks: Dict[Series, array] = {}
+    deviations: Dict[Series, array] = {}
+    with _open_lines(jsonl_path) as f:
+        for line in f:
+            item = json.loads(line)
+            for pool, pool_deviations in item["deviations"].items():
+                for i, deviation in enumerate(pool_deviations):
+                    series = (pool, i)
+                    if series not in blocks:
+                        blocks[series] = array("q")
+                        deviations[series] = array("d")
+                    blocks[series].append(item["block"])
+                    deviations[series].append(deviation)
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = []
+    for series in sorted(blocks):
+        series_blocks = np.frombuffer(blocks[series], dtype=np.int64)
+        order = np.argsort(series_blocks, kind="stable")
+        np.save(column_path(directory, series, BLOCKS), series_blocks[order])
+        np.save(
+            column_path(directory, series, DEVIATIONS),
+            np.frombuffer(deviations[series], dtype=np.float64)[order],
+        )
+        manifest.append({"pool": series[0], "index": series[1], "rows": len(order)})
+    with open(path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return sorted(blocks)
+
+
+def list_series(directory: str) -> List[Series]:
+    with open(path.join(directory, MANIFEST_FILE)) as f:
+        return [(entry["pool"], entry["index"]) for entry in json.load(f)]
+
+
+def load_column(
+    directory: str, series: Series, column: str, mmap: bool = True
+) -> np.ndarray:
+    return np.load(
+        column_path(directory, series, column), mmap_mode="r" if mmap else None
+    )
+
+
+def load_series(
+    directory: str, series: Series, mmap: bool = True
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the blocks and the deviations of `series`."""
+    return (
+        load_column(directory, series, BLOCKS, mmap),
+        load_column(directory, series, DEVIATIONS, mmap),
+    )
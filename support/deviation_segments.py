@@ -0,0 +1,68 @@
+import glob
+import json
+import logging
+import os
+from os import path
+from typing import Iterator, List, Optional, Tuple
+
+
+def segment_path(segments_dir: str, blocks: range) -> str:
+    return path.join(segments_dir, f"{blocks.start}-{blocks.stop}.json")
+
+
+def segment_range(filename: str) -> Optional[range]:
+    """Inverse of `segment_path`, without the step, or None for other files."""
+    name, _ = path.splitext(path.basename(filename))
+    try:
+        start, stop = (int(part) for part in name.split("-"))
+    except ValueError:
+        return None
+    return range(start, stop)
+
+
+def read_lines(filename: str) -> Iterator[Tuple[int, str]]:
+    with open(filename) as f:
+        for line in f:
+            try:
+                yield json.loads(line)["block"], line.strip()
+            except (json.JSONDecodeError, KeyError):
+                # a line can be truncated if a fetcher was interrupted
+                logging.warning("Skipping invalid line in %s: %r", filename, line)
+
+
+def overlapping_segments(blocks: range, output_file: str) -> List[str]:
+    """Other segments next to `output_file` sharing blocks with `blocks`, such
+    as the segments of a previous run with a different number of shards."""
+    filenames = []
+    for filename in sorted(glob.glob(path.join(path.dirname(output_file), "*.json"))):
+        other = segment_range(filename)
+        if other is None or path.abspath(filename) == path.abspath(output_file):
+            continue
+        if max(other.start, blocks.start) < min(other.stop, blocks.stop):
+            filenames.append(filename)
+    return filenames
+
+
+def seed_segment(blocks: range, output_file: str, legacy_file: str) -> None:
+    """Starts a new segment with the blocks of `blocks` already fetched into
+    overlapping segments or into `legacy_file`, the output of unsharded runs
+    from before segments, so that they are not fetched again."""
+    if path.exists(output_file):
+        return
+    sources = overlapping_segments(blocks, output_file)
+    if path.exists(legacy_file):
+        sources.append(legacy_file)
+    if not sources:
+        return
+    seeded = set()
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        for source in sources:
+            for block, line in read_lines(source):
+                if block in blocks and block not in seeded:
+                    f.write(line + "\n")
+                    seeded.add(block)
+    os.replace(tmp_file, output_file)
+    logging.info(
+        "Seeded %s with %s blocks of %s", output_file, len(seeded), ", ".join(sources)
+    )
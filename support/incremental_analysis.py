@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from os import path
+from typing import Dict, Iterable, Set
+
+from support.deviation_columns import Series
+from support.quantile_sketch import TDigest
+
+
+def _series_key(series: Series) -> str:
+    pool, i = series
+    return f"{pool}:{i}"
+
+
+def _parse_series_key(key: str) -> Series:
+    pool, i = key.split(":")
+    return pool, int(i)
+
+
+class IncrementalAnalysis:
+    """Per-series deviation sketches folded over append-only JSON lines files,
+    such as the segments written by `fetch_deviations`.
+
+    The state remembers how many bytes of every file were already processed,
+    so that an update only parses the lines appended since the last one, and
+    which blocks were folded, so that blocks found in several files, such as
+    overlapping segments, are only counted once.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.sketches: Dict[Series, TDigest] = {}
+        self.offsets: Dict[str, int] = {}
+        self.last_blocks: Dict[str, int] = {}
+        self.blocks: Set[int] = set()
+
+    @property
+    def last_block(self) -> int:
+        return max(self.last_blocks.values(), default=0)
+
+    @classmethod
+    def load(cls, filename: str) -> IncrementalAnalysis:
+        analysis = cls()
+        if not path.exists(filename):
+            return analysis
+        with open(filename) as f:
+            state = json.load(f)
+        if "blocks" not in state:
+            logging.warning("%s has no folded blocks, starting over", filename)
+            return analysis
+        analysis.sketches = {
+            _parse_series_key(key): TDigest.from_dict(sketch)
+            for key, sketch in state["sketches"].items()
+        }
+        analysis.offsets = state["offsets"]
+        analysis.last_blocks = state["last_blocks"]
+        analysis.blocks = set(state["blocks"])
+        return analysis
+
+    def save(self, filename: str) -> None:
+        state = {
+            "sketches": {
+                _series_key(series): sketch.to_dict()
+                for series, sketch in sorted(self.sketches.items())
+            },
+            "offsets": self.offsets,
+            "last_blocks": self.last_blocks,
+            "blocks": sorted(self.blocks),
+        }
+        tmp_file = filename + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, filename)
+
+    def update(self, filenames: Iterable[str]) -> int:
+        """Folds the lines appended to `filenames` since the last update and
+        returns how many blocks were new."""
+        filenames = list(filenames)
+        for filename in filenames:
+            key = path.basename(filename)
+            if path.getsize(filename) < self.offsets.get(key, 0):
+                logging.warning("%s was truncated, starting over", filename)
+                self.reset()
+                break
+
+        processed = 0
+        for filename in filenames:
+            key = path.basename(filename)
+            offset = self.offsets.get(key, 0)
+            with open(filename, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # still being written
+                    offset += len(line)
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning("Skipping invalid line in %s", filename)
+                        continue
+                    self.last_blocks[key] = max(
+                        self.last_blocks.get(key, 0), item["block"]
+                    )
+                    if item["block"] in self.blocks:
+                        continue
+                    self._add(item)
+                    self.blocks.add(item["block"])
+                    processed += 1
+            self.offsets[key] = offset
+        return processed
+
+    def _add(self, item) -> None:
+        for pool, deviations in item["deviations"].items():
+            for i, deviation in enumerate(deviations):
+                self.sketches.setdefault((pool, i), TDigest()).add(deviation)
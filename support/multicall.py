@@ -0,0 +1,119 @@
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from eth_abi import decode_abi, encode_abi
+from eth_utils import function_signature_to_4byte_selector
+
+from support.async_fetcher import TokenBucket
+from support.rpc_cache import RpcCache
+
+# deployed at the same address on every chain, from block 14353601 on mainnet
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+AGGREGATE3_SELECTOR = function_signature_to_4byte_selector(
+    "aggregate3((address,bool,bytes)[])"
+)
+MAX_CALLS_PER_REQUEST = 500
+
+BlockIdentifier = Union[int, str]
+
+
+class Call(NamedTuple):
+    target: str
+    calldata: bytes
+    decoder: Callable[[bytes], Any]
+
+
+def encode_aggregate3(calls: Sequence[Call]) -> bytes:
+    encoded = encode_abi(
+        ["(address,bool,bytes)[]"],
+        [[(call.target, True, call.calldata) for call in calls]],
+    )
+    return AGGREGATE3_SELECTOR + encoded
+
+
+def decode_aggregate3(data: bytes) -> List[Tuple[bool, bytes]]:
+    (results,) = decode_abi(["(bool,bytes)[]"], data)
+    return list(results)
+
+
+class Multicall:
+    """Batches constant calls into Multicall3 `aggregate3` eth_calls.
+
+    Calls are queued with `add` using brownie contract methods (anything with
+    `_address`, `encode_input` and `decode_output`) and sent by `execute`, at
+    most `max_calls` per eth_call. As with `brownie.multicall`, failed calls
+    resolve to None instead of raising.
+
+    When an `RpcCache` is given, the results of calls made at a block number
+    are read from it and only the missing calls are sent, successful results
+    being stored in it. When a `rate_limiter` is given, a token is taken from
+    it before every eth_call sent.
+    """
+
+    def __init__(
+        self,
+        web3,
+        address: str = MULTICALL3_ADDRESS,
+        max_calls: int = MAX_CALLS_PER_REQUEST,
+        cache: Optional[RpcCache] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+    ):
+        self.web3 = web3
+        self.address = address
+        self.max_calls = max_calls
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.requests = 0
+        self._calls: List[Call] = []
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def add(self, method, *args) -> int:
+        calldata = bytes.fromhex(method.encode_input(*args)[2:])
+        self._calls.append(Call(method._address, calldata, method.decode_output))
+        return len(self._calls) - 1
+
+    def _aggregate(
+        self, calls: Sequence[Call], block: BlockIdentifier
+    ) -> List[Tuple[bool, bytes]]:
+        results: List[Tuple[bool, bytes]] = []
+        for start in range(0, len(calls), self.max_calls):
+            batch = calls[start : start + self.max_calls]
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            data = self.web3.eth.call(
+                {"to": self.address, "data": "0x" + encode_aggregate3(batch).hex()},
+                block,
+            )
+            self.requests += 1
+            results.extend(decode_aggregate3(data))
+        return results
+
+    def _aggregate_cached(
+        self, calls: Sequence[Call], block: int, cache: RpcCache
+    ) -> List[Tuple[bool, bytes]]:
+        keys = [(block, call.target, call.calldata) for call in calls]
+        results = cache.get_many(keys)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            fetched = self._aggregate([calls[i] for i in missing], block)
+            cache.put_many({keys[i]: result for i, result in zip(missing, fetched)})
+            for i, result in zip(missing, fetched):
+                results[i] = result
+        return results  # type: ignore[return-value]
+
+    def execute(self, block: BlockIdentifier = "latest") -> List[Optional[Any]]:
+        calls, self._calls = self._calls, []
+        if self.cache is not None and isinstance(block, int):
+            raw_results = self._aggregate_cached(calls, block, self.cache)
+        else:
+            raw_results = self._aggregate(calls, block)
+
+        results: List[Optional[Any]] = []
+        for call, (success, return_data) in zip(calls, raw_results):
+            # calls to addresses without code succeed with no data
+            if success and return_data:
+                results.append(call.decoder(return_data))
+            else:
+                results.append(None)
+        return results
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+COMPRESSION = 500
+
+
+class TDigest:
+    """Merging t-digest (Dunning & Ertl) using the k1 scale function.
+
+    Centroids near the tails are kept small, which makes high quantiles such
+    as q99.9 precise, while the whole digest stays at most a few times
+    `compression` centroids whatever the number of values added. Digests
+    built on different parts of the data can be merged.
+    """
+
+    def __init__(self, compression: float = COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[float] = []
+        self._buffer_size = int(5 * compression)
+
+    def __len__(self) -> int:
+        return int(self.count + len(self._buffer))
+
+    def add(self, value: float) -> None:
+        self._buffer.append(value)
+        if len(self._buffer) >= self._buffer_size:
+            self._compress()
+
+    def update(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: TDigest) -> None:
+        other._compress()
+        self._compress(other.means, other.weights)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _compress(
+        self, means: np.ndarray = np.empty(0), weights: np.ndarray = np.empty(0)
+    ) -> None:
+        if self._buffer:
+            buffer = np.asarray(self._buffer, dtype=np.float64)
+            self.min = min(self.min, buffer.min())
+            self.max = max(self.max, buffer.max())
+            means = np.concatenate([means, buffer])
+            weights = np.concatenate([weights, np.ones(len(buffer))])
+            self._buffer = []
+        if len(means) == 0:
+            return
+
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+
+        # greedily merges neighbours as long as a centroid spans at most one
+        # unit of k(q) = compression / (2 pi) * asin(2q - 1)
+        merged_means: List[float] = []
+        merged_weights: List[float] = []
+        scale = self.compression / (2 * math.pi)
+        q_left = 0.0
+        k_limit = scale * math.asin(2 * q_left - 1) + 1
+        mean, weight = means[0], weights[0]
+        for next_mean, next_weight in zip(means[1:].tolist(), weights[1:].tolist()):
+            q_right = (q_left * total + weight + next_weight) / total
+            if scale * math.asin(min(1.0, 2 * q_right - 1)) <= k_limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged_means.append(mean)
+                merged_weights.append(weight)
+                q_left += weight / total
+                k_limit = scale * math.asin(min(1.0, 2 * q_left - 1)) + 1
+                mean, weight = next_mean, next_weight
+        merged_means.append(mean)
+        merged_weights.append(weight)
+
+        self.means = np.asarray(merged_means)
+        self.weights = np.asarray(merged_weights)
+        self.count = total
+
+    def quantile(self, q: float) -> float:
+        """Interpolates linearly between the centers of the centroids, at the
+        rank `q * (count + 1)` like the exclusive method of
+        `statistics.quantiles`. Beyond the first and last centers the result
+        is clamped to the min and max, unless every centroid holds a single
+        value: the exclusive method is then reproduced exactly, including its
+        extrapolation in the tails."""
+        self._compress()
+        if len(self.means) == 0:
+            return math.nan
+        rank = q * (self.count + 1)
+        if len(self.means) >= 2 and len(self.means) == self.count:
+            j = min(max(int(rank), 1), len(self.means) - 1)
+            low, high = self.means[j - 1], self.means[j]
+            return float(low + (high - low) * (rank - j))
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0.0], centers, [self.count]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(rank - 0.5, positions, values))
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._compress()
+        return {
+            "compression": self.compression,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> TDigest:
+        digest = cls(data["compression"])
+        digest.means = np.asarray(data["means"], dtype=np.float64)
+        digest.weights = np.asarray(data["weights"], dtype=np.float64)
+        digest.count = float(digest.weights.sum())
+        digest.min = data["min"]
+        digest.max = data["max"]
+        return digest
@@ -0,0 +1,62 @@
+"""Replica of `CNCMintingRebalancingRewardsHandler` over many paths at once.
+
+Amounts are Python ints in NumPy object arrays, one row per path, so that
+rewards round exactly like the contract.
+"""
+
+from typing import Sequence, Union
+
+import numpy as np
+
+from support.curve_lp_oracle import convert_scale
+from support.weight_manager import ONE, mul_down
+
+MAX_REBALANCING_REWARDS = 1_900_000 * ONE
+# gives out 5 dollars per hour (1 CNC = 3 USD) for every 10,000 USD to shift
+INITIAL_REBALANCING_REWARD_PER_DOLLAR_PER_SECOND = 5 * ONE // (3600 * 1 * 10_000 * 3)
+MAX_WEIGHT_UPDATE_MIN_DELAY = 21 * 86400  # Controller.MAX_WEIGHT_UPDATE_MIN_DELAY
+
+IntArray = Union[Sequence[int], np.ndarray]
+
+
+def compute_rebalancing_rewards(
+    deviation_before: IntArray,
+    deviation_after: IntArray,
+    elapsed: IntArray,
+    decimals: int,
+    underlying_price: IntArray,
+    reward_factor: IntArray = ONE,
+    reward_per_dollar_per_second: int = INITIAL_REBALANCING_REWARD_PER_DOLLAR_PER_SECOND,
+) -> np.ndarray:
+    """`computeRebalancingRewards` for every row, `elapsed` being the seconds
+    since `rebalancingRewardsActivatedAt`. Deviations are in underlying units
+    and the price has 18 decimals."""
+    deviation_before = np.asarray(deviation_before, dtype=object)
+    deviation_after = np.asarray(deviation_after, dtype=object)
+    elapsed = np.minimum(np.asarray(elapsed, dtype=object), MAX_WEIGHT_UPDATE_MIN_DELAY)
+    delta = np.where(
+        deviation_before < deviation_after, 0, deviation_before - deviation_after
+    )
+    rewards = mul_down(
+        mul_down(
+            mul_down(
+                elapsed * reward_per_dollar_per_second,
+                convert_scale(delta, decimals, 18),
+            ),
+            reward_factor,
+        ),
+        underlying_price,
+    )
+    return np.asarray(rewards, dtype=object)
+
+
+def distribute_rebalancing_rewards(
+    rewards: IntArray, total_cnc_minted: np.ndarray
+) -> np.ndarray:
+    """`_distributeRebalancingRewards`: caps `rewards` so that no path mints
+    more than `MAX_REBALANCING_REWARDS` in total, updates `total_cnc_minted`
+    in place and returns the minted amounts."""
+    rewards = np.asarray(rewards, dtype=object)
+    minted = np.minimum(rewards, MAX_REBALANCING_REWARDS - total_cnc_minted)
+    total_cnc_minted += minted
+    return minted
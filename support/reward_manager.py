@@ -0,0 +1,219 @@
+"""Offline replica of the `RewardManager` accounting of a Conic pool.
+
+`PoolRewards` replays `poolCheckpoint` and the other updates of the pool-wide
+`earnedIntegral` and `lastHoldings`, one operation at a time. `AccountRewards`
+holds `accountShare` and `accountIntegral` of every account in arrays and
+folds batches of account events (`accountCheckpoint` on stake, unstake and
+claim) at once, given the pool integrals of every event.
+
+Rewards are ordered as `REWARD_KEYS` everywhere and values are Python ints,
+in NumPy object arrays for the per-account state, so that every `mulDown`
+and `divDown` rounds like the contract.
+"""
+
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from support.weight_manager import ONE, div_down, mul_down
+
+CNC, CRV, CVX = 0, 1, 2
+REWARD_KEYS = ("cnc", "crv", "cvx")
+
+Rewards = Tuple[int, int, int]  # (cnc, crv, cvx)
+IntArray = Union[Sequence[int], np.ndarray]
+
+
+class EventKind:
+    CHECKPOINT = 0  # accountCheckpoint without any balance change
+    STAKE = 1
+    UNSTAKE = 2
+    CLAIM = 3  # claimEarnings, the share is zeroed after the checkpoint
+
+
+class PoolRewards:
+    """Pool-wide state of `RewardManager`. `holdings` are what
+    `_getHoldingsWithCliffInfo` reads: balances of the Conic pool plus CRV
+    and CVX claimable on Convex and CNC claimable from the `LpTokenStaker`."""
+
+    def __init__(self, fee_percentage: int = 0):
+        self.earned_integral = [0, 0, 0]
+        self.last_holdings = [0, 0, 0]
+        self.fee_percentage = fee_percentage
+
+    @property
+    def fees_enabled(self) -> bool:
+        return self.fee_percentage > 0
+
+    def _earned(self, holdings: Rewards) -> List[int]:
+        earned = [holdings[key] - self.last_holdings[key] for key in range(3)]
+        assert earned[CNC] >= 0 and earned[CRV] >= 0, "holdings below last holdings"
+        return earned
+
+    def _update_earned(
+        self, earned: List[int], holdings: List[int], total_staked: int
+    ) -> Rewards:
+        if total_staked > 0:
+            for key in range(3):
+                self.earned_integral[key] += div_down(earned[key], total_staked)
+                self.last_holdings[key] = holdings[key]
+        return self.integrals
+
+    def checkpoint(self, holdings: Rewards, total_staked: int) -> Rewards:
+        """`poolCheckpoint`, returns the new earned integrals."""
+        holdings = list(holdings)
+        earned = self._earned(holdings)
+        earned[CVX] = max(earned[CVX], 0)
+        if self.fees_enabled:
+            for key in (CRV, CVX):
+                fee = mul_down(earned[key], self.fee_percentage)
+                earned[key] -= fee
+                holdings[key] -= fee
+        return self._update_earned(earned, holdings, total_staked)
+
+    def observed_checkpoint(self, holdings: Rewards, total_staked: int) -> Rewards:
+        """`poolCheckpoint` replayed from the holdings read right after it ran.
+        Fees were already sent to the fee recipient by then, so `holdings` are
+        the new last holdings and what they gained is earned net of fees,
+        whatever the fee percentage was."""
+        holdings = list(holdings)
+        earned = self._earned(holdings)
+        earned[CVX] = max(earned[CVX], 0)
+        return self._update_earned(earned, holdings, total_staked)
+
+    def sold_reward_tokens(self, received_cnc: int, total_staked: int) -> Rewards:
+        """CNC bought with the extra rewards (`SoldRewardTokens`)."""
+        if total_staked > 0 and received_cnc > 0:
+            self.earned_integral[CNC] += div_down(received_cnc, total_staked)
+            self.last_holdings[CNC] += received_cnc
+        return self.integrals
+
+    def claimed(self, holdings_after: Rewards) -> None:
+        # `claimEarnings` resets the last holdings once the rewards are sent
+        self.last_holdings = list(holdings_after)
+
+    @property
+    def integrals(self) -> Rewards:
+        cnc, crv, cvx = self.earned_integral
+        return cnc, crv, cvx
+
+    def pending_integrals(self, holdings: Rewards, total_staked: int) -> Rewards:
+        """Integrals used by the `claimableRewards` view, which adds what was
+        earned since the last checkpoint without updating the state."""
+        integrals = list(self.earned_integral)
+        if total_staked > 0:
+            earned = self._earned(holdings)
+            for key in range(3):
+                if key != CNC and self.fees_enabled:
+                    earned[key] = mul_down(earned[key], ONE - self.fee_percentage)
+                integrals[key] += div_down(earned[key], total_staked)
+        cnc, crv, cvx = integrals
+        return cnc, crv, cvx
+
+
+class AccountRewards:
+    """Staked balance, `accountShare` and `accountIntegral` of every account,
+    rows being assigned to accounts in order of appearance."""
+
+    def __init__(self):
+        self.accounts: Dict[str, int] = {}
+        self.balances = np.zeros(0, dtype=object)
+        self.shares = np.zeros((0, 3), dtype=object)
+        self.integrals = np.zeros((0, 3), dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    @property
+    def total_staked(self) -> int:
+        return int(self.balances.sum())
+
+    def indices(self, accounts: Sequence[str]) -> np.ndarray:
+        for account in accounts:
+            self.accounts.setdefault(account, len(self.accounts))
+        missing = len(self.accounts) - len(self.balances)
+        if missing > 0:
+            self.balances = np.concatenate(
+                [self.balances, np.zeros(missing, dtype=object)]
+            )
+            self.shares = np.concatenate([self.shares, np.zeros((missing, 3), object)])
+            self.integrals = np.concatenate(
+                [self.integrals, np.zeros((missing, 3), object)]
+            )
+        return np.array([self.accounts[account] for account in accounts], dtype=int)
+
+    def fold(
+        self,
+        accounts: Sequence[str],
+        kinds: IntArray,
+        amounts: IntArray,
+        integrals: IntArray,
+    ) -> np.ndarray:
+        """Applies events in order, `integrals` having one row of pool
+        integrals per event, as left by the `poolCheckpoint` of the event.
+        Returns the amounts claimed by every event, shape `(events, 3)`.
+
+        Events are grouped by account, and the checkpoints of every account
+        are computed with cumulative sums, so the cost does not depend on how
+        events of different accounts interleave.
+        """
+        events = len(accounts)
+        claimed = np.zeros((events, 3), dtype=object)
+        if events == 0:
+            return claimed
+        rows = self.indices(accounts)
+        kinds = np.asarray(kinds)
+        amounts = np.asarray(amounts, dtype=object)
+        integrals = np.asarray(integrals, dtype=object).reshape(events, 3)
+        deltas = np.where(
+            kinds == EventKind.STAKE,
+            amounts,
+            np.where(kinds == EventKind.UNSTAKE, -amounts, 0),
+        ).astype(object)
+
+        order = np.argsort(rows, kind="stable")
+        rows, deltas, integrals = rows[order], deltas[order], integrals[order]
+        claims = kinds[order] == EventKind.CLAIM
+        positions = np.arange(events)
+        starts = np.concatenate([[True], rows[1:] != rows[:-1]])
+        ends = np.concatenate([starts[1:], [True]])
+        group_start = np.maximum.accumulate(np.where(starts, positions, 0))
+
+        # balance of the account before every event
+        staked = np.cumsum(deltas) - deltas
+        balances = self.balances[rows] + staked - staked[group_start]
+        assert (balances + deltas >= 0).all(), "unstaking more than staked"
+
+        # accountIntegral before every event
+        previous = np.empty_like(integrals)
+        previous[1:] = integrals[:-1]
+        previous[starts] = self.integrals[rows[starts]]
+        earned = mul_down(balances[:, None], integrals - previous)
+
+        # shares accumulated since the start of the group, then since the
+        # previous claim of the account
+        cumulative = np.cumsum(earned, axis=0)
+        since_start = cumulative - (cumulative[group_start] - earned[group_start])
+        last_claim = np.maximum.accumulate(np.where(claims, positions, -1))
+        previous_claim = np.concatenate([[-1], last_claim[:-1]])
+        claimed_before = previous_claim >= group_start
+        shares = np.where(
+            claimed_before[:, None],
+            since_start - since_start[np.maximum(previous_claim, 0)],
+            self.shares[rows] + since_start,
+        )
+        claimed[order[claims]] = shares[claims]
+
+        last = np.flatnonzero(ends)
+        self.balances[rows[last]] = balances[last] + deltas[last]
+        self.integrals[rows[last]] = integrals[last]
+        self.shares[rows[last]] = np.where(claims[last][:, None], 0, shares[last])
+        return claimed
+
+    def claimable(self, integrals: Rewards) -> np.ndarray:
+        """`claimableRewards` of every account, shape `(accounts, 3)`, given
+        the pool integrals of `PoolRewards.pending_integrals`."""
+        integrals = np.asarray(integrals, dtype=object)[None, :]
+        return self.shares + mul_down(
+            self.balances[:, None], integrals - self.integrals
+        )
@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+RPC_CACHE_PATH = "build/rpc-cache.sqlite"
+
+# (block, to, calldata)
+CallKey = Tuple[int, str, bytes]
+# (success, return data)
+CallResult = Tuple[bool, bytes]
+
+
+class RpcCache:
+    """On-disk cache of eth_call results keyed by (chain, block, to, calldata).
+
+    Calls at a given past block always return the same result, so only calls
+    made at an explicit block number should be cached, and only for blocks
+    that are deep enough not to be reorged.
+    """
+
+    def __init__(self, chain_id: int, filename: str = RPC_CACHE_PATH):
+        self.chain_id = chain_id
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        # the connection is shared by the fetcher threads
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS calls (
+                chain_id INTEGER NOT NULL,
+                block INTEGER NOT NULL,
+                target TEXT NOT NULL,
+                calldata BLOB NOT NULL,
+                success INTEGER NOT NULL,
+                return_data BLOB NOT NULL,
+                PRIMARY KEY (chain_id, block, target, calldata)
+            ) WITHOUT ROWID""")
+        self._db.commit()
+
+    def get_many(self, keys: Sequence[CallKey]) -> List[Optional[CallResult]]:
+        results: List[Optional[CallResult]] = []
+        with self._lock:
+            for block, target, calldata in keys:
+                row = self._db.execute(
+                    "SELECT success, return_data FROM calls WHERE chain_id = ?"
+                    " AND block = ? AND target = ? AND calldata = ?",
+                    (self.chain_id, block, target.lower(), calldata),
+                ).fetchone()
+                results.append(None if row is None else (bool(row[0]), row[1]))
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, entries: Dict[CallKey, CallResult]) -> None:
+        """Stores the successful results of `entries`. Failures are not cached
+        since they can come from the node (e.g. running out of gas or state
+        pruned) rather than from the call itself."""
+        rows = [
+            (self.chain_id, block, target.lower(), calldata, int(success), data)
+            for (block, target, calldata), (success, data) in entries.items()
+            if success
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO calls VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -2,20 +2,23 @@ from __future__ import annotations
 
 import functools
 import math
-from dataclasses import dataclass
 from typing import List, Tuple, Union
 
 from support.tracked_number import TrackedNumber
 
 
-@dataclass
 @functools.total_ordering
 class ScaledInt(TrackedNumber["ScaledInt"]):
-    value: int
-    decimals: int = 18
+    __slots__ = ("value", "decimals")
 
-    def __post_init__(self):
-        self._log_number(self)
+    def __init__(self, value: int, decimals: int = 18):
+        self.value = value
+        self.decimals = decimals
+        if TrackedNumber.tracer is not None:
+            self._log_number(self, value)
+
+    def __repr__(self) -> str:
+        return f"ScaledInt(value={self.value!r}, decimals={self.decimals!r})"
 
     @classmethod
     def from_int(cls, value, decimals=18):
@@ -87,6 +90,6 @@ class ScaledInt(TrackedNumber["ScaledInt"]):
 
     @classmethod
     def get_topn(cls, n=5) -> List[Tuple[str, int]]:
-        return sorted([(k, abs(r.value)) for k, r in cls.history], key=lambda x: -x[1])[
-            :n
-        ]
+        if TrackedNumber.tracer is None:
+            return []
+        return TrackedNumber.tracer.topn(n)
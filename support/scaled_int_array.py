@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import math
+from typing import Iterable, Iterator, List, Sequence, Union
+
+import numpy as np
+
+from support.scaled_int import ScaledInt
+
+Operand = Union["ScaledIntArray", ScaledInt, int]
+
+
+class ScaledIntArray:
+    """Column of fixed-point values sharing the same `decimals`.
+
+    Values are kept in a NumPy object array so that every element is a Python
+    int and operations round exactly like `ScaledInt` does element-wise.
+    Mixed operations with a `ScaledInt` need the array on the left-hand side.
+    """
+
+    __slots__ = ("values", "decimals")
+
+    def __init__(self, values: Union[Sequence[int], np.ndarray], decimals: int = 18):
+        values = np.asarray(values)
+        if values.dtype != object:
+            values = values.astype(object)
+        assert values.ndim == 1, "ScaledIntArray must be one-dimensional"
+        self.values = values
+        self.decimals = decimals
+
+    @classmethod
+    def from_ints(cls, values: Iterable[int], decimals=18) -> ScaledIntArray:
+        return cls([value * 10**decimals for value in values], decimals)
+
+    @classmethod
+    def from_fixed(cls, values: Iterable[int], decimals=18) -> ScaledIntArray:
+        return cls(list(values), decimals)
+
+    @classmethod
+    def from_scaled(cls, values: Sequence[ScaledInt], decimals=18) -> ScaledIntArray:
+        for value in values:
+            assert value.decimals == decimals, "Decimals must be the same"
+        return cls([value.value for value in values], decimals)
+
+    def _operand(self, other: Union[ScaledIntArray, ScaledInt]):
+        assert self.decimals == other.decimals, "Decimals must be the same"
+        return other.values if isinstance(other, ScaledIntArray) else other.value
+
+    def _compared(self, other: Operand):
+        if isinstance(other, int):
+            return other * 10**self.decimals
+        return self._operand(other)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return ScaledInt(self.values[index], self.decimals)
+        return ScaledIntArray(self.values[index], self.decimals)
+
+    def __iter__(self) -> Iterator[ScaledInt]:
+        return (ScaledInt(value, self.decimals) for value in self.values)
+
+    def __repr__(self) -> str:
+        values = self.values.tolist()
+        return f"ScaledIntArray(values={values!r}, decimals={self.decimals!r})"
+
+    def tolist(self) -> List[ScaledInt]:
+        return list(self)
+
+    def sqrt(self) -> ScaledIntArray:
+        scale = 10**self.decimals
+        return ScaledIntArray(
+            [int(math.sqrt(value * scale)) for value in self.values], self.decimals
+        )
+
+    def __add__(self, other: Union[ScaledIntArray, ScaledInt]) -> ScaledIntArray:
+        return ScaledIntArray(self.values + self._operand(other), self.decimals)
+
+    def __sub__(self, other: Union[ScaledIntArray, ScaledInt]) -> ScaledIntArray:
+        return ScaledIntArray(self.values - self._operand(other), self.decimals)
+
+    def __neg__(self) -> ScaledIntArray:
+        return ScaledIntArray(-self.values, self.decimals)
+
+    def __abs__(self) -> ScaledIntArray:
+        return ScaledIntArray(np.abs(self.values), self.decimals)
+
+    def __mul__(self, other: Operand) -> ScaledIntArray:
+        if isinstance(other, int):
+            return ScaledIntArray(self.values * other, self.decimals)
+        return ScaledIntArray(
+            self.values * self._operand(other) // 10**self.decimals, self.decimals
+        )
+
+    def __rmul__(self, other: int) -> ScaledIntArray:
+        return self * other
+
+    def __truediv__(self, other: Operand) -> ScaledIntArray:
+        if isinstance(other, int):
+            return ScaledIntArray(self.values // other, self.decimals)
+        return ScaledIntArray(
+            self.values * 10**self.decimals // self._operand(other), self.decimals
+        )
+
+    def __pow__(self, exp: int) -> ScaledIntArray:
+        scale = 10**self.decimals
+        result = np.full(len(self.values), scale, dtype=object)
+        for _ in range(exp):
+            result = result * self.values // scale
+        return ScaledIntArray(result, self.decimals)
+
+    def __eq__(self, other: Operand) -> np.ndarray:  # type: ignore[override]
+        if isinstance(other, (ScaledInt, ScaledIntArray)) and (
+            other.decimals != self.decimals
+        ):
+            return np.zeros(len(self.values), dtype=bool)
+        return np.asarray(self.values == self._compared(other), dtype=bool)
+
+    def __ne__(self, other: Operand) -> np.ndarray:  # type: ignore[override]
+        return ~(self == other)
+
+    def __lt__(self, other: Operand) -> np.ndarray:
+        return np.asarray(self.values < self._compared(other), dtype=bool)
+
+    def __le__(self, other: Operand) -> np.ndarray:
+        return np.asarray(self.values <= self._compared(other), dtype=bool)
+
+    def __gt__(self, other: Operand) -> np.ndarray:
+        return np.asarray(self.values > self._compared(other), dtype=bool)
+
+    def __ge__(self, other: Operand) -> np.ndarray:
+        return np.asarray(self.values >= self._compared(other), dtype=bool)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def to_float(self) -> np.ndarray:
+        scale = 10**self.decimals
+        return np.array([value / scale for value in self.values], dtype=np.float64)
+
+    def downscale(self, decimals: int) -> ScaledIntArray:
+        return ScaledIntArray(self.values // 10 ** (self.decimals - decimals), decimals)
+
+    def upscale(self, decimals: int) -> ScaledIntArray:
+        return ScaledIntArray(self.values * 10 ** (decimals - self.decimals), decimals)
@@ -0,0 +1,147 @@
+"""Batched version of `token_pricing_reference.get_v1_lp_token_price`.
+
+Prices are computed for all rows at once in float64 using the same
+safeguarded Halley iteration as `YFromDSolver`. Rows whose price ends up
+close to one of the given thresholds, or that cannot be priced in float64,
+are re-priced exactly with the Decimal implementation, and large tables can
+be split across processes.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from support.token_pricing_reference import A_PREC, get_v1_lp_token_price
+
+MAX_ITERATIONS = 64
+RELATIVE_TOLERANCE = 1e-13
+RECHECK_MARGIN = 1e-6
+MIN_ROWS_PER_WORKER = 10_000
+
+
+def _calc_y(x: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    r = np.sqrt(x * (4 * b + x * (a + x) ** 2))
+    return (r - x * (x + a)) / (2 * x)
+
+
+def _solve_x(D: np.ndarray, A: np.ndarray, price: np.ndarray) -> Tuple[np.ndarray, ...]:
+    n = 2
+    a = D * A_PREC / (A * n) - D
+    b = D ** (n + 1) * A_PREC / (A * n ** (2 * n - 1))
+
+    mirrored = price < 1
+    target = np.log(np.where(mirrored, 1 / price, price))
+    x = D / (2 * np.exp(target / 2))
+
+    low, high = np.zeros_like(x), D.copy()
+    active = np.flatnonzero(np.isfinite(x))
+    for _ in range(MAX_ITERATIONS):
+        if active.size == 0:
+            break
+        _x, _a, _b = x[active], a[active], b[active]
+        R = _x * (4 * _b + _x * (_a + _x) ** 2)
+        r = np.sqrt(R)
+        p = (2 * _b - _x * (_a * _x + _x**2 - r)) / (2 * _x * r)
+        N = 3 * _b + _x * (_a**2 + 3 * _a * _x + 3 * _x**2)
+        M = _x * R * r
+        dN = _a**2 + 6 * _a * _x + 9 * _x**2
+        dM = R * r + 3 * _x * r * (2 * _b + _x * (_a + _x) * (_a + 2 * _x))
+        dp = -2 * _b * N / M
+        # M * M overflows float64 for D above ~1e23
+        d2p = -2 * _b * (dN - N * dM / M) / M
+
+        h = np.log(p) - target[active]
+        _low = np.where(h > 0, _x, low[active])
+        _high = np.where(h > 0, high[active], _x)
+        dh = _x * dp / p
+        d2h = dh + _x**2 * d2p / p - dh**2
+        step = -h / dh
+        ratio = h * d2h / dh**2
+        step = np.where(ratio < 1, step / (1 - ratio / 2), step)
+        x_next = _x * np.exp(step)
+        # converged steps are kept even outside the bracket, which x can be an
+        # end of once converged
+        kept = np.abs(x_next - _x) <= RELATIVE_TOLERANCE * _x
+        kept |= (_low <= x_next) & (x_next <= _high)
+        x_next = np.where(kept, x_next, (_low + _high) / 2)
+
+        x[active], low[active], high[active] = x_next, _low, _high
+        converged = ~(np.abs(x_next - _x) > RELATIVE_TOLERANCE * _x)
+        active = active[~converged]
+
+    x = np.where(mirrored, _calc_y(x, a, b), x)
+    return x, a, b
+
+
+def _price_chunk(
+    columns: Tuple[Sequence, ...], thresholds: Sequence[float], margin: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    D, total_supply, A, price_a, price_b = (
+        np.asarray(column, dtype=np.float64) for column in columns
+    )
+    # overflows and divisions by zero end up as non-finite prices, rechecked below
+    with np.errstate(all="ignore"):
+        x, a, b = _solve_x(D, A, price_a)
+        amount_a = x - 0.5
+        amount_b = _calc_y(amount_a, a, b)
+        prices = (amount_a * price_a + amount_b * price_b) / total_supply
+
+    recheck = ~np.isfinite(prices)
+    for threshold in thresholds:
+        recheck |= np.abs(prices - threshold) <= margin * abs(threshold)
+
+    rechecked = np.flatnonzero(recheck)
+    for i in rechecked:
+        row = [Decimal(column[i]) for column in columns]
+        prices[i] = float(get_v1_lp_token_price(*row))
+    return prices, rechecked
+
+
+def get_v1_lp_token_prices(
+    D: Sequence,
+    total_supply: Sequence,
+    A_precise: Sequence,
+    price_a: Sequence,
+    price_b: Sequence,
+    thresholds: Sequence[float] = (),
+    recheck_margin: float = RECHECK_MARGIN,
+    workers: Optional[int] = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the LP token price of every row and the rows that were re-priced
+    with Decimal because they were within `recheck_margin` (relative) of one of
+    the `thresholds` or could not be priced in float64.
+
+    `workers=None` uses one process per core.
+    """
+    columns = [
+        column if isinstance(column, np.ndarray) else np.asarray(column, dtype=object)
+        for column in (D, total_supply, A_precise, price_a, price_b)
+    ]
+    rows = len(columns[0])
+    assert all(len(column) == rows for column in columns), "columns lengths differ"
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, max(1, rows // MIN_ROWS_PER_WORKER))
+    if workers == 1:
+        return _price_chunk(tuple(columns), thresholds, recheck_margin)
+
+    bounds = np.linspace(0, rows, workers + 1, dtype=int)
+    chunks = [
+        tuple(column[start:end] for column in columns)
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+    prices: List[np.ndarray] = []
+    rechecked: List[np.ndarray] = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_price_chunk, chunk, thresholds, recheck_margin)
+            for chunk in chunks
+        ]
+        for start, future in zip(bounds[:-1], futures):
+            chunk_prices, chunk_rechecked = future.result()
+            prices.append(chunk_prices)
+            rechecked.append(chunk_rechecked + start)
+    return np.concatenate(prices), np.concatenate(rechecked)
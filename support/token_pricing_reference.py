@@ -1,6 +1,13 @@
-from decimal import Decimal
+from decimal import Decimal, localcontext
+from typing import Tuple
 
 A_PREC = 100
+# digits used by YFromDSolver, so that the stopping test and `y` stay exact
+# enough for D in wei (the default context only has 28)
+SOLVER_PRECISION = 60
+RELATIVE_TOLERANCE = Decimal("1e-30")
+MAX_ITERATIONS = 255
+
 
 # functions to simplify the iterative process
 def calc_a(D: Decimal, A: Decimal, n: int) -> Decimal:
@@ -81,7 +88,100 @@ def get_v1_lp_token_price(
     price_a: Decimal,
     price_b: Decimal,
 ) -> Decimal:
-    amount_asset_a = calc_y_from_D(D, A_precise, price_a)
-    amount_asset_b = calc_y_from_x_crv(amount_asset_a, A_precise, D)
+    solver = YFromDSolver(D, A_precise)
+    amount_asset_a, _ = solver.solve(price_a)
+    amount_asset_b = solver.y(amount_asset_a)
     token_price = (amount_asset_a * price_a + amount_asset_b * price_b) / total_supply
     return token_price
+
+
+class YFromDSolver:
+    """Solves `calc_y_from_D` for a fixed (D, A) without recomputing `a`/`b`.
+
+    The marginal price is closed-form in x, so Halley's method is applied to
+    ln(price(x)) - ln(s) in ln(x), where the function is close to linear,
+    falling back to Newton or bisection when the step is not trustworthy.
+    Prices below 1 are solved on the mirrored side of the (symmetric) curve
+    so the iteration always starts where the price is above the target.
+    Everything is computed with `SOLVER_PRECISION` digits.
+    """
+
+    def __init__(self, D: Decimal, A: Decimal, n: int = 2):
+        self.D = D
+        self.A = A
+        self.n = n
+        with localcontext() as ctx:
+            ctx.prec = SOLVER_PRECISION
+            self.a = calc_a(D, A, n)
+            self.b = calc_b(D, A, n)
+
+    def y(self, x: Decimal) -> Decimal:
+        # positive root of y ** 2 + (x + a) * y - b / x = 0
+        a, b = self.a, self.b
+        with localcontext() as ctx:
+            ctx.prec = SOLVER_PRECISION
+            r = (x * (4 * b + x * (a + x) ** 2)).sqrt()
+            return (r - x * (x + a)) / (2 * x)
+
+    def _price_derivatives(self, x: Decimal) -> Tuple[Decimal, Decimal, Decimal]:
+        a, b = self.a, self.b
+        R = x * (4 * b + x * (a + x) ** 2)
+        r = R.sqrt()
+        price = (2 * b - x * (a * x + x**2 - r)) / (2 * x * r)
+        # same as compute_ddf_for_x, written as N / M to differentiate it again
+        N = 3 * b + x * (a**2 + 3 * a * x + 3 * x**2)
+        M = x * R * r
+        dN = a**2 + 6 * a * x + 9 * x**2
+        dM = R * r + 3 * x * r * (2 * b + x * (a + x) * (a + 2 * x))
+        d_price = -2 * b * N / M
+        d2_price = -2 * b * (dN * M - N * dM) / (M * M)
+        return price, d_price, d2_price
+
+    def solve(
+        self, price: Decimal, tolerance: Decimal = RELATIVE_TOLERANCE
+    ) -> Tuple[Decimal, int]:
+        """Returns x minus 0.5, as `calc_y_from_D`, and the iterations used.
+        The iteration stops once a step moves x by less than `tolerance`
+        times x. The offset is capped to x / 2 so that x stays in (0, D]
+        when the root is below 1."""
+        with localcontext() as ctx:
+            ctx.prec = SOLVER_PRECISION
+            x, iterations = self._solve(price, tolerance)
+            return x - min(x / 2, Decimal("0.5")), iterations
+
+    def _solve(self, price: Decimal, tolerance: Decimal) -> Tuple[Decimal, int]:
+        mirrored = price < 1
+        if mirrored:
+            price = 1 / price
+        log_price = price.ln()
+
+        # the price is decreasing in x, the root is below D / 2 after mirroring
+        low, high = Decimal(0), self.D
+        x = self.D / (2 * price.sqrt())
+        for iterations in range(1, MAX_ITERATIONS + 1):
+            p, dp, d2p = self._price_derivatives(x)
+            h = p.ln() - log_price
+            if h > 0:
+                low = x
+            else:
+                high = x
+            dh = x * dp / p
+            d2h = dh + x**2 * d2p / p - dh**2
+            # Halley's correction of the Newton step, unless it is unstable
+            step = -h / dh
+            ratio = h * d2h / dh**2
+            if ratio < 1:
+                step /= 1 - ratio / 2
+            x_next = x * step.exp()
+            # tested before the bracket, which x can be an end of once converged
+            if abs(x_next - x) <= tolerance * x_next:
+                x = x_next
+                break
+            # steps leaving the bracket, which is within (0, D], are bisected
+            if not low < x_next <= high:
+                x_next = (low + high) / 2
+            x = x_next
+
+        if mirrored:
+            x = self.y(x)
+        return x, iterations
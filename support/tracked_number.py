@@ -1,25 +1,124 @@
 from __future__ import annotations
 
-import inspect
+import heapq
+import itertools
+import sys
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import ClassVar, Generic, List, Tuple, TypeVar, cast
+from types import FrameType
+from typing import (
+    ClassVar,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 T = TypeVar("T")
 
+# (function, line) of the operation that created the number and its two callers
+CallSite = Tuple[Tuple[str, int], ...]
+CALL_SITE_DEPTH = 3
+
+
+def format_call_site(call_site: CallSite) -> str:
+    return " -> ".join(f"{function} ({lineno})" for function, lineno in call_site[::-1])
+
 
 @dataclass
-class TrackedNumber(Generic[T]):
-    _history: ClassVar[List[Tuple[str, TrackedNumber]]] = []
+class CallSiteStats:
+    count: int = 0
+    max: int = 0
+    min: int = 0
+    abs_sum: int = 0
+
+    def add(self, value: int) -> None:
+        if self.count == 0:
+            self.max = self.min = value
+        else:
+            self.max = max(self.max, value)
+            self.min = min(self.min, value)
+        self.count += 1
+        self.abs_sum += abs(value)
+
+
+class NumberTracer(Generic[T]):
+    """Keeps the `top_n` largest numbers seen and aggregates per call site.
+
+    Only one number every `1 / sample_rate` is recorded and memory does not
+    grow with the number of values traced.
+    """
+
+    def __init__(self, top_n: int = 20, sample_rate: float = 1.0):
+        assert top_n > 0, "top_n must be positive"
+        assert 0 < sample_rate <= 1, "sample_rate must be in (0, 1]"
+        self.top_n = top_n
+        self.sample_every = max(1, round(1 / sample_rate))
+        self.seen = 0
+        self.call_sites: Dict[CallSite, CallSiteStats] = {}
+        self._top: List[Tuple[int, int, CallSite, T]] = []
+        self._counter = itertools.count()
+
+    def should_sample(self) -> bool:
+        self.seen += 1
+        return self.seen % self.sample_every == 0
 
-    def _log_number(self, number: T):
-        curframe = inspect.currentframe()
-        calframe = inspect.getouterframes(curframe, 2)
-        formatted_frame = " -> ".join(
-            f"{c.function} ({c.lineno})" for c in calframe[3:6][::-1]
+    def record(self, number: T, value: int, frame: Optional[FrameType]) -> None:
+        call_site = []
+        while frame is not None and len(call_site) < CALL_SITE_DEPTH:
+            call_site.append((frame.f_code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        key = tuple(call_site)
+
+        stats = self.call_sites.get(key)
+        if stats is None:
+            stats = self.call_sites[key] = CallSiteStats()
+        stats.add(value)
+
+        entry = (abs(value), next(self._counter), key, number)
+        if len(self._top) < self.top_n:
+            heapq.heappush(self._top, entry)
+        elif entry[0] > self._top[0][0]:
+            heapq.heapreplace(self._top, entry)
+
+    def topn(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        top = sorted(self._top, key=lambda entry: (-entry[0], entry[1]))
+        return [(format_call_site(key), magnitude) for magnitude, _, key, _ in top][:n]
+
+    def top_numbers(self, n: Optional[int] = None) -> List[Tuple[str, T]]:
+        top = sorted(self._top, key=lambda entry: (-entry[0], entry[1]))
+        return [(format_call_site(key), number) for _, _, key, number in top][:n]
+
+    def summary(self) -> List[Tuple[str, CallSiteStats]]:
+        return sorted(
+            ((format_call_site(k), v) for k, v in self.call_sites.items()),
+            key=lambda item: -item[1].abs_sum,
         )
-        self._history.append((formatted_frame, cast(TrackedNumber, number)))
 
-    @classmethod
-    @property
-    def history(cls) -> List[Tuple[str, T]]:
-        return cast(List[Tuple[str, T]], cls._history)
+
+class TrackedNumber(Generic[T]):
+    __slots__ = ()
+
+    # NOTE: set through `track`; tracing is disabled while this is None
+    tracer: ClassVar[Optional[NumberTracer]] = None
+
+    def _log_number(self, number: T, value: int):
+        tracer = TrackedNumber.tracer
+        if tracer is None or not tracer.should_sample():
+            return
+        # skip this frame and the constructor to start at the operation
+        tracer.record(number, value, sys._getframe(2))
+
+    @staticmethod
+    @contextmanager
+    def track(top_n: int = 20, sample_rate: float = 1.0) -> Iterator[NumberTracer]:
+        tracer: NumberTracer = NumberTracer(top_n, sample_rate)
+        previous = TrackedNumber.tracer
+        TrackedNumber.tracer = tracer
+        try:
+            yield tracer
+        finally:
+            TrackedNumber.tracer = previous
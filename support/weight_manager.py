@@ -0,0 +1,385 @@
+"""Off-chain replica of `ConicPoolWeightManager` and of the deposit and
+withdrawal loops of `BaseConicPool`, over many omnipool states at once.
+
+Every state is a row: allocations have shape `(rows, pools)` and amounts
+shape `(rows,)`. Values are Python ints in NumPy object arrays so that every
+`mulDown`/`divDown` rounds like `ScaledMath`. Operations for which the
+contract would revert leave the state of the row untouched and are reported
+through the `reverted` mask they return.
+
+Curve LP tokens are valued at one underlying each, i.e. LP prices are assumed
+constant over a simulation.
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+ONE = 10**18
+MAX_USD_VALUE_FOR_REMOVING_POOL = 100 * ONE
+MAX_DEVIATION = 2 * 10**16  # BaseConicPool.maxDeviation
+MAX_IDLE_CURVE_LP_RATIO = 5 * 10**16  # BaseConicPool.maxIdleCurveLpRatio
+DEPOSIT_ROUNDING_TOLERANCE = 100  # `1e2` in BaseConicPool._depositToCurve
+
+IntArray = Union[Sequence[int], np.ndarray]
+
+
+def mul_down(a, b):
+    return a * b // ONE
+
+
+def div_down(a, b):
+    return a * ONE // b
+
+
+def _column(values, rows: int) -> np.ndarray:
+    return np.broadcast_to(np.asarray(values, dtype=object), (rows,)).copy()
+
+
+def _safe(values: np.ndarray) -> np.ndarray:
+    # denominators of rows that are discarded anyway
+    return np.where(values == 0, 1, values)
+
+
+class PoolSelection(NamedTuple):
+    indices: np.ndarray  # -1 where the contract reverts
+    amounts: np.ndarray
+
+
+class WeightManager:
+    """`ConicPoolWeightManager` for a list of Curve pools, in the order in
+    which they were added to the omnipool."""
+
+    def __init__(
+        self,
+        pools: Sequence[str],
+        weights: Sequence[int],
+        underlying_decimals: int = 18,
+        underlying_price: int = ONE,
+    ):
+        assert len(pools) == len(weights), "invalid pool weights"
+        self.pools = list(pools)
+        self.underlying_decimals = underlying_decimals
+        self.underlying_price = underlying_price
+        self.set_weights(weights)
+
+    @property
+    def n_pools(self) -> int:
+        return len(self.pools)
+
+    def set_weights(self, weights: Sequence[int]) -> None:
+        assert len(weights) == self.n_pools, "invalid pool weights"
+        assert all(weight >= 0 for weight in weights), "negative weight"
+        assert sum(weights) == ONE, "weights do not sum to 1"
+        self.weights = np.array([int(weight) for weight in weights], dtype=object)
+
+    def update_weights(self, weights: Sequence[Sequence]) -> None:
+        """`updateWeights` with `(pool, weight)` pairs sorted by address."""
+        addresses = [pool.lower() for pool, _ in weights]
+        assert addresses == sorted(set(addresses)), "pools not sorted"
+        by_address = {pool.lower(): int(weight) for pool, weight in weights}
+        assert set(by_address) == {pool.lower() for pool in self.pools}
+        self.set_weights([by_address[pool.lower()] for pool in self.pools])
+
+    def set_weight_to_zero(self, pool: str) -> None:
+        """`_setWeightToZero`, as done when a Curve pool depegs."""
+        index = self.pools.index(pool)
+        weight = self.weights[index]
+        if weight == 0:
+            return
+        assert weight != ONE, "can't remove last pool"
+        scale_up = div_down(ONE, ONE - weight)
+        weights = list(self.weights)
+        weights[index] = 0
+        non_zero = [i for i, weight in enumerate(weights) if weight != 0]
+        total = 0
+        for k, i in enumerate(non_zero):
+            weights[i] = mul_down(weights[i], scale_up)
+            if k == len(non_zero) - 1:
+                weights[i] = ONE - total
+            total += weights[i]
+        self.set_weights(weights)
+
+    def _is_removable(self, allocated: np.ndarray) -> np.ndarray:
+        # zero weight pools still holding at least half of the removal limit
+        allocated_usd = (
+            self.underlying_price * allocated // 10**self.underlying_decimals
+        )
+        return (self.weights == 0) & (
+            allocated_usd >= MAX_USD_VALUE_FOR_REMOVING_POOL // 2
+        )
+
+    def get_deposit_pool(
+        self, total_underlying: IntArray, allocated: IntArray, max_deviation: IntArray
+    ) -> PoolSelection:
+        allocated = np.asarray(allocated, dtype=object)
+        rows = allocated.shape[0]
+        total = _column(total_underlying, rows)[:, None]
+        max_deviation = _column(max_deviation, rows)[:, None]
+
+        target = mul_down(total, self.weights)
+        weight_with_deviation = mul_down(self.weights, ONE + max_deviation)
+        weight_with_deviation = np.where(
+            weight_with_deviation > ONE, ONE, weight_with_deviation
+        )
+        max_amounts = np.where(
+            allocated < target,
+            mul_down(total, weight_with_deviation) - allocated,
+            0,
+        )
+        # the first strictly largest amount is kept, as in the contract
+        indices = np.argmax(max_amounts, axis=1)
+        amounts = max_amounts[np.arange(rows), indices]
+        return PoolSelection(np.where(amounts > 0, indices, -1), amounts)
+
+    def get_withdraw_pool(
+        self, total_underlying: IntArray, allocated: IntArray, max_deviation: IntArray
+    ) -> PoolSelection:
+        allocated = np.asarray(allocated, dtype=object)
+        rows = allocated.shape[0]
+        total = _column(total_underlying, rows)[:, None]
+        max_deviation = _column(max_deviation, rows)[:, None]
+
+        target = mul_down(total, self.weights)
+        min_balance = target - mul_down(target, max_deviation)
+        max_amounts = np.where(allocated > target, allocated - min_balance, 0)
+        indices = np.argmax(max_amounts, axis=1)
+        amounts = max_amounts[np.arange(rows), indices]
+        indices = np.where(amounts > 0, indices, -1)
+
+        # the first removable pool is returned as soon as it is reached
+        removable = self._is_removable(allocated)
+        for row in np.flatnonzero(removable.any(axis=1)):
+            index = int(np.argmax(removable[row]))
+            indices[row] = index
+            amounts[row] = allocated[row, index]
+        return PoolSelection(indices, amounts)
+
+    def compute_total_deviation(
+        self, allocated_underlying: IntArray, allocated: IntArray
+    ) -> np.ndarray:
+        allocated = np.asarray(allocated, dtype=object)
+        total = _column(allocated_underlying, allocated.shape[0])[:, None]
+        return np.abs(mul_down(total, self.weights) - allocated).sum(axis=1)
+
+    def is_balanced(
+        self, allocated: IntArray, total_allocated: IntArray, max_deviation: int
+    ) -> np.ndarray:
+        allocated = np.asarray(allocated, dtype=object)
+        total = _column(total_allocated, allocated.shape[0])[:, None]
+        target = mul_down(total, self.weights)
+        deviation_ratio = div_down(np.abs(target - allocated), _safe(target))
+        # zero weight pools are skipped unless they can still be withdrawn from
+        out_of_bounds = (self.weights != 0) & (deviation_ratio > max_deviation)
+        unbalanced = (out_of_bounds | self._is_removable(allocated)).any(axis=1)
+        return (total[:, 0] == 0) | ~unbalanced
+
+
+class DepositResult(NamedTuple):
+    reverted: np.ndarray
+    # computeTotalDeviation before and after the deposit, 0 when rebalancing
+    # rewards are not active
+    deviation_before: np.ndarray
+    deviation_after: np.ndarray
+
+
+class OmnipoolSimulation:
+    """Underlying held by `rows` independent copies of an omnipool and the
+    `BaseConicPool` flows moving it in and out of the Curve pools.
+
+    Curve LP tokens of every pool are split between the idle balance of the
+    omnipool and the balance staked on Convex, staked whenever the idle
+    share reaches `max_idle_curve_lp_ratio`.
+    """
+
+    def __init__(
+        self,
+        manager: WeightManager,
+        allocated: IntArray,
+        idle_underlying: Optional[IntArray] = None,
+        max_deviation: int = MAX_DEVIATION,
+        max_idle_curve_lp_ratio: int = MAX_IDLE_CURVE_LP_RATIO,
+        rebalancing_rewards_enabled: bool = True,
+    ):
+        self.manager = manager
+        self.staked = np.array(allocated, dtype=object)
+        rows = self.rows
+        assert self.staked.shape == (rows, manager.n_pools)
+        self.idle_lp = np.zeros_like(self.staked)
+        self.idle_underlying = _column(
+            0 if idle_underlying is None else idle_underlying, rows
+        )
+        self.max_deviation = max_deviation
+        self.max_idle_curve_lp_ratio = max_idle_curve_lp_ratio
+        self.rebalancing_rewards_enabled = rebalancing_rewards_enabled
+        self.rebalancing_reward_active = np.zeros(rows, dtype=bool)
+        self.total_deviation_after_weight_update = np.zeros(rows, dtype=object)
+        # number of Convex deposits triggered by the idle ratio, per row
+        self.convex_deposits = np.zeros(rows, dtype=np.int64)
+
+    @property
+    def rows(self) -> int:
+        return self.staked.shape[0]
+
+    @property
+    def allocated(self) -> np.ndarray:
+        return self.staked + self.idle_lp
+
+    @property
+    def total_allocated(self) -> np.ndarray:
+        return self.allocated.sum(axis=1)
+
+    @property
+    def total_underlying(self) -> np.ndarray:
+        return self.total_allocated + self.idle_underlying
+
+    def _max_deviation(self) -> np.ndarray:
+        # `_getMaxDeviation`
+        return np.where(self.rebalancing_reward_active, 0, self.max_deviation)
+
+    def is_balanced(self) -> np.ndarray:
+        return self.manager.is_balanced(
+            self.allocated, self.total_allocated, self.max_deviation
+        )
+
+    def update_weights(self, weights: Sequence[Sequence]) -> None:
+        self.manager.update_weights(weights)
+        self.total_deviation_after_weight_update = self.manager.compute_total_deviation(
+            self.total_underlying, self.allocated
+        )
+        self.rebalancing_reward_active = (
+            self.rebalancing_rewards_enabled & ~self.is_balanced()
+        )
+
+    def _deposit_lp(self, rows: np.ndarray, indices: np.ndarray, amounts) -> None:
+        # CurveAdapter.deposit
+        rows, indices = rows[amounts > 0], indices[amounts > 0]
+        amounts = amounts[amounts > 0]
+        self.idle_lp[rows, indices] += amounts
+        idle = self.idle_lp[rows, indices]
+        total = idle + self.staked[rows, indices]
+        stake = div_down(idle, total) >= self.max_idle_curve_lp_ratio
+        rows, indices = rows[stake], indices[stake]
+        self.staked[rows, indices] += self.idle_lp[rows, indices]
+        self.idle_lp[rows, indices] = 0
+        self.convex_deposits[rows] += 1
+
+    def _withdraw_lp(self, rows: np.ndarray, indices: np.ndarray, amounts) -> None:
+        # CurveAdapter.withdraw, idle LP tokens are used first
+        amounts = np.minimum(amounts, self.allocated[rows, indices])
+        from_idle = np.minimum(amounts, self.idle_lp[rows, indices])
+        self.idle_lp[rows, indices] -= from_idle
+        self.staked[rows, indices] -= amounts - from_idle
+
+    def deposit(self, amounts: IntArray) -> DepositResult:
+        """`depositFor` of `amounts` of underlying, 0 for no deposit."""
+        amounts = _column(amounts, self.rows)
+        active = np.flatnonzero(amounts > 0)
+        reverted = np.zeros(self.rows, dtype=bool)
+        deviation_before = np.zeros(self.rows, dtype=object)
+        deviation_after = np.zeros(self.rows, dtype=object)
+        if len(active) == 0:
+            return DepositResult(reverted, deviation_before, deviation_after)
+
+        allocated_before = self.allocated[active]
+        total_allocated_before = allocated_before.sum(axis=1)
+        remaining = self.idle_underlying[active] + amounts[active]
+        total_after_deposit = total_allocated_before + remaining
+        allocated = allocated_before.copy()
+        max_deviation = self._max_deviation()[active]
+
+        # rows at which every pool receives its deposits, committed only if the
+        # whole loop succeeds
+        steps: List = []
+        pending = np.arange(len(active))
+        while len(pending) > 0:
+            selection = self.manager.get_deposit_pool(
+                total_after_deposit[pending], allocated[pending], max_deviation[pending]
+            )
+            failed = selection.indices < 0
+            reverted[active[pending[failed]]] = True
+            ok = ~failed
+            pending, indices = pending[ok], selection.indices[ok]
+            max_amounts = selection.amounts[ok]
+            max_amounts = np.where(
+                remaining[pending] < max_amounts + DEPOSIT_ROUNDING_TOLERANCE,
+                remaining[pending],
+                max_amounts,
+            )
+            to_deposit = np.minimum(remaining[pending], max_amounts)
+            steps.append((pending, indices, to_deposit))
+            remaining[pending] -= to_deposit
+            allocated[pending, indices] += to_deposit
+            pending = pending[remaining[pending] > 0]
+
+        done = ~reverted[active]
+        for pending, indices, to_deposit in steps:
+            keep = done[pending]
+            self._deposit_lp(active[pending[keep]], indices[keep], to_deposit[keep])
+        rows = active[done]
+        self.idle_underlying[rows] = 0
+
+        # _handleRebalancingRewards
+        rewarded = rows[self.rebalancing_reward_active[rows]]
+        if len(rewarded) > 0:
+            before = np.flatnonzero(np.isin(active, rewarded))
+            deviation_before[rewarded] = self.manager.compute_total_deviation(
+                total_allocated_before[before], allocated_before[before]
+            )
+            deviation_after[rewarded] = self.manager.compute_total_deviation(
+                self.total_allocated[rewarded], self.allocated[rewarded]
+            )
+            balanced = self.manager.is_balanced(
+                self.allocated[rewarded],
+                self.total_allocated[rewarded],
+                self.max_deviation,
+            )
+            self.rebalancing_reward_active[rewarded[balanced]] = False
+        return DepositResult(reverted, deviation_before, deviation_after)
+
+    def withdraw(self, amounts: IntArray) -> np.ndarray:
+        """`withdraw` of `amounts` of underlying, 0 for no withdrawal. Returns
+        the rows that reverted, the amounts withdrawn being capped by what the
+        omnipool holds."""
+        amounts = _column(amounts, self.rows)
+        amounts = np.minimum(amounts, self.total_underlying)
+        reverted = np.zeros(self.rows, dtype=bool)
+        active = np.flatnonzero(amounts > self.idle_underlying)
+        if len(active) > 0:
+            remaining = amounts[active] - self.idle_underlying[active]
+            total_after_withdrawal = self.total_allocated[active] - remaining
+            allocated = self.allocated[active]
+            max_deviation = self._max_deviation()[active]
+
+            steps: List = []
+            pending = np.arange(len(active))
+            while len(pending) > 0:
+                selection = self.manager.get_withdraw_pool(
+                    total_after_withdrawal[pending],
+                    allocated[pending],
+                    max_deviation[pending],
+                )
+                failed = selection.indices < 0
+                reverted[active[pending[failed]]] = True
+                ok = ~failed
+                pending, indices = pending[ok], selection.indices[ok]
+                to_withdraw = np.minimum(remaining[pending], selection.amounts[ok])
+                steps.append((pending, indices, to_withdraw))
+                remaining[pending] -= to_withdraw
+                allocated[pending, indices] -= to_withdraw
+                pending = pending[remaining[pending] > 0]
+
+            done = ~reverted[active]
+            for pending, indices, to_withdraw in steps:
+                keep = done[pending]
+                self._withdraw_lp(
+                    active[pending[keep]], indices[keep], to_withdraw[keep]
+                )
+            # LP tokens are worth one underlying, the shortfall is withdrawn
+            self.idle_underlying[active[done]] = amounts[active[done]]
+
+        withdrawn = np.where(
+            reverted, 0, np.minimum(self.idle_underlying, amounts)
+        ).astype(object)
+        self.idle_underlying -= withdrawn
+        return reverted
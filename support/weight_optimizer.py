@@ -0,0 +1,107 @@
+"""Weight optimizer for all omnipools at once.
+
+For every omnipool of TVL `T` currently at weights `w0`, the weights `w`
+minimize, on the simplex,
+
+    sum_i  S * (w_i T)^2 / L_i  +  R_i * w_i T  +  C * |w_i - w0_i| T
+
+that is the slippage of moving the allocation of every Curve pool of
+liquidity `L_i`, the expected depeg loss `R_i` per dollar allocated and the
+rebalancing cost `C` per dollar of `computeTotalDeviation` created by the
+update. The objective is separable, so the minimum is found by bisecting the
+Lagrange multiplier of `sum(w) = 1`, in closed form for every pool and
+vectorized over omnipools. Omnipools with fewer pools are padded with masked
+columns.
+"""
+
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+ONE = 10**18
+BISECTION_ITERATIONS = 100
+
+
+class Objective(NamedTuple):
+    quadratic: np.ndarray  # (omnipools, pools)
+    linear: np.ndarray
+    absolute: np.ndarray  # (omnipools, 1)
+    current: np.ndarray
+    mask: np.ndarray
+
+    def __call__(self, weights: np.ndarray) -> np.ndarray:
+        costs = (
+            self.quadratic * weights**2
+            + self.linear * weights
+            + self.absolute * np.abs(weights - self.current)
+        )
+        return np.where(self.mask, costs, 0).sum(axis=1)
+
+
+def build_objective(
+    tvl: np.ndarray,
+    liquidity: np.ndarray,
+    depeg_risk: np.ndarray,
+    current: np.ndarray,
+    mask: np.ndarray,
+    slippage_factor: float,
+    rebalancing_cost: float,
+) -> Objective:
+    """`tvl` has one value per omnipool and the other arrays one row per
+    omnipool and one column per Curve pool, masked columns being ignored."""
+    tvl = np.asarray(tvl, dtype=np.float64)[:, None]
+    liquidity = np.where(mask, liquidity, 1.0)
+    return Objective(
+        quadratic=slippage_factor * tvl**2 / liquidity,
+        linear=depeg_risk * tvl,
+        absolute=rebalancing_cost * tvl,
+        current=np.where(mask, current, 0.0),
+        mask=mask,
+    )
+
+
+def _pool_minimizers(objective: Objective, multiplier: np.ndarray) -> np.ndarray:
+    # argmin over [0, 1] of q w^2 + (c - multiplier) w + r |w - w0|
+    q, c, r, w0 = (
+        objective.quadratic,
+        objective.linear,
+        objective.absolute,
+        objective.current,
+    )
+    above = (multiplier - c - r) / (2 * q)
+    below = (multiplier - c + r) / (2 * q)
+    weights = np.where(above > w0, above, np.where(below < w0, below, w0))
+    return np.where(objective.mask, np.clip(weights, 0.0, 1.0), 0.0)
+
+
+def minimize(objective: Objective) -> np.ndarray:
+    """Float weights summing to one of every omnipool."""
+    q, c, r = objective.quadratic, objective.linear, objective.absolute
+    # the sum of the weights is 0 below `low` and at least 1 above `high`
+    low = np.where(objective.mask, c - r, np.inf).min(axis=1)
+    high = np.where(objective.mask, 2 * q + c + r, -np.inf).max(axis=1)
+    for _ in range(BISECTION_ITERATIONS):
+        middle = (low + high) / 2
+        total = _pool_minimizers(objective, middle[:, None]).sum(axis=1)
+        low = np.where(total < 1, middle, low)
+        high = np.where(total < 1, high, middle)
+    weights = _pool_minimizers(objective, high[:, None])
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def round_weights(
+    weights: Sequence[float], total: int = ONE, precision: int = 10**14
+) -> list:
+    """Integer weights summing to exactly `total`, multiples of `precision`
+    except for the largest one which takes what `precision` cannot divide.
+    Units are given to the largest remainders."""
+    weights = np.asarray(weights, dtype=np.float64)
+    units = total // precision
+    scaled = weights / weights.sum() * units
+    rounded = np.floor(scaled).astype(np.int64)
+    missing = units - int(rounded.sum())
+    for i in np.argsort(rounded - scaled, kind="stable")[:missing]:
+        rounded[i] += 1
+    result = [int(value) * precision for value in rounded]
+    result[int(np.argmax(weights))] += total - units * precision
+    return result
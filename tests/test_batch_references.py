@@ -0,0 +1,210 @@
+"""Batched and vectorized replicas checked against their scalar references
+on random inputs."""
+
+import random
+
+import pytest
+
+from support.CurvePoolV1 import CurvePool
+from support.cnc_locker import (
+    DAY,
+    GRACE_PERIOD,
+    MAX_LOCK_TIME,
+    MAX_LOCKS,
+    MIN_LOCK_AMOUNT,
+    MIN_LOCK_TIME,
+    LockerState,
+)
+from support.curve_lp_oracle import OraclePool, stableswap_quotes
+from support.curve_pool_batch import get_D_batch, get_dy_batch, get_y_batch
+from support.reward_manager import AccountRewards, EventKind, PoolRewards
+from support.weight_manager import ONE
+
+
+def random_pools(rng: random.Random, rows: int, n_coins: int = 2):
+    pools = []
+    for _ in range(rows):
+        pool = CurvePool(rng.randint(1, 5000), [10**18] * n_coins)
+        first = rng.randint(10**18, 10**27)
+        pool.balances = [first] + [
+            int(first * rng.uniform(0.01, 100)) for _ in range(n_coins - 1)
+        ]
+        pool.fee = rng.randint(0, 4 * 10**7)
+        pools.append(pool)
+    return pools
+
+
+@pytest.mark.parametrize("n_coins", [2, 3])
+def test_curve_pool_batch(n_coins):
+    rng = random.Random(n_coins)
+    pools = random_pools(rng, 300, n_coins)
+    balances = [pool.balances for pool in pools]
+    amps = [pool.A for pool in pools]
+    fees = [pool.fee for pool in pools]
+    dxs = [rng.randint(1, pool.balances[0]) for pool in pools]
+    xs = [pool._xp()[0] + dx for pool, dx in zip(pools, dxs)]
+
+    assert list(get_D_batch(balances, amps)) == [
+        pool.get_D(pool._xp(), pool.A) for pool in pools
+    ]
+    assert list(get_y_batch(0, 1, xs, balances, amps)) == [
+        pool._get_y(0, 1, x, pool._xp()) for pool, x in zip(pools, xs)
+    ]
+    assert list(get_dy_batch(0, 1, dxs, balances, amps, fees, pools[0].rates)) == [
+        pool.get_dy(0, 1, dx) for pool, dx in zip(pools, dxs)
+    ]
+
+
+def test_curve_pool_batch_zero_balances():
+    balances = [[10**24, 10**12], [10**24, 0], [0, 0]]
+    pool = CurvePool(100)
+    pool.balances = balances[0]
+    amp = pool.A
+
+    assert list(get_D_batch(balances, amp, strict=False)) == [
+        pool.get_D(pool._xp(), amp),
+        None,
+        0,
+    ]
+    assert list(get_y_batch(0, 1, [0, 10**24, 10**18], balances, amp, False)) == [
+        None,
+        None,
+        0,
+    ]
+    expected = [pool.get_dy(0, 1, 10**18), None, None]
+    assert list(get_dy_batch(0, 1, 10**18, balances, amp, strict=False)) == expected
+    quotes = stableswap_quotes(OraclePool("pool", [18, 18]), balances, amp, 0)
+    assert list(quotes[(0, 1)]) == expected
+
+    with pytest.raises(ZeroDivisionError):
+        get_D_batch(balances, amp)
+    with pytest.raises(ZeroDivisionError):
+        get_y_batch(0, 1, 0, balances[:1], amp)
+
+
+class ScalarAccount:
+    """`accountCheckpoint` of a single account, one event at a time."""
+
+    def __init__(self):
+        self.balance = 0
+        self.share = [0, 0, 0]
+        self.integral = [0, 0, 0]
+
+    def apply(self, kind: int, amount: int, integrals) -> list:
+        for key in range(3):
+            self.share[key] += (
+                self.balance * (integrals[key] - self.integral[key]) // ONE
+            )
+            self.integral[key] = integrals[key]
+        claimed = [0, 0, 0]
+        if kind == EventKind.CLAIM:
+            claimed, self.share = self.share, [0, 0, 0]
+        elif kind == EventKind.STAKE:
+            self.balance += amount
+        elif kind == EventKind.UNSTAKE:
+            self.balance -= amount
+        return claimed
+
+
+def test_account_rewards_fold():
+    rng = random.Random(0)
+    pool = PoolRewards(fee_percentage=10**17)
+    account_rewards = AccountRewards()
+    scalar = {f"account{i}": ScalarAccount() for i in range(20)}
+    holdings = [0, 0, 0]
+    total_staked = 0
+    batch: list = []
+    claimed, expected = [], []
+    for step in range(1000):
+        holdings = [holding + rng.randint(0, 10**20) for holding in holdings]
+        integrals = pool.checkpoint(tuple(holdings), total_staked)
+        account = rng.choice(list(scalar))
+        kind = rng.choice(
+            [EventKind.CHECKPOINT, EventKind.STAKE, EventKind.UNSTAKE, EventKind.CLAIM]
+        )
+        amount = 0
+        if kind == EventKind.UNSTAKE and scalar[account].balance == 0:
+            kind = EventKind.STAKE
+        if kind == EventKind.STAKE:
+            amount = rng.randint(1, 10**22)
+            total_staked += amount
+        elif kind == EventKind.UNSTAKE:
+            amount = rng.randint(1, scalar[account].balance)
+            total_staked -= amount
+        expected.append(scalar[account].apply(kind, amount, integrals))
+        batch.append((account, kind, amount, integrals))
+        # batches of random sizes, so that the state carried between folds
+        # is checked too
+        if rng.random() < 0.05 or step == 999:
+            accounts, kinds, amounts, batch_integrals = zip(*batch)
+            claimed += account_rewards.fold(
+                accounts, kinds, amounts, batch_integrals
+            ).tolist()
+            batch = []
+
+    assert claimed == expected
+    assert account_rewards.total_staked == total_staked
+    for account, reference in scalar.items():
+        row = account_rewards.accounts[account]
+        assert account_rewards.balances[row] == reference.balance
+        assert list(account_rewards.shares[row]) == reference.share
+        assert list(account_rewards.integrals[row]) == reference.integral
+
+
+def test_locker_state_at():
+    rng = random.Random(0)
+    state = LockerState()
+    users = [f"user{i}" for i in range(8)]
+    for user in users[:3]:
+        state.claim_airdrop_boost(user, rng.choice([ONE, 2 * ONE]))
+
+    now = 1_700_000_000
+    snapshots = {}
+    for _ in range(500):
+        now += rng.randint(0, 20 * DAY)
+        user = rng.choice(users)
+        locks = state.user_locks(user)
+        operation = rng.random()
+        if operation < 0.4 and len(locks) < MAX_LOCKS:
+            amount = rng.randint(MIN_LOCK_AMOUNT, 10**22)
+            lock_time = rng.randint(MIN_LOCK_TIME, MAX_LOCK_TIME)
+            state.lock(now, user, amount, lock_time)
+        elif operation < 0.55 and locks:
+            lock_ids = [
+                lock.id for lock in locks if lock.unlock_time < now + MAX_LOCK_TIME
+            ]
+            state.relock(now, user, lock_ids, MAX_LOCK_TIME)
+        elif operation < 0.75:
+            state.execute_available_unlocks(now, user)
+        elif operation < 0.9:
+            expired = [lock.id for lock in locks if lock.unlock_time <= now]
+            state.execute_unlocks(now, user, expired)
+        else:
+            for lock in locks:
+                if lock.unlock_time + GRACE_PERIOD <= now:
+                    state.kick(now, user, lock.id)
+                    break
+
+        # views of every user after the last operation at `now`
+        snapshots[now] = {
+            user: (
+                state.locked_balance[user],
+                state.locked_boosted[user],
+                sum(
+                    lock.amount * lock.boost // ONE
+                    for lock in state.user_locks(user)
+                    if lock.unlock_time > now
+                ),
+            )
+            for user in users
+        }
+
+    timestamps = sorted(snapshots)
+    balances = state.at(timestamps)
+    for row, timestamp in enumerate(timestamps):
+        for user, column in state.users.items():
+            assert (
+                balances.locked_balance[row, column],
+                balances.locked_boosted[row, column],
+                balances.rewards_boost[row, column],
+            ) == snapshots[timestamp][user]
@@ -0,0 +1,39 @@
+import json
+import os
+
+from support.block_index import BlockIndex
+
+
+def write_blocks(output_file: str, blocks, mode: str = "a"):
+    with open(output_file, mode) as f:
+        for block in blocks:
+            f.write(json.dumps({"block": block}) + "\n")
+
+
+def test_resume_after_append(tmp_path):
+    blocks = range(100, 200, 5)
+    output_file = str(tmp_path / "out.json")
+    write_blocks(output_file, blocks[:5])
+    BlockIndex.load(blocks, output_file).save()
+
+    write_blocks(output_file, blocks[5:8])
+    index = BlockIndex.load(blocks, output_file)
+    assert len(index) == 8
+    assert index.last_contiguous_block() == blocks[7]
+
+
+def test_rebuilt_when_output_shrinks(tmp_path):
+    blocks = range(100, 200, 5)
+    output_file = str(tmp_path / "out.json")
+    write_blocks(output_file, blocks[:10])
+    BlockIndex.load(blocks, output_file).save()
+
+    # rewritten with fewer blocks, the saved offset is past its end
+    write_blocks(output_file, blocks[:3], mode="w")
+    index = BlockIndex.load(blocks, output_file)
+    assert [block for block in blocks if block in index] == list(blocks[:3])
+    assert index.offset == os.path.getsize(output_file)
+
+    os.remove(output_file)
+    index = BlockIndex.load(blocks, output_file)
+    assert len(index) == 0 and index.offset == 0
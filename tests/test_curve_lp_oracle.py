@@ -0,0 +1,19 @@
+from support.curve_lp_oracle import OraclePool, get_usd_prices
+
+ONE = 10**18
+
+
+def test_revert_reasons():
+    pool = OraclePool("pool", [18, 18])
+    balances = [[ONE, ONE], [ONE, 0], [ONE, ONE], [ONE, ONE]]
+    prices = [[ONE, ONE]] * 4
+    quotes = {(0, 1): [ONE, ONE, ONE // 2, None]}
+    result = get_usd_prices(pool, balances, prices, ONE, 4 * 10**6, quotes)
+    assert list(result.prices) == [2 * ONE, 0, 0, 0]
+    assert list(result.reverted) == [False, True, True, True]
+    assert list(result.reasons) == [
+        None,
+        "balance is 0",
+        "NotWithinThreshold(pool, 0, 1)",
+        "get_dy(0, 1) reverted in pool",
+    ]
@@ -0,0 +1,61 @@
+"""`CurvePool` optimizations checked against a pool computing everything from
+scratch on random inputs."""
+
+import random
+
+from support.CurvePoolV1 import CurvePool
+
+
+def random_balances(rng: random.Random, n_coins: int = 2):
+    first = rng.randint(10**18, 10**27)
+    return [first] + [int(first * rng.uniform(0.01, 100)) for _ in range(n_coins - 1)]
+
+
+def test_d_cache():
+    rng = random.Random(0)
+    cold = CurvePool(100, d_cache_size=0)
+    cached = CurvePool(100, d_cache_size=8)
+    states = [random_balances(rng) for _ in range(20)]
+    for _ in range(200):
+        # states are revisited, so that the cache is hit and evicts entries
+        balances = rng.choice(states)
+        dx = rng.randint(1, balances[0])
+        cold.balances = cached.balances = balances
+        assert cached.get_D(cached._xp(), cached.A) == cold.get_D(cold._xp(), cold.A)
+        assert cached.get_dy(0, 1, dx) == cold.get_dy(0, 1, dx)
+    assert cached.d_cache_stats.hits > 0
+    assert len(cached._d_cache) == 8
+
+
+def test_warm_start():
+    rng = random.Random(0)
+    cold = CurvePool(200, d_cache_size=0)
+    warm = CurvePool(200, d_cache_size=0, warm_start=True)
+    balances = random_balances(rng)
+    for _ in range(200):
+        # small moves, within the range where the last D is used
+        balances = [int(balance * rng.uniform(0.998, 1.002)) for balance in balances]
+        cold.balances = warm.balances = balances
+        D_cold = cold.get_D(cold._xp(), cold.A)
+        D_warm = warm.get_D(warm._xp(), warm.A)
+        # warm starts can converge to a value 1 wei away
+        assert abs(D_warm - D_cold) <= 1
+    assert warm.d_cache_stats.warm_starts > 0
+
+
+def test_get_dy_curve():
+    rng = random.Random(0)
+    for n_coins in (2, 3):
+        for _ in range(30):
+            pool = CurvePool(rng.randint(1, 5000), [10**18] * n_coins)
+            pool.balances = random_balances(rng, n_coins)
+            pool.fee = rng.randint(0, 4 * 10**7)
+            i, j = rng.sample(range(n_coins), 2)
+            # growing sizes reuse the last y, others start again from D
+            sizes = sorted(rng.randint(1, pool.balances[i]) for _ in range(10))
+            sizes += [rng.randint(1, pool.balances[i]) for _ in range(5)]
+            quotes = pool.get_dy_curve(i, j, sizes)
+            assert [quote.dx for quote in quotes] == sizes
+            assert [quote.dy for quote in quotes] == [
+                pool.get_dy(i, j, dx) for dx in sizes
+            ]
@@ -0,0 +1,42 @@
+"""Segments of `fetch_deviations` resumed with a different number of shards."""
+
+import json
+
+from support.block_index import BlockIndex
+from support.deviation_segments import read_lines, seed_segment, segment_path
+
+
+def fetch_segment(blocks: range, segments_dir, legacy_file, fetched, limit=None):
+    """`fetch_deviations.main` for one shard, interrupted after `limit` blocks
+    are fetched."""
+    output_file = segment_path(segments_dir, blocks)
+    seed_segment(blocks, output_file, legacy_file)
+    index = BlockIndex.load(blocks, output_file)
+    with open(output_file, "a") as f:
+        for block in blocks:
+            if block in index:
+                continue
+            if len(fetched) == limit:
+                break
+            fetched.append(block)
+            f.write(json.dumps({"block": block, "deviations": {}}) + "\n")
+            f.flush()
+            index.add(block, f.tell())
+    index.save()
+    return output_file
+
+
+def test_reshard_fetches_every_block_once(tmp_path):
+    blocks = range(1000, 5000, 10)
+    legacy_file = str(tmp_path / "deviations.json")
+    with open(legacy_file, "w") as f:
+        for block in blocks[:30]:
+            f.write(json.dumps({"block": block, "deviations": {}}) + "\n")
+
+    fetched: list = []
+    fetch_segment(blocks, str(tmp_path), legacy_file, fetched, limit=250)
+    for shard in (blocks[:200], blocks[200:]):
+        output_file = fetch_segment(shard, str(tmp_path), legacy_file, fetched)
+        assert sorted(block for block, _ in read_lines(output_file)) == list(shard)
+
+    assert sorted(fetched) == list(blocks[30:])
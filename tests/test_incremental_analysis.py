@@ -0,0 +1,52 @@
+"""`IncrementalAnalysis` folds checked against a single pass over the
+deduplicated blocks on random inputs."""
+
+import json
+import random
+
+from support.incremental_analysis import IncrementalAnalysis
+from support.quantile_sketch import TDigest
+
+
+def write_lines(filename, items):
+    with open(filename, "a") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+
+
+def test_overlapping_segments_are_folded_once(tmp_path):
+    rng = random.Random(0)
+    items = [
+        {
+            "block": block,
+            "deviations": {
+                pool: [rng.expovariate(1) for _ in range(2)] for pool in ("a", "b")
+            },
+        }
+        for block in range(0, 1000, 4)
+    ]
+    single_pass = {}
+    for item in items:
+        for pool, deviations in item["deviations"].items():
+            for i, deviation in enumerate(deviations):
+                single_pass.setdefault((pool, i), TDigest()).add(deviation)
+
+    # a segment re-sharded in two, the first half being fetched again
+    whole, half = tmp_path / "0-1000.json", tmp_path / "0-500.json"
+    write_lines(whole, items[:200])
+    write_lines(half, items[:125])
+    state = str(tmp_path / "state.json")
+    analysis = IncrementalAnalysis()
+    assert analysis.update([whole, half]) == 200
+    analysis.save(state)
+
+    write_lines(whole, items[200:])
+    analysis = IncrementalAnalysis.load(state)
+    assert analysis.update([whole, half]) == len(items) - 200
+    assert analysis.last_block == items[-1]["block"]
+
+    assert analysis.sketches.keys() == single_pass.keys()
+    for series, sketch in single_pass.items():
+        assert len(analysis.sketches[series]) == len(items)
+        for q in (0.5, 0.99, 0.998, 0.999):
+            assert analysis.sketches[series].quantile(q) == sketch.quantile(q)
@@ -0,0 +1,150 @@
+from eth_abi import decode_abi, encode_abi
+from eth_utils import function_signature_to_4byte_selector
+
+from support.async_fetcher import TokenBucket
+from support.multicall import AGGREGATE3_SELECTOR, MULTICALL3_ADDRESS, Multicall
+from support.rpc_cache import RpcCache
+
+ADDER = "0x" + "11" * 20
+REVERTER = "0x" + "22" * 20
+NO_CODE = "0x" + "33" * 20
+
+
+class Method:
+    """The part of a brownie contract method used by `Multicall.add`."""
+
+    def __init__(self, address: str, signature: str, inputs: list, output: str):
+        self._address = address
+        self.selector = function_signature_to_4byte_selector(signature)
+        self.inputs = inputs
+        self.output = output
+
+    def encode_input(self, *args) -> str:
+        return "0x" + (self.selector + encode_abi(self.inputs, args)).hex()
+
+    def decode_output(self, data: bytes):
+        (value,) = decode_abi([self.output], data)
+        return value
+
+
+class Eth:
+    """Stand-in for the JSON-RPC node: executes `aggregate3` eth_calls
+    against an adder contract, a contract that always reverts and an
+    address without code."""
+
+    def __init__(self):
+        self.calls: list = []
+
+    def call(self, transaction: dict, block):
+        assert transaction["to"] == MULTICALL3_ADDRESS
+        data = bytes.fromhex(transaction["data"][2:])
+        assert data[:4] == AGGREGATE3_SELECTOR
+        (calls,) = decode_abi(["(address,bool,bytes)[]"], data[4:])
+        self.calls.append((block, calls))
+
+        results = []
+        for target, allow_failure, calldata in calls:
+            assert allow_failure
+            if target == ADDER:
+                a, b = decode_abi(["uint256", "uint256"], calldata[4:])
+                results.append((True, encode_abi(["uint256"], [a + b])))
+            elif target == REVERTER:
+                results.append((False, b""))
+            else:
+                results.append((True, b""))
+        return encode_abi(["(bool,bytes)[]"], [results])
+
+
+class Web3:
+    def __init__(self):
+        self.eth = Eth()
+
+
+def add(address: str) -> Method:
+    return Method(address, "add(uint256,uint256)", ["uint256", "uint256"], "uint256")
+
+
+def test_execute_in_batches():
+    web3 = Web3()
+    multicall = Multicall(web3, max_calls=2)
+    for i in range(5):
+        multicall.add(add(ADDER), i, 10)
+    assert len(multicall) == 5
+    assert multicall.execute(100) == [10, 11, 12, 13, 14]
+    assert multicall.requests == 3
+    assert [len(calls) for _, calls in web3.eth.calls] == [2, 2, 1]
+    assert len(multicall) == 0
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(rate=1e6)
+        self.acquired = 0
+
+    def acquire(self) -> None:
+        super().acquire()
+        self.acquired += 1
+
+
+def test_rate_limited_per_request(tmp_path):
+    bucket = CountingBucket()
+    cache = RpcCache(1, str(tmp_path / "rpc-cache.sqlite"))
+    multicall = Multicall(Web3(), max_calls=2, cache=cache, rate_limiter=bucket)
+    for i in range(5):
+        multicall.add(add(ADDER), i, 10)
+    multicall.execute(100)
+    assert bucket.acquired == multicall.requests == 3
+
+    # cached results take no token
+    for i in range(6):
+        multicall.add(add(ADDER), i, 10)
+    multicall.execute(100)
+    assert bucket.acquired == multicall.requests == 4
+    cache.close()
+
+
+def test_failed_calls_are_none():
+    multicall = Multicall(Web3())
+    multicall.add(add(ADDER), 1, 2)
+    multicall.add(add(REVERTER), 1, 2)
+    multicall.add(add(NO_CODE), 1, 2)
+    assert multicall.execute(0) == [3, None, None]
+
+
+def test_cache_round_trip(tmp_path):
+    web3 = Web3()
+    cache = RpcCache(1, str(tmp_path / "rpc-cache.sqlite"))
+    multicall = Multicall(web3, cache=cache)
+
+    multicall.add(add(ADDER), 1, 2)
+    multicall.add(add(REVERTER), 1, 2)
+    assert multicall.execute(100) == [3, None]
+    assert multicall.requests == 1
+
+    # only the new call is sent
+    multicall.add(add(ADDER), 1, 2)
+    multicall.add(add(ADDER), 3, 4)
+    assert multicall.execute(100) == [3, 7]
+    assert multicall.requests == 2
+    assert len(web3.eth.calls[-1][1]) == 1
+
+    # results of other blocks and of "latest" are not served from the cache
+    multicall.add(add(ADDER), 1, 2)
+    assert multicall.execute(101) == [3]
+    multicall.add(add(ADDER), 1, 2)
+    assert multicall.execute("latest") == [3]
+    assert multicall.requests == 4
+
+    cache.close()
+    cache = RpcCache(1, str(tmp_path / "rpc-cache.sqlite"))
+    multicall = Multicall(Web3(), cache=cache)
+    multicall.add(add(ADDER), 3, 4)
+    assert multicall.execute(100) == [7]
+    assert multicall.requests == 0
+
+    # failed calls are sent again
+    multicall.add(add(ADDER), 3, 4)
+    multicall.add(add(REVERTER), 1, 2)
+    assert multicall.execute(100) == [7, None]
+    assert multicall.requests == 1
+    assert cache.hits == 2
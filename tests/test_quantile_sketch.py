@@ -0,0 +1,24 @@
+"""`TDigest` quantiles checked against the exact computation of
+`analyze_deviations` on random inputs."""
+
+import random
+
+import numpy as np
+import pytest
+
+from scripts.analyze_deviations import quantile
+from support.quantile_sketch import TDigest
+
+
+@pytest.mark.parametrize("size", [2, 3, 10, 50, 300])
+def test_single_value_centroids_are_exact(size):
+    rng = random.Random(size)
+    values = [rng.expovariate(1) for _ in range(size)]
+    digest = TDigest()
+    digest.update(values)
+    values.sort()
+    # tails included, where the exclusive method extrapolates
+    for i in (1, 10, 500, 990, 998, 999):
+        assert digest.quantile(i / 1000) == pytest.approx(
+            quantile(np.asarray(values), i, 1000), rel=1e-12, abs=1e-12
+        )
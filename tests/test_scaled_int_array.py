@@ -0,0 +1,52 @@
+"""`ScaledIntArray` checked element-wise against `ScaledInt` on random
+inputs."""
+
+import operator
+import random
+
+from support.scaled_int import ScaledInt
+from support.scaled_int_array import ScaledIntArray
+
+
+def random_values(rng: random.Random, size: int):
+    # negative values too, for the rounding of floor divisions
+    return [rng.choice([1, -1]) * rng.randint(1, 10**24) for _ in range(size)]
+
+
+def scalars(array: ScaledIntArray):
+    return [(value.value, value.decimals) for value in array]
+
+
+def test_element_wise_like_scaled_int():
+    rng = random.Random(0)
+    for decimals in (6, 18):
+        a = ScaledIntArray(random_values(rng, 50), decimals)
+        b = ScaledIntArray(random_values(rng, 50), decimals)
+        scalar = ScaledInt(rng.randint(1, 10**24), decimals)
+        factor = rng.randint(1, 1000)
+
+        for op in (operator.add, operator.sub, operator.mul, operator.truediv):
+            assert scalars(op(a, b)) == [
+                (op(x, y).value, decimals) for x, y in zip(a, b)
+            ]
+            assert scalars(op(a, scalar)) == [
+                (op(x, scalar).value, decimals) for x in a
+            ]
+        for op in (operator.mul, operator.truediv):
+            assert scalars(op(a, factor)) == [
+                (op(x, factor).value, decimals) for x in a
+            ]
+        assert scalars(factor * a) == [((factor * x).value, decimals) for x in a]
+        assert scalars(-a) == [((-x).value, decimals) for x in a]
+        assert scalars(abs(a)) == [(abs(x).value, decimals) for x in a]
+        assert scalars(abs(a) ** 3) == [((abs(x) ** 3).value, decimals) for x in a]
+        assert scalars(abs(a).sqrt()) == [(abs(x).sqrt().value, decimals) for x in a]
+        assert scalars(a.downscale(4)) == [(x.downscale(4).value, 4) for x in a]
+        assert scalars(a.upscale(24)) == [(x.upscale(24).value, 24) for x in a]
+        assert list(a.to_float()) == [x.to_float() for x in a]
+
+        for op in (operator.lt, operator.le, operator.gt, operator.ge, operator.eq):
+            assert list(op(a, b)) == [op(x, y) for x, y in zip(a, b)]
+            assert list(op(a, scalar)) == [op(x, scalar) for x in a]
+            assert list(op(a, 3)) == [op(x, 3) for x in a]
+        assert list(a == a[::-1]) == [x == y for x, y in zip(a, a[::-1])]
@@ -0,0 +1,38 @@
+"""`get_v1_lp_token_prices` checked against the Decimal pricer on random
+inputs."""
+
+import random
+from decimal import Decimal
+
+from support.token_pricing_batch import get_v1_lp_token_prices
+from support.token_pricing_reference import A_PREC, get_v1_lp_token_price
+
+
+def test_get_v1_lp_token_prices():
+    rng = random.Random(0)
+    rows = []
+    for _ in range(300):
+        D = int(10 ** rng.uniform(20, 27))
+        total_supply = int(D * rng.uniform(0.9, 1.1))
+        A_precise = (int(10 ** rng.uniform(0, 4)) + 1) * A_PREC
+        price_a = round(10 ** rng.uniform(-1, 1), 8)
+        price_b = round(10 ** rng.uniform(-1, 1), 8)
+        rows.append((D, total_supply, A_precise, price_a, price_b))
+    expected = [
+        float(get_v1_lp_token_price(*(Decimal(value) for value in row))) for row in rows
+    ]
+    thresholds = [expected[0], expected[1]]
+
+    prices, rechecked = get_v1_lp_token_prices(*zip(*rows), thresholds=thresholds)
+
+    # rows close to a threshold are re-priced with Decimal, the others agree
+    # with it to float64 rounding
+    assert {0, 1} <= set(rechecked)
+    for i in rechecked:
+        assert prices[i] == expected[i]
+    for price, reference in zip(prices, expected):
+        assert abs(price - reference) <= 1e-12 * reference
+
+    # the float64 iteration prices almost all rows without falling back
+    _, rechecked = get_v1_lp_token_prices(*zip(*rows))
+    assert len(rechecked) <= len(rows) // 100
@@ -0,0 +1,45 @@
+import random
+from decimal import Decimal
+
+from support.token_pricing_reference import (
+    MAX_ITERATIONS,
+    YFromDSolver,
+    calc_y_from_D,
+)
+
+
+def test_y_from_d_solver_matches_calc_y_from_d():
+    rng = random.Random(0)
+    # calc_y_from_D stops once x moves by less than 0.001, so its own error
+    # is below this for D >= 1e6
+    tolerance = Decimal("1e-10")
+    for _ in range(300):
+        D = Decimal(int(10 ** rng.uniform(6, 12)))
+        A = Decimal(int(10 ** rng.uniform(2, 6)))
+        price = Decimal(str(round(10 ** rng.uniform(-0.3, 0.3), 8)))
+        solver = YFromDSolver(D, A)
+        expected = calc_y_from_D(D, A, price)
+        x, _ = solver.solve(price, tolerance)
+        assert abs(x - expected) <= tolerance * expected
+        _, iterations = solver.solve(price)
+        assert iterations <= 10
+
+    # converges onto an end of the bracket, the last step must not be bisected
+    _, iterations = YFromDSolver(Decimal(8629530), Decimal(104)).solve(
+        Decimal("1.84484847")
+    )
+    assert iterations <= 10
+
+
+def test_y_from_d_solver_wide_inputs():
+    rng = random.Random(0)
+    for _ in range(300):
+        D = Decimal(int(10 ** rng.uniform(2, 27)))
+        A = Decimal(int(10 ** rng.uniform(0, 6)) + 1)
+        price = Decimal(str(round(10 ** rng.uniform(-2, 2), 8)))
+        solver = YFromDSolver(D, A)
+        x, iterations = solver.solve(price)
+        assert iterations < MAX_ITERATIONS
+        assert 0 < x and 0 < solver.y(x)
+        if price >= 1:
+            assert x <= D